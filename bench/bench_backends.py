@@ -0,0 +1,153 @@
+"""
+保存先（バックエンド）ごとの打刻ベンチマーク（Drive・スプレッドシートはローカルの代替を使用）
+
+    python -m bench.bench_backends --backends drive local sheets --existing-rows 0 2000 --writers 4 --punches 10 --latency 0.05
+
+保存先ごとに、既に existing-rows 行ある当日分へ writers 人が同時に punches 回ずつ打刻し、
+1打刻あたりの所要時間・リクエスト数・通信量と、1年分の読み込み時間、消えた行・重複した行を
+JSON Lines で出力する（--output でファイルにも追記）。消えた行・重複した行があれば終了コード 1。
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bench.bench_punch import percentile, use_temp_local_state
+from bench.fake_drive import FakeDrive
+from bench.fake_sheets import FakeSheets
+
+FOLDER_ID = "bench-folder"
+TOKEN = "bench-token"
+SPREADSHEET_ID = "bench-spreadsheet"
+
+
+def existing_rows(rows, now):
+    import logicMod
+    start = now.replace(hour=0, minute=0, second=0)
+    return [
+        {
+            "名前": f"staff{i % 12}",
+            "モード": "出勤" if i % 2 == 0 else "退勤",
+            "時刻": (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+            logicMod.PUNCH_ID_COLUMN: f"seed{i:08d}",
+        }
+        for i in range(rows)
+    ]
+
+
+def run_case(name, rows, writers, punches, latency, workdir):
+    import logicMod
+    from utils.backend_utils import create_backend, use_punch_backend
+
+    now = datetime.now()
+    year = now.strftime("%Y")
+    filename = logicMod.get_shard_filename(f"{year}_timecard.csv", now.strftime("%Y-%m-%d %H:%M:%S"))
+    settings = {"local": {"path": f"{workdir}/{name}-{rows}"}, "sheets": {"spreadsheet_id": SPREADSHEET_ID}}
+    backend = create_backend(name, **settings.get(name, {}))
+    use_punch_backend(backend)
+    logicMod._recent_writes.clear()
+    # 🗜 計測中にシャード統合を走らせない
+    logicMod._last_compaction[(FOLDER_ID, year)] = now.strftime("%Y-%m-%d")
+
+    with FakeDrive(latency=latency, seed=0) as drive, FakeSheets(latency=latency) as sheets:
+        sheets.create_spreadsheet(SPREADSHEET_ID)
+        if rows:
+            backend.append_rows(TOKEN, FOLDER_ID, filename, existing_rows(rows, now))
+        drive.reset_stats()
+        sheets.reset_stats()
+
+        expected, latencies, errors = [], [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(writers)
+
+        def writer(w):
+            barrier.wait()
+            for i in range(punches):
+                _, _, record = logicMod.generate_punch_record(f"writer{w}", "出勤" if i % 2 == 0 else "退勤")
+                start = time.perf_counter()
+                try:
+                    backend.append_rows(TOKEN, FOLDER_ID, filename, [record])
+                except Exception as e:
+                    errors.append(str(e))
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    expected.append(record[logicMod.PUNCH_ID_COLUMN])
+
+        threads = [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        logicMod.verify_recent_writes(TOKEN)
+        write_stats = [drive.stats(), sheets.stats()]
+
+        drive.reset_stats()
+        sheets.reset_stats()
+        started = time.perf_counter()
+        year_df = logicMod.load_timecard_year(TOKEN, year, FOLDER_ID)
+        load_ms = (time.perf_counter() - started) * 1000
+        read_stats = [drive.stats(), sheets.stats()]
+
+    ids = year_df[logicMod.PUNCH_ID_COLUMN].tolist()
+    total = writers * punches
+    return {
+        "benchmark": "backends",
+        "backend": name,
+        "existing_rows": rows,
+        "writers": writers,
+        "punches_per_writer": punches,
+        "injected_latency_s": latency,
+        "elapsed_s": round(elapsed, 3),
+        "punches_per_s": round(total / elapsed, 2),
+        "latency_p50_ms": round(percentile(latencies, 50), 2),
+        "latency_p95_ms": round(percentile(latencies, 95), 2),
+        "requests_per_punch": round(sum(s["requests"] for s in write_stats) / total, 2),
+        "bytes_per_punch": round(sum(s["bytes_sent"] + s["bytes_received"] for s in write_stats) / total),
+        "load_year_ms": round(load_ms, 2),
+        "load_year_bytes": sum(s["bytes_received"] for s in read_stats),
+        "lost_rows": len(set(expected) - set(ids)),
+        "duplicate_rows": len(ids) - len(set(ids)),
+        "errors": errors,
+        "python": platform.python_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存先ごとの打刻ベンチマーク")
+    parser.add_argument("--backends", nargs="+", default=["drive", "local", "sheets"])
+    parser.add_argument("--existing-rows", type=int, nargs="+", default=[0, 2000])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--punches", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="1リクエストあたりの注入遅延（秒）")
+    parser.add_argument("--output", help="結果を追記する JSON Lines ファイル")
+    args = parser.parse_args(argv)
+
+    # 🔇 Streamlit の「ScriptRunContext がない」警告を抑止
+    logging.disable(logging.WARNING)
+    use_temp_local_state()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.backends:
+            for rows in args.existing_rows:
+                result = run_case(name, rows, args.writers, args.punches, args.latency, workdir)
+                results.append(result)
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return all(r["lost_rows"] == 0 and r["duplicate_rows"] == 0 and not r["errors"] for r in results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,133 @@
+"""
+同時打刻のベンチマーク（ローカルの Drive 代替を使用）
+
+    python -m bench.bench_concurrency --writers 8 --punches 5 --latency 0.05
+
+複数の書き込み手が同じ日別ファイルへ同時に打刻し、最後にファイルの中身を突き合わせて
+消えた行・重複した行・競合による再試行回数を JSON Lines で出力する（--output でファイルにも追記）。
+消えた行が1件でもあれば終了コード 1。
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+
+from bench.bench_punch import use_temp_local_state
+from bench.fake_drive import FakeDrive
+from utils.retry_utils import reset_retry_state, retry_stats
+
+FOLDER_ID = "bench-folder"
+TOKEN = "bench-token"
+
+
+def run_case(writers, punches, latency, max_version_step=1):
+    import logicMod
+
+    year = datetime.now().strftime("%Y")
+    filename = logicMod.get_shard_filename(f"{year}_timecard.csv", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    expected = []
+    errors = []
+    barrier = threading.Barrier(writers)
+
+    def writer(w):
+        service = logicMod.get_drive_service(TOKEN)
+        barrier.wait()
+        for i in range(punches):
+            # 🏷 名前に書き込み手と連番を入れて、1行ずつ見分けられるようにする
+            row = {"名前": f"writer{w}-{i}", "モード": "出勤", "時刻": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+            expected.append(row["名前"])
+            try:
+                logicMod.append_csv_to_drive(service, filename, logicMod.punch_rows_to_csv([row]), FOLDER_ID)
+            except Exception as e:
+                errors.append(str(e))
+
+    for key in logicMod._write_stats:
+        logicMod._write_stats[key] = 0
+    logicMod._recent_writes.clear()
+    reset_retry_state()
+
+    # 🔎 送信ワーカーと同じく、書き込みの事後確認を定期的に走らせる
+    stop = threading.Event()
+
+    def verifier():
+        while not stop.wait(logicMod.WRITE_SETTLE_SECONDS):
+            logicMod.verify_recent_writes(TOKEN)
+
+    with FakeDrive(latency=latency, seed=0, max_version_step=max_version_step) as drive:
+        threads = [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+        checker = threading.Thread(target=verifier)
+        start = time.perf_counter()
+        checker.start()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        # ⏳ 最後の書き込みの確認が済むまで待つ
+        time.sleep(logicMod.WRITE_SETTLE_SECONDS * 2)
+        stop.set()
+        checker.join()
+        logicMod.verify_recent_writes(TOKEN)
+
+        copies = [f for f in drive.files.values() if f["name"] == filename and not f["trashed"]]
+        content = drive.read_file(filename, FOLDER_ID) or "名前,モード,時刻\n".encode("utf-8")
+        stats = drive.stats()
+
+    names = pd.read_csv(BytesIO(content))["名前"].tolist()
+    total = writers * punches
+    return {
+        "benchmark": "concurrency",
+        "writers": writers,
+        "punches_per_writer": punches,
+        "injected_latency_s": latency,
+        "max_version_step": max_version_step,
+        "elapsed_s": round(elapsed, 3),
+        "punches_per_s": round(total / elapsed, 2),
+        "lost_rows": len(set(expected) - set(names)),
+        "duplicate_rows": len(names) - len(set(names)),
+        "file_copies": len(copies),
+        "errors": errors,
+        "requests_per_punch": round(stats["requests"] / total, 2),
+        "write_stats": dict(logicMod._write_stats),
+        "retry_stats": retry_stats(),
+        "python": platform.python_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="同時打刻のベンチマーク")
+    parser.add_argument("--writers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--punches", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="Drive 1リクエストあたりの注入遅延（秒）")
+    parser.add_argument("--max-version-step", type=int, default=3, help="Drive の version が1回の更新で進む最大値")
+    parser.add_argument("--output", help="結果を追記する JSON Lines ファイル")
+    args = parser.parse_args(argv)
+
+    # 🔇 Streamlit の「ScriptRunContext がない」警告を抑止
+    logging.disable(logging.WARNING)
+    use_temp_local_state()
+
+    results = []
+    for writers in args.writers:
+        result = run_case(writers, args.punches, args.latency, args.max_version_step)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return all(r["lost_rows"] == 0 and r["file_copies"] == 1 for r in results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
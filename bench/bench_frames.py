@@ -0,0 +1,90 @@
+"""
+タイムカードCSVの読み込み・追記のベンチマーク（Drive 通信なし）
+
+    python -m bench.bench_frames --rows 100000 --repeat 5
+
+1年分相当のCSVについて
+  - 読み込み: 素の pd.read_csv（全列が文字列）と、型付きの read_timecard_csv
+  - 追記: DataFrame を結合して全体を to_csv し直す方式と、バイト列の末尾に足す方式
+の所要時間とメモリ使用量を JSON Lines で出力する（--output でファイルにも追記）。
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+
+from bench.bench_punch import make_year_csv, use_temp_local_state
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return round(statistics.median(times) * 1000, 2), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="タイムカードCSVの読み込み・追記のベンチマーク")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="結果を追記する JSON Lines ファイル")
+    args = parser.parse_args(argv)
+
+    # 🔇 Streamlit の「ScriptRunContext がない」警告を抑止
+    logging.disable(logging.WARNING)
+    use_temp_local_state()
+    import logicMod
+    from utils.csv_utils import append_csv_bytes, read_csv_as_text, csv_engine
+
+    results = []
+    for rows in args.rows:
+        data = make_year_csv(rows, datetime.now().year)
+        new_df = read_csv_as_text(logicMod.punch_rows_to_csv([
+            {"名前": "staff0", "モード": "出勤", "時刻": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        ]))
+
+        plain_ms, plain_df = measure(lambda: pd.read_csv(BytesIO(data)), args.repeat)
+        typed_ms, typed_df = measure(lambda: logicMod.read_timecard_csv(data), args.repeat)
+        rewrite_ms, _ = measure(
+            lambda: pd.concat([pd.read_csv(BytesIO(data)), new_df], ignore_index=True).to_csv(index=False).encode("utf-8"),
+            args.repeat
+        )
+        append_ms, _ = measure(lambda: append_csv_bytes(data, new_df), args.repeat)
+
+        result = {
+            "benchmark": "frames",
+            "rows": rows,
+            "csv_bytes": len(data),
+            "engine": csv_engine(),
+            "parse_plain_ms": plain_ms,
+            "parse_typed_ms": typed_ms,
+            "memory_plain_bytes": int(plain_df.memory_usage(deep=True).sum()),
+            "memory_typed_bytes": int(typed_df.memory_usage(deep=True).sum()),
+            "dtypes_typed": {column: str(dtype) for column, dtype in typed_df.dtypes.items()},
+            "append_rewrite_ms": rewrite_ms,
+            "append_bytes_ms": append_ms,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        }
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,336 @@
+"""
+複数セッションの同時打刻の負荷試験（ローカルの Drive 代替を使用）
+
+    python -m bench.bench_load --sessions 1 5 20 --punches 5 --latency 0.05
+
+1セッション = 1台の打刻端末。--mode apptest（既定）は Streamlit の AppTest で main.py を実際に動かし、
+スタッフ名を入力して「✅ 出勤」を押す操作を各セッションが同時に繰り返す。--mode direct は画面を通さず
+record_punch_async を直接呼ぶ。全セッションの打刻後、送信ワーカーが Drive へ送り終えるのを待ってから
+Drive 上の CSV を突き合わせ、次を JSON Lines で出力する（--output でファイルにも追記）。
+
+  - 打刻のスループット（画面に結果が出るまで / Drive に届くまで）
+  - 1打刻の応答時間の p50 / p95 / p99
+  - 消えた行・重複した行
+  - 1打刻あたりの Drive リクエスト数（種類別）
+
+消えた行・重複した行・エラーが1件でもあれば終了コード 1。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import pandas as pd
+
+from bench.bench_punch import percentile
+from bench.fake_drive import FakeDrive
+from utils.retry_utils import reset_retry_state, retry_stats
+
+TOKEN = "bench-token"
+# 🔁 送信後、全セッションそろって事後確認を回す回数（他の端末が重複ファイルを統合して消した行も、次の回で書き戻される）
+VERIFY_ROUNDS = 3
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+# 🧾 main.py が読む st.secrets（Drive 代替を使うので値はダミー）
+SECRETS = {
+    "web": {
+        "client_id": "bench-client",
+        "client_secret": "bench-secret",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "redirect_uri": "http://localhost:8501",
+    }
+}
+
+
+def _main_folder_id():
+    # 📁 main.py に書かれているフォルダ（AppTest の打刻はそこへ入る）
+    with open(MAIN_SCRIPT, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("folder_id = "):
+                return line.split("=", 1)[1].strip().strip('"')
+    raise RuntimeError("main.py に folder_id が見つかりません")
+
+
+# 🖥 AppTest で main.py を動かす1セッション
+class AppTestSession:
+    def __init__(self, timeout):
+        from pytz import timezone
+        from streamlit.testing.v1 import AppTest
+        self.app = AppTest.from_file(MAIN_SCRIPT, default_timeout=timeout)
+        for key, value in SECRETS.items():
+            self.app.secrets[key] = value
+        self.app.session_state["access_token"] = TOKEN
+        self.app.session_state["expires_at"] = datetime.now(timezone("Asia/Tokyo")) + timedelta(hours=1)
+        self.app.run()
+        self._raise_on_exception()
+
+    def punch(self, name):
+        self.app.text_input[0].set_value(name)
+        self.app.button[0].click()
+        self.app.run()
+        self._raise_on_exception()
+        if not any(name in element.value for element in self.app.success):
+            raise RuntimeError(f"{name} の打刻結果が表示されませんでした")
+
+    def _raise_on_exception(self):
+        if self.app.exception:
+            raise RuntimeError(self.app.exception[0].message)
+
+
+# ⚙️ 画面を通さずに打刻処理だけを呼ぶ1セッション
+class DirectSession:
+    def __init__(self, folder_id):
+        self.folder_id = folder_id
+
+    def punch(self, name):
+        import logicMod
+        timestamp, success, _ = logicMod.record_punch_async(name, "出勤", TOKEN, self.folder_id)
+        if not success:
+            raise RuntimeError(f"{name} の打刻に失敗しました")
+
+
+def _drive_punch_names(files, folder_id):
+    names = []
+    for f in files:
+        if f["trashed"] or folder_id not in f["parents"] or "_timecard" not in f["name"] or not f["name"].endswith(".csv"):
+            continue
+        names += pd.read_csv(BytesIO(f["content"]), dtype=str)["名前"].tolist()
+    return names
+
+
+# 🗄 空のローカルDB・キャッシュから始める（プロセスごと。打刻端末ごとに手元のDBを持つのと同じ）
+def _reset_local_state():
+    import logicMod
+    import utils.drive_utils as drive_utils
+    import utils.store_utils as store_utils
+
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    store_utils.STORE_PATH = os.path.join(workdir, "timecard.sqlite3")
+    drive_utils.CACHE_DIR = os.path.join(workdir, "drive_cache")
+    with drive_utils._contents_lock:
+        drive_utils._contents.clear()
+    logicMod._recent_writes.clear()
+    for key in logicMod._write_stats:
+        logicMod._write_stats[key] = 0
+    reset_retry_state()
+
+
+def _wait_until_sent(timeout):
+    import logicMod
+    from utils.outbox_utils import pending_punch_count
+    deadline = time.monotonic() + timeout
+    while pending_punch_count() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    sent_at = time.time()
+    # ⏳ 書き込みの事後確認（送信ワーカーが走らせる verify_recent_writes）が済むまで待つ
+    time.sleep(logicMod.WRITE_SETTLE_SECONDS * 2)
+    logicMod.verify_recent_writes(TOKEN)
+    return pending_punch_count(), sent_at
+
+
+def _verify_rounds(barrier):
+    import logicMod
+    for _ in range(VERIFY_ROUNDS):
+        barrier.wait()
+        time.sleep(logicMod.WRITE_SETTLE_SECONDS)
+        logicMod.verify_recent_writes(TOKEN)
+
+
+def _punch_loop(client, s, punches, think):
+    latencies, expected, errors = [], [], []
+    for i in range(punches):
+        # 🏷 名前にセッションと連番を入れて、1行ずつ見分けられるようにする
+        name = f"load{s}-{i}"
+        start = time.perf_counter()
+        try:
+            client.punch(name)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+        expected.append(name)
+        time.sleep(think)
+    return latencies, expected, errors
+
+
+# 🖥 apptest: 1セッション = 1プロセス（AppTest はプロセス全体の状態を書き換えるため、同じプロセスで同時に動かせない）
+#    各プロセスが自分のローカルDB・送信ワーカーを持ち、共有の Drive 代替へ送る
+def _apptest_process(drive, latency, s, punches, think, timeout, ready, go, verified, results):
+    import logicMod
+    from bench.fake_drive import install_shared_drive
+    from utils.outbox_utils import pending_punch_count
+    logging.disable(logging.WARNING)
+    _reset_local_state()
+    install_shared_drive(drive, latency)
+    try:
+        client = AppTestSession(timeout)
+        _wait_until_sent(timeout)
+    except Exception as e:
+        ready.wait()
+        go.wait()
+        _verify_rounds(verified)
+        results.put({"latencies": [], "expected": [], "errors": [f"load{s}: {e}"], "pending": 0, "sent_at": time.time()})
+        return
+    ready.wait()
+    go.wait()
+    latencies, expected, errors = _punch_loop(client, s, punches, think)
+    sent_at = _wait_until_sent(timeout)[1]
+    _verify_rounds(verified)
+    pending = pending_punch_count()
+    results.put({
+        "latencies": latencies, "expected": expected, "errors": errors, "pending": pending, "sent_at": sent_at,
+        "write_stats": dict(logicMod._write_stats), "retry_stats": retry_stats(),
+    })
+
+
+def _run_apptest(sessions, punches, latency, think, timeout):
+    import multiprocessing
+    from bench.fake_drive import start_shared_drive
+
+    manager, drive = start_shared_drive(seed=0)
+    try:
+        ready, go = multiprocessing.Barrier(sessions + 1), multiprocessing.Barrier(sessions + 1)
+        verified = multiprocessing.Barrier(sessions)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=_apptest_process, args=(drive, latency, s, punches, think, timeout, ready, go, verified, results))
+            for s in range(sessions)
+        ]
+        for p in processes:
+            p.start()
+        # 🚪 セッションの立ち上げ（初回表示）は計測に含めない
+        ready.wait()
+        drive.reset_stats()
+        go.wait()
+        started = time.time()
+        outcomes = [results.get(timeout=timeout * (punches + 2)) for _ in processes]
+        for p in processes:
+            p.join()
+        return started, outcomes, drive.stats(), drive.snapshot()
+    finally:
+        manager.shutdown()
+
+
+# ⚙️ direct: 1プロセスの中で各セッションをスレッドとして動かす（1台のサーバーに複数の画面がつながる状況）
+def _run_direct(sessions, punches, latency, think, timeout, folder_id):
+    import logicMod
+    _reset_local_state()
+    with FakeDrive(latency=latency, seed=0) as drive:
+        barrier = threading.Barrier(sessions + 1)
+        outcomes = [None] * sessions
+
+        def session(s):
+            barrier.wait()
+            outcomes[s] = _punch_loop(DirectSession(folder_id), s, punches, think)
+
+        threads = [threading.Thread(target=session, args=(s,)) for s in range(sessions)]
+        for t in threads:
+            t.start()
+        drive.reset_stats()
+        barrier.wait()
+        started = time.time()
+        for t in threads:
+            t.join()
+        pending, sent_at = _wait_until_sent(timeout)
+        stats, files = drive.stats(), drive.snapshot()
+
+    shared = {"pending": pending, "sent_at": sent_at, "write_stats": dict(logicMod._write_stats), "retry_stats": retry_stats()}
+    outcomes = [dict(shared, latencies=l, expected=e, errors=err) for l, e, err in outcomes]
+    # 📮 送信待ちはプロセスで1つなので、件数は1回だけ数える
+    for outcome in outcomes[1:]:
+        outcome["pending"] = 0
+    return started, outcomes, stats, files
+
+
+def run_case(mode, sessions, punches, latency, think, timeout):
+    folder_id = _main_folder_id()
+    if mode == "apptest":
+        started, outcomes, stats, files = _run_apptest(sessions, punches, latency, think, timeout)
+    else:
+        started, outcomes, stats, files = _run_direct(sessions, punches, latency, think, timeout, folder_id)
+
+    latencies = [ms for o in outcomes for ms in o["latencies"]]
+    expected = [name for o in outcomes for name in o["expected"]]
+    errors = [e for o in outcomes for e in o["errors"]]
+    acked = max(started + sum(o["latencies"]) / 1000 for o in outcomes) - started if latencies else 0
+    delivered = max(o["sent_at"] for o in outcomes) - started
+    found = Counter(_drive_punch_names(files, folder_id))
+    copies = Counter(f["name"] for f in files if folder_id in f["parents"])
+    expected_set = set(expected)
+    total = sessions * punches
+
+    write_stats, retries = Counter(), Counter()
+    for o in outcomes:
+        write_stats.update(o.get("write_stats", {}))
+        retries.update({k: v for k, v in o.get("retry_stats", {}).items() if isinstance(v, (int, float))})
+    if mode == "direct":
+        write_stats, retries = outcomes[0]["write_stats"], outcomes[0]["retry_stats"]
+
+    return {
+        "benchmark": "load",
+        "mode": mode,
+        "sessions": sessions,
+        "punches_per_session": punches,
+        "injected_latency_s": latency,
+        "think_time_s": think,
+        "ack_elapsed_s": round(acked, 3),
+        "delivered_elapsed_s": round(delivered, 3),
+        "ack_punches_per_s": round(len(latencies) / acked, 2) if acked else None,
+        "delivered_punches_per_s": round(len(expected) / delivered, 2) if delivered > 0 else None,
+        "latency_p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "latency_p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "latency_p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "latency_max_ms": round(max(latencies), 2) if latencies else None,
+        "lost_rows": sum(1 for name in expected if not found[name]),
+        "duplicate_rows": sum(count - 1 for name, count in found.items() if name in expected_set and count > 1),
+        "duplicate_files": {name: count for name, count in sorted(copies.items()) if count > 1},
+        "pending_after_wait": sum(o["pending"] for o in outcomes),
+        "errors": errors,
+        "requests_per_punch": round(stats["requests"] / total, 2),
+        "calls_per_punch": {call: round(count / total, 2) for call, count in sorted(stats["calls"].items())},
+        "write_stats": dict(write_stats),
+        "retry_stats": dict(retries),
+        "python": platform.python_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数セッションの同時打刻の負荷試験")
+    parser.add_argument("--mode", choices=["apptest", "direct"], default="apptest")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--punches", type=int, default=5, help="1セッションあたりの打刻数")
+    parser.add_argument("--latency", type=float, default=0.05, help="Drive 1リクエストあたりの注入遅延（秒）")
+    parser.add_argument("--think", type=float, default=0.0, help="1セッションの打刻の間隔（秒）")
+    parser.add_argument("--timeout", type=float, default=60, help="1回の画面実行・送信完了を待つ上限（秒）")
+    parser.add_argument("--output", help="結果を追記する JSON Lines ファイル")
+    args = parser.parse_args(argv)
+
+    # 🔇 Streamlit の「ScriptRunContext がない」警告を抑止
+    logging.disable(logging.WARNING)
+
+    results = []
+    for sessions in args.sessions:
+        result = run_case(args.mode, sessions, args.punches, args.latency, args.think, args.timeout)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return all(
+        r["lost_rows"] == 0 and r["duplicate_rows"] == 0 and not r["errors"] and not r["pending_after_wait"]
+        for r in results
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,158 @@
+"""
+打刻経路のベンチマーク（ローカルの Drive 代替を使用）
+
+    python -m bench.bench_punch --rows 1000 10000 100000 --punches 20 --latency 0.05
+
+年次ファイルの行数ごとに、1打刻あたりの所要時間・Drive リクエスト数・通信量を
+JSON Lines で出力する（--output でファイルにも追記）。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from bench.fake_drive import FakeDrive
+from utils.retry_utils import reset_retry_state, retry_stats
+
+FOLDER_ID = "bench-folder"
+TOKEN = "bench-token"
+
+
+# 🗄 手元のDB・キャッシュは一時ディレクトリに置く（本番の data/ に計測用の打刻を残さない）
+def use_temp_local_state():
+    import utils.drive_utils as drive_utils
+    import utils.store_utils as store_utils
+
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    store_utils.STORE_PATH = os.path.join(workdir, "timecard.sqlite3")
+    drive_utils.CACHE_DIR = os.path.join(workdir, "drive_cache")
+    return workdir
+
+
+def make_year_csv(rows, year):
+    start = datetime(int(year), 1, 1, 9, 0, 0)
+    times = [(start + timedelta(minutes=7 * i)).strftime("%Y-%m-%d %H:%M:%S") for i in range(rows)]
+    return pd.DataFrame({
+        "名前": [f"staff{i % 12}" for i in range(rows)],
+        "モード": ["出勤" if i % 2 == 0 else "退勤" for i in range(rows)],
+        "時刻": times,
+    }).to_csv(index=False).encode("utf-8")
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+# 🧪 打刻方式ごとの1回分の処理
+def punch_yearly_rewrite(logicMod, i):
+    # 旧方式: 年次ファイルを毎回ダウンロード→結合→全体をアップロード
+    filename, timestamp, record = logicMod.generate_punch_record(f"staff{i % 12}", "出勤")
+    service = logicMod.get_drive_service(TOKEN)
+    logicMod.append_csv_to_drive(service, filename, logicMod.punch_rows_to_csv([record]), FOLDER_ID)
+
+
+def punch_record_punch(logicMod, i):
+    logicMod.record_punch(f"staff{i % 12}", "出勤", TOKEN, FOLDER_ID)
+
+
+def punch_outbox_flush(logicMod, i):
+    # 送信ワーカーが1打刻を送る処理（シャード追記＋索引保存）
+    filename, timestamp, record = logicMod.generate_punch_record(f"staff{i % 12}", "出勤")
+    logicMod.flush_punch_rows(FOLDER_ID, logicMod.get_shard_filename(filename, timestamp), [record], TOKEN)
+
+
+def punch_error_log(logicMod, i):
+    from utils.error_utils import log_error_to_drive, flush_error_log
+    log_error_to_drive(f"bench error {i}", TOKEN, FOLDER_ID)
+    flush_error_log()
+
+
+STRATEGIES = {
+    "yearly_rewrite": punch_yearly_rewrite,
+    "record_punch": punch_record_punch,
+    "outbox_flush": punch_outbox_flush,
+    "error_log": punch_error_log,
+}
+
+
+def run_case(strategy, rows, punches, latency, failure_rate, max_version_step=1):
+    import logicMod
+
+    year = datetime.now().strftime("%Y")
+    reset_retry_state()
+    with FakeDrive(latency=latency, failure_rate=failure_rate, seed=0, max_version_step=max_version_step) as drive:
+        drive.put_file(f"{year}_timecard.csv", make_year_csv(rows, year), FOLDER_ID)
+        logicMod._last_compaction[(FOLDER_ID, year)] = datetime.now().strftime("%Y-%m-%d")
+
+        # 🔥 ウォームアップ（クライアント生成・fileId 解決）は計測しない
+        STRATEGIES[strategy](logicMod, -1)
+        drive.reset_stats()
+
+        latencies = []
+        for i in range(punches):
+            start = time.perf_counter()
+            STRATEGIES[strategy](logicMod, i)
+            latencies.append(time.perf_counter() - start)
+        stats = drive.stats()
+
+    return {
+        "benchmark": "punch",
+        "strategy": strategy,
+        "year_rows": rows,
+        "punches": punches,
+        "injected_latency_s": latency,
+        "failure_rate": failure_rate,
+        "max_version_step": max_version_step,
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "latency_max_ms": round(max(latencies) * 1000, 3),
+        "requests_per_punch": round(stats["requests"] / punches, 2),
+        "bytes_sent_per_punch": stats["bytes_sent"] // punches,
+        "bytes_received_per_punch": stats["bytes_received"] // punches,
+        "calls": stats["calls"],
+        "retry_stats": retry_stats(),
+        "python": platform.python_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="打刻経路のベンチマーク")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument("--punches", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="Drive 1リクエストあたりの注入遅延（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--max-version-step", type=int, default=3, help="Drive の version が1回の更新で進む最大値")
+    parser.add_argument("--output", help="結果を追記する JSON Lines ファイル")
+    args = parser.parse_args(argv)
+
+    # 🔇 Streamlit の「ScriptRunContext がない」警告を抑止
+    logging.disable(logging.WARNING)
+    use_temp_local_state()
+
+    results = []
+    for strategy in args.strategies:
+        for rows in args.rows:
+            result = run_case(strategy, rows, args.punches, args.latency, args.failure_rate, args.max_version_step)
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
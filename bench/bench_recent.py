@@ -0,0 +1,143 @@
+"""
+直近の打刻だけを読む処理のベンチマーク（ローカルの Drive 代替を使用）
+
+    python -m bench.bench_recent --rows 10000 100000 --today-rows 50 --latency 0.05
+
+年次ファイルに rows 行（1月1日〜昨日）、当日シャードに today-rows 行がある状態で、
+「今日の打刻」「今週の打刻」「1年分」を、手元のキャッシュが空の端末から読んだときの
+Drive からの受信バイト数・リクエスト数・所要時間を、バイト位置の索引がある場合と無い場合で比べて
+JSON Lines で出力する（--output でファイルにも追記）。
+"""
+import argparse
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from bench.fake_drive import FakeDrive
+
+FOLDER_ID = "bench-folder"
+TOKEN = "bench-token"
+
+
+def make_rows(rows, first, last):
+    step = max((last - first).total_seconds() / max(rows, 1), 1)
+    return pd.DataFrame({
+        "名前": [f"staff{i % 12}" for i in range(rows)],
+        "モード": ["出勤" if i % 2 == 0 else "退勤" for i in range(rows)],
+        "時刻": [(first + timedelta(seconds=int(step * i))).strftime("%Y-%m-%d %H:%M:%S") for i in range(rows)],
+        "打刻ID": [f"bench{first:%Y%m%d}{i:08d}" for i in range(rows)],
+    })
+
+
+def cold_read(drive, func):
+    import utils.drive_utils as drive_utils
+    # 🧊 別の端末から読む想定で、手元のキャッシュ（中身・ディスク・fileId・先読みしたメタデータ）を空にする
+    drive_utils.CACHE_DIR = tempfile.mkdtemp(dir=drive_utils.CACHE_DIR)
+    with drive_utils._contents_lock:
+        drive_utils._contents.clear()
+    with drive_utils._file_ids_lock:
+        drive_utils._file_ids.clear()
+    with drive_utils._prefetched_lock:
+        drive_utils._prefetched.clear()
+    drive.reset_stats()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    stats = drive.stats()
+    return {
+        "rows": len(result),
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "requests": stats["requests"],
+        "bytes_received": stats["bytes_received"],
+    }
+
+
+def run_case(rows, today_rows, latency, workdir):
+    import logicMod
+    import utils.drive_utils as drive_utils
+
+    drive_utils.CACHE_DIR = workdir
+    now = datetime.now()
+    year = now.strftime("%Y")
+    year_file = f"{year}_timecard.csv"
+    offsets_file = logicMod.get_offsets_filename(year_file)
+    # 🗜 計測中にシャード統合を走らせない
+    logicMod._last_compaction[(FOLDER_ID, year)] = now.strftime("%Y-%m-%d")
+
+    with FakeDrive(latency=latency, seed=0) as drive:
+        service = logicMod.get_drive_service(TOKEN)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        history = make_rows(rows, datetime(int(year), 1, 1), midnight - timedelta(seconds=1))
+        logicMod.append_csv_to_drive(service, year_file, history.to_csv(index=False).encode("utf-8"), FOLDER_ID)
+        if today_rows:
+            today = make_rows(today_rows, midnight, now)
+            shard = logicMod.get_shard_filename(year_file, now.strftime("%Y-%m-%d %H:%M:%S"))
+            logicMod.append_csv_to_drive(service, shard, today.to_csv(index=False).encode("utf-8"), FOLDER_ID)
+
+        def today_view():
+            return logicMod.load_todays_punches(TOKEN, FOLDER_ID)
+
+        def week_view():
+            monday = midnight - timedelta(days=midnight.weekday())
+            return logicMod.load_timecard_range(
+                TOKEN, FOLDER_ID, monday.strftime("%Y-%m-%d"), (monday + timedelta(days=7)).strftime("%Y-%m-%d")
+            )
+
+        def year_view():
+            return logicMod.load_timecard_year(TOKEN, year, FOLDER_ID)
+
+        result = {
+            "benchmark": "recent",
+            "year_rows": rows,
+            "today_rows": today_rows,
+            "year_csv_bytes": len(drive.read_file(year_file, FOLDER_ID)),
+            "offsets_bytes": len(drive.read_file(offsets_file, FOLDER_ID)),
+            "injected_latency_s": latency,
+            "today": cold_read(drive, today_view),
+            "week": cold_read(drive, week_view),
+            "year": cold_read(drive, year_view),
+        }
+        # 📭 索引が無い（古い・壊れた）場合は年次ファイル全体を読む
+        drive.find(offsets_file, FOLDER_ID)["trashed"] = True
+        result["today_without_offsets"] = cold_read(drive, today_view)
+        result["week_without_offsets"] = cold_read(drive, week_view)
+
+    result["python"] = platform.python_version()
+    result["timestamp"] = datetime.now().isoformat(timespec="seconds")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="直近の打刻だけを読む処理のベンチマーク")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--today-rows", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Drive 1リクエストあたりの注入遅延（秒）")
+    parser.add_argument("--output", help="結果を追記する JSON Lines ファイル")
+    args = parser.parse_args(argv)
+
+    # 🔇 Streamlit の「ScriptRunContext がない」警告を抑止
+    logging.disable(logging.WARNING)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.rows:
+            result = run_case(rows, args.today_rows, args.latency, workdir)
+            results.append(result)
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    # ✅ 索引があるときの「今日」は、索引が無いときより読む量が少ないこと
+    return all(r["today"]["bytes_received"] < r["today_without_offsets"]["bytes_received"] for r in results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
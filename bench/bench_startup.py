@@ -0,0 +1,94 @@
+"""
+起動時間のベンチマーク
+
+    python -m bench.bench_startup --repeat 5
+
+毎回新しい Python プロセスで
+  - main.py が読み込むモジュール（ui / logicMod / utils.auth_utis）の import 時間
+  - import 後に読み込まれていた重い依存（pandas, googleapiclient など）
+  - Streamlit AppTest で main.py を初回描画するまでの時間
+を計測し、JSON Lines で出力する（--output でファイルにも追記）。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["pandas", "googleapiclient.discovery", "googleapiclient.http", "google.oauth2.credentials", "requests", "httplib2"]
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import streamlit
+streamlit_done = time.perf_counter()
+import ui, logicMod, utils.auth_utis
+done = time.perf_counter()
+print(json.dumps({
+    "streamlit_s": streamlit_done - start,
+    "app_modules_s": done - streamlit_done,
+    "total_s": done - start,
+    "heavy_loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+RENDER_PROBE = """
+import json, logging, time
+logging.disable(logging.WARNING)
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("main.py", default_timeout=60)
+at.secrets["web"] = {
+    "client_id": "bench-client",
+    "client_secret": "bench-secret",
+    "token_uri": "http://127.0.0.1:9/token",
+    "redirect_uri": "http://localhost:8501",
+}
+at.run()
+print(json.dumps({"first_render_s": time.perf_counter() - start, "exceptions": [str(e.value) for e in at.exception]}))
+"""
+
+
+def run_probe(code):
+    completed = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="起動時間のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-render", action="store_true", help="AppTest による初回描画の計測を省く")
+    parser.add_argument("--output", help="結果を追記する JSON Lines ファイル")
+    args = parser.parse_args(argv)
+
+    imports = [run_probe(IMPORT_PROBE) for _ in range(args.repeat)]
+    renders = [] if args.skip_render else [run_probe(RENDER_PROBE) for _ in range(args.repeat)]
+
+    result = {
+        "benchmark": "startup",
+        "repeat": args.repeat,
+        "import_streamlit_p50_ms": round(statistics.median(r["streamlit_s"] for r in imports) * 1000, 1),
+        "import_app_modules_p50_ms": round(statistics.median(r["app_modules_s"] for r in imports) * 1000, 1),
+        "import_total_p50_ms": round(statistics.median(r["total_s"] for r in imports) * 1000, 1),
+        "heavy_modules_at_import": imports[0]["heavy_loaded"],
+        "python": sys.version.split()[0],
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+    if renders:
+        result["first_render_p50_ms"] = round(statistics.median(r["first_render_s"] for r in renders) * 1000, 1)
+        result["render_exceptions"] = renders[0]["exceptions"]
+
+    print(json.dumps(result, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+Google Drive v3 のローカル代替（ベンチマーク・負荷試験用）
+
+本物の googleapiclient の service をそのまま使い、HTTP 層だけを差し替える。
+files().list / get / get_media（Range対応）/ create / update / delete と
+バッチリクエストを実装し、遅延・失敗の注入と通信量の計測ができる。
+"""
+import email.parser
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from datetime import datetime, timezone
+from multiprocessing.managers import BaseManager
+import httplib2
+
+import utils.drive_utils as drive_utils
+import utils.retry_utils as retry_utils
+
+
+def _now_rfc3339():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+# 🔍 Drive の q パラメータ（このアプリが使う書式だけ）を評価
+def _match_query(f, query):
+    if not query:
+        return not f["trashed"]
+    for term in query.split(" and "):
+        term = term.strip()
+        if term.startswith("name contains "):
+            # 🔤 本物の Drive と同じく、name の contains は先頭一致
+            if not f["name"].startswith(term[len("name contains "):].strip("'")):
+                return False
+        elif term.startswith("name="):
+            if f["name"] != term[len("name="):].strip("'"):
+                return False
+        elif term.startswith("mimeType="):
+            if f["mimeType"] != term[len("mimeType="):].strip("'"):
+                return False
+        elif term.endswith(" in parents"):
+            if term[: -len(" in parents")].strip("'") not in f["parents"]:
+                return False
+        elif term == "trashed=false":
+            if f["trashed"]:
+                return False
+    return True
+
+
+class FakeDrive:
+    """プロセス内の Drive。install() で utils.drive_utils の HTTP を差し替える"""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, failure_status=503, retry_after=None, seed=None, max_version_step=1):
+        self.latency = latency
+        # 🔢 本物の Drive の version は増えることしか保証されないので、1回の更新で 1〜max_version_step 進める
+        self.max_version_step = max_version_step
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.files = {}
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.bytes_sent = 0       # クライアント → Drive
+        self.bytes_received = 0   # Drive → クライアント
+        self._next_id = 0
+        self._saved = None
+        self._saved_budget = None
+
+    # 🔌 インストール / アンインストール
+    def install(self):
+        http = FakeDriveHttp(self)
+        self._saved = drive_utils._get_thread_http
+        drive_utils._get_thread_http = lambda access_token: http
+        drive_utils.clear_drive_services()
+        # 🪣 本物の Drive 向けのリクエスト予算は数えない（予算待ちの sleep を Drive・アプリの所要時間として測らない）
+        self._saved_budget = retry_utils.REQUEST_BUDGET_ENABLED
+        retry_utils.REQUEST_BUDGET_ENABLED = False
+        with drive_utils._file_ids_lock:
+            drive_utils._file_ids.clear()
+        return self
+
+    def uninstall(self):
+        if self._saved:
+            drive_utils._get_thread_http = self._saved
+            self._saved = None
+            retry_utils.REQUEST_BUDGET_ENABLED = self._saved_budget
+        drive_utils.clear_drive_services()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    # 📊 計測値
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "requests": sum(self.calls.values()),
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+            }
+
+    # 📁 テストデータ投入・確認用
+    def put_file(self, name, content, folder_id=None, mime_type="text/csv"):
+        with self.lock:
+            self._next_id += 1
+            file_id = f"fake{self._next_id:06d}"
+            self.files[file_id] = {
+                "id": file_id,
+                "name": name,
+                "mimeType": mime_type,
+                "parents": [folder_id] if folder_id else [],
+                "trashed": False,
+                "version": 0,
+                "createdTime": _now_rfc3339(),
+            }
+            self._set_content(self.files[file_id], content)
+            return file_id
+
+    def find(self, name, folder_id=None):
+        with self.lock:
+            for f in self.files.values():
+                if f["name"] == name and not f["trashed"] and (folder_id is None or folder_id in f["parents"]):
+                    return f
+        return None
+
+    def read_file(self, name, folder_id=None):
+        f = self.find(name, folder_id)
+        return f["content"] if f else None
+
+    def snapshot(self):
+        """ゴミ箱に無いファイルの一覧（中身つきのコピー）"""
+        with self.lock:
+            return [dict(f, parents=list(f["parents"])) for f in self.files.values() if not f["trashed"]]
+
+    def _set_content(self, f, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        f["content"] = content
+        f["version"] += self.random.randint(1, self.max_version_step) if self.max_version_step > 1 else 1
+        f["md5Checksum"] = hashlib.md5(content).hexdigest()
+        f["modifiedTime"] = _now_rfc3339()
+
+    def _metadata(self, f):
+        meta = {k: v for k, v in f.items() if k not in ("content", "trashed")}
+        meta["version"] = str(f["version"])
+        meta["size"] = str(len(f["content"]))
+        meta["headRevisionId"] = f"rev{f['version']}"
+        meta["webViewLink"] = f"https://drive.google.com/file/d/{f['id']}/view"
+        return meta
+
+    # 🌐 1リクエスト分の処理（戻り値: status, headers, body[bytes]）
+    def handle(self, method, uri, body=None, headers=None):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        parsed = urllib.parse.urlparse(uri)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        path = parsed.path
+
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body = body or b""
+
+        if path.startswith("/batch/"):
+            return self._handle_batch(body, headers)
+
+        with self.lock:
+            self.bytes_sent += len(body)
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.calls["failure"] += 1
+                extra = {"retry-after": str(self.retry_after)} if self.retry_after is not None else {}
+                return self._error(self.failure_status, "injected failure", extra)
+
+            if path.startswith("/upload/drive/v3/files"):
+                file_id = path[len("/upload/drive/v3/files"):].strip("/")
+                metadata, content = self._parse_upload(body, headers, params)
+                if method == "POST":
+                    return self._create(metadata, content)
+                return self._update(file_id, params, metadata, content)
+
+            if path.startswith("/drive/v3/files"):
+                file_id = path[len("/drive/v3/files"):].strip("/")
+                if method == "GET" and not file_id:
+                    return self._list(params)
+                if method == "GET" and params.get("alt") == "media":
+                    return self._get_media(file_id, headers)
+                if method == "GET":
+                    return self._get(file_id)
+                if method == "POST" and not file_id:
+                    return self._create(json.loads(body or b"{}"), None)
+                if method == "PATCH":
+                    return self._update(file_id, params, json.loads(body or b"{}"), None)
+                if method == "DELETE":
+                    return self._delete(file_id)
+
+        return self._error(400, f"unsupported request {method} {path}")
+
+    def _json(self, status, payload, extra=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.bytes_received += len(data)
+        return status, dict({"content-type": "application/json; charset=UTF-8"}, **(extra or {})), data
+
+    def _error(self, status, message, extra=None):
+        return self._json(status, {"error": {"code": status, "message": message}}, extra)
+
+    def _parse_upload(self, body, headers, params):
+        content_type = headers.get("content-type", "")
+        if params.get("uploadType") != "multipart":
+            return {}, body
+        message = email.parser.BytesParser().parsebytes(
+            b"Content-Type: " + content_type.encode("utf-8") + b"\r\n\r\n" + body
+        )
+        parts = message.get_payload()
+        metadata = json.loads(parts[0].get_payload(decode=True) or b"{}")
+        return metadata, parts[1].get_payload(decode=True)
+
+    def _list(self, params):
+        self.calls["list"] += 1
+        found = [self._metadata(f) for f in self.files.values() if _match_query(f, params.get("q"))]
+        if params.get("orderBy", "").startswith("createdTime"):
+            found.sort(key=lambda f: (f["createdTime"], f["id"]))
+        else:
+            found.sort(key=lambda f: f["name"])
+        return self._json(200, {"files": found})
+
+    def _get(self, file_id):
+        self.calls["get"] += 1
+        f = self.files.get(file_id)
+        if not f or f["trashed"]:
+            return self._error(404, f"File not found: {file_id}")
+        return self._json(200, self._metadata(f))
+
+    def _get_media(self, file_id, headers):
+        self.calls["get_media"] += 1
+        f = self.files.get(file_id)
+        if not f or f["trashed"]:
+            return self._error(404, f"File not found: {file_id}")
+
+        content = f["content"]
+        total = len(content)
+        range_header = headers.get("range")
+        if not range_header:
+            self.bytes_received += total
+            return 200, {"content-length": str(total)}, content
+
+        # 📐 bytes=a-b / bytes=a- / bytes=-n
+        first, last = range_header.split("=", 1)[1].split("-", 1)
+        if first == "":
+            first, last = max(total - int(last), 0), total - 1
+        else:
+            first, last = int(first), min(int(last) if last else total - 1, total - 1)
+        if total == 0 or first >= total:
+            return 416, {"content-range": f"bytes */{total}"}, b""
+
+        chunk = content[first:last + 1]
+        self.bytes_received += len(chunk)
+        return 206, {"content-range": f"bytes {first}-{last}/{total}", "content-length": str(len(chunk))}, chunk
+
+    def _create(self, metadata, content):
+        self.calls["create"] += 1
+        self._next_id += 1
+        file_id = f"fake{self._next_id:06d}"
+        self.files[file_id] = {
+            "id": file_id,
+            "name": metadata.get("name", "untitled"),
+            "mimeType": metadata.get("mimeType", "application/octet-stream"),
+            "parents": list(metadata.get("parents", [])),
+            "trashed": False,
+            "version": 0,
+            "createdTime": _now_rfc3339(),
+        }
+        self._set_content(self.files[file_id], content or b"")
+        return self._json(200, self._metadata(self.files[file_id]))
+
+    def _update(self, file_id, params, metadata, content):
+        self.calls["update"] += 1
+        f = self.files.get(file_id)
+        if not f or f["trashed"]:
+            return self._error(404, f"File not found: {file_id}")
+
+        for parent in filter(None, params.get("removeParents", "").split(",")):
+            if parent in f["parents"]:
+                f["parents"].remove(parent)
+        for parent in filter(None, params.get("addParents", "").split(",")):
+            if parent not in f["parents"]:
+                f["parents"].append(parent)
+        if "name" in metadata:
+            f["name"] = metadata["name"]
+        if "trashed" in metadata:
+            f["trashed"] = bool(metadata["trashed"])
+        if content is not None:
+            self._set_content(f, content)
+        return self._json(200, self._metadata(f))
+
+    def _delete(self, file_id):
+        self.calls["delete"] += 1
+        if self.files.pop(file_id, None) is None:
+            return self._error(404, f"File not found: {file_id}")
+        return 204, {}, b""
+
+    # 📦 バッチ（multipart/mixed の中の application/http を1件ずつ処理）
+    def _handle_batch(self, body, headers):
+        with self.lock:
+            self.calls["batch"] += 1
+            self.bytes_sent += len(body)
+        message = email.parser.BytesParser().parsebytes(
+            b"Content-Type: " + headers["content-type"].encode("utf-8") + b"\r\n\r\n" + body
+        )
+
+        boundary = "batch_fake_boundary"
+        out = []
+        for part in message.get_payload():
+            raw = part.get_payload(decode=True).decode("utf-8")
+            request_line, rest = raw.split("\n", 1)
+            method, path, _ = request_line.split(" ", 2)
+            inner_headers, _, inner_body = rest.replace("\r\n", "\n").partition("\n\n")
+            status, resp_headers, data = self.handle(method, "https://www.googleapis.com" + path, inner_body or None)
+            content_id = part["Content-ID"].replace("<", "<response-", 1)
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: {resp_headers.get('content-type', 'application/json')}\r\n\r\n"
+                f"{data.decode('utf-8')}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        return 200, {"content-type": f"multipart/mixed; boundary={boundary}"}, "".join(out).encode("utf-8")
+
+
+class FakeDriveHttp:
+    """httplib2.Http 互換（googleapiclient から呼ばれる request() だけ実装）"""
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if self.drive.latency:
+            time.sleep(self.drive.latency)
+        status, headers, content = self.drive.handle(method, uri, body, headers)
+        resp = httplib2.Response(dict(headers, status=str(status)))
+        return resp, content
+
+    def close(self):
+        pass
+
+
+# 🌐 別プロセスから1つの Drive 代替を共有する（複数の打刻端末が同じフォルダを使う負荷試験用）
+class _SharedDriveManager(BaseManager):
+    pass
+
+
+_SharedDriveManager.register("FakeDrive", FakeDrive, exposed=("handle", "stats", "reset_stats", "snapshot", "put_file"))
+
+
+def start_shared_drive(**kwargs):
+    """Drive 代替を別プロセスで起動する。戻り値: (manager, drive のプロキシ)。終わったら manager.shutdown()"""
+    manager = _SharedDriveManager()
+    manager.start()
+    return manager, manager.FakeDrive(**kwargs)
+
+
+class _RemoteDrive:
+    def __init__(self, proxy, latency):
+        self.proxy = proxy
+        self.latency = latency
+
+    def handle(self, method, uri, body=None, headers=None):
+        return self.proxy.handle(method, uri, body, headers)
+
+
+def install_shared_drive(proxy, latency=0.0):
+    """このプロセスの utils.drive_utils を、共有の Drive 代替へつなぐ（遅延はこちら側で入れる）"""
+    http = FakeDriveHttp(_RemoteDrive(proxy, latency))
+    drive_utils._get_thread_http = lambda access_token: http
+    drive_utils.clear_drive_services()
+    with drive_utils._file_ids_lock:
+        drive_utils._file_ids.clear()
@@ -0,0 +1,174 @@
+"""
+Google Sheets v4 のローカル代替（保存先「sheets」のベンチマーク用）
+
+fake_drive と同じく HTTP 層だけを差し替える。spreadsheets.get / batchUpdate（addSheet・appendCells）と
+values.get / update / append を実装し、遅延の注入と通信量の計測ができる。
+Drive 代替と一緒に使うときは FakeDrive を先に install() すること（Drive 宛ての通信はそちらへ回す）。
+"""
+import json
+import threading
+import urllib.parse
+from collections import Counter
+
+import utils.drive_utils as drive_utils
+import utils.sheets_utils as sheets_utils
+from bench.fake_drive import FakeDriveHttp
+
+SHEETS_HOST = "sheets.googleapis.com"
+
+
+# 📐 "'2025'!A1" / "'2025'" → タブ名
+def _sheet_title(range_):
+    title = range_ if range_.endswith("'") or "!" not in range_ else range_.rsplit("!", 1)[0]
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    return title
+
+
+class FakeSheets:
+    """プロセス内のスプレッドシート。install() で Sheets 宛ての通信だけをこちらへ回す"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.spreadsheets = {}  # spreadsheet_id → {タブ名: {"sheetId", "rows"}}
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._saved = None
+
+    # 🔌 インストール / アンインストール
+    def install(self):
+        self._saved = drive_utils._get_thread_http
+        saved, sheets_http = self._saved, FakeDriveHttp(self)
+
+        class _RoutingHttp:
+            def __init__(self, other):
+                self.other = other
+
+            def request(self, uri, *args, **kwargs):
+                target = sheets_http if urllib.parse.urlparse(uri).netloc == SHEETS_HOST else self.other
+                return target.request(uri, *args, **kwargs)
+
+            def close(self):
+                pass
+
+        drive_utils._get_thread_http = lambda access_token: _RoutingHttp(saved(access_token))
+        sheets_utils.clear_sheets_services()
+        return self
+
+    def uninstall(self):
+        if self._saved:
+            drive_utils._get_thread_http = self._saved
+            self._saved = None
+        sheets_utils.clear_sheets_services()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+    # 📊 計測値
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "requests": sum(self.calls.values()),
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+            }
+
+    def create_spreadsheet(self, spreadsheet_id):
+        with self.lock:
+            self.spreadsheets.setdefault(spreadsheet_id, {})
+        return spreadsheet_id
+
+    def rows(self, spreadsheet_id, title):
+        with self.lock:
+            return [list(r) for r in self.spreadsheets[spreadsheet_id][title]["rows"]]
+
+    # 🌐 1リクエスト分の処理（戻り値: status, headers, body[bytes]）
+    def handle(self, method, uri, body=None, headers=None):
+        parsed = urllib.parse.urlparse(uri)
+        path = urllib.parse.unquote(parsed.path)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body = body or b""
+
+        with self.lock:
+            self.bytes_sent += len(body)
+            if not path.startswith("/v4/spreadsheets/"):
+                return self._error(400, f"unsupported request {method} {path}")
+            spreadsheet_id, _, rest = path[len("/v4/spreadsheets/"):].partition("/")
+            spreadsheet_id, _, action = spreadsheet_id.partition(":")
+            sheets = self.spreadsheets.get(spreadsheet_id)
+            if sheets is None:
+                return self._error(404, f"Requested entity was not found: {spreadsheet_id}")
+
+            if not rest and method == "GET":
+                self.calls["get"] += 1
+                return self._json(200, {"sheets": [
+                    {"properties": {"title": title, "sheetId": s["sheetId"]}} for title, s in sheets.items()
+                ]})
+            if action == "batchUpdate":
+                return self._batch_update(sheets, json.loads(body or b"{}"))
+            if rest.startswith("values/"):
+                range_, _, values_action = rest[len("values/"):].partition(":")
+                sheet = sheets.get(_sheet_title(range_))
+                if sheet is None:
+                    return self._error(400, f"Unable to parse range: {range_}")
+                if values_action == "append" and method == "POST":
+                    self.calls["append"] += 1
+                    values = json.loads(body)["values"]
+                    first = len(sheet["rows"]) + 1
+                    sheet["rows"].extend([str(v) for v in row] for row in values)
+                    return self._json(200, {"updates": {"updatedRows": len(values), "updatedRange": f"A{first}"}})
+                if method == "PUT":
+                    self.calls["update"] += 1
+                    values = json.loads(body)["values"]
+                    sheet["rows"][:len(values)] = [[str(v) for v in row] for row in values]
+                    return self._json(200, {"updatedRows": len(values)})
+                if method == "GET":
+                    self.calls["values_get"] += 1
+                    return self._json(200, {"range": range_, "values": [list(r) for r in sheet["rows"]]})
+
+        return self._error(400, f"unsupported request {method} {path}")
+
+    # 📦 batchUpdate は全体で成功か失敗か（途中の状態を残さない）
+    def _batch_update(self, sheets, payload):
+        self.calls["batch_update"] += 1
+        staged = {title: {"sheetId": s["sheetId"], "rows": list(s["rows"])} for title, s in sheets.items()}
+        for request in payload.get("requests", []):
+            if "addSheet" in request:
+                properties = request["addSheet"]["properties"]
+                sheet_id = properties.get("sheetId", len(staged))
+                if properties["title"] in staged or any(s["sheetId"] == sheet_id for s in staged.values()):
+                    return self._error(400, f"A sheet with the name \"{properties['title']}\" already exists.")
+                staged[properties["title"]] = {"sheetId": sheet_id, "rows": []}
+            elif "appendCells" in request:
+                target = request["appendCells"]["sheetId"]
+                sheet = next((s for s in staged.values() if s["sheetId"] == target), None)
+                if sheet is None:
+                    return self._error(400, f"No grid with id: {target}")
+                for row in request["appendCells"]["rows"]:
+                    sheet["rows"].append([next(iter(c["userEnteredValue"].values())) for c in row["values"]])
+            else:
+                return self._error(400, f"unsupported batchUpdate request {list(request)}")
+        sheets.clear()
+        sheets.update(staged)
+        return self._json(200, {"replies": []})
+
+    def _json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.bytes_received += len(data)
+        return status, {"content-type": "application/json; charset=UTF-8"}, data
+
+    def _error(self, status, message):
+        return self._json(status, {"error": {"code": status, "message": message}})
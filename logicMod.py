@@ -1,106 +1,53 @@
 import streamlit as st
-import pandas as pd
-import requests
+import csv
+import hashlib
 import json
+import random
+import re
+import threading
+import time
+import uuid
 from datetime import datetime
-from io import StringIO, BytesIO
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-from google.oauth2.credentials import Credentials
+from io import StringIO, BytesIO, RawIOBase
+from utils.drive_utils import (
+    get_drive_service,
+    find_file_id,
+    settle_created_file,
+    remember_file_id,
+    forget_file_id,
+    call_with_file_id,
+    download_file_bytes,
+    download_file_cached,
+    get_file_metadata,
+    remember_file_content,
+    get_cached_frame,
+    execute_batch,
+    batch_get_metadata,
+    iter_file_chunks,
+    prefetch_file_metadata,
+    upload_file_bytes,
+    trash_file,
+    delete_file,
+    forget_file_content,
+    open_file_for_range_reads,
+    CACHE_METADATA_FIELDS
+)
+from utils.outbox_utils import enqueue_punch, start_outbox_worker
+from utils.store_utils import replace_synced_punches, latest_punches, known_folders, set_sync_state, pending_punches
+from utils.token_utils import get_shared_access_token
+from utils.timing_utils import span, timed
+from utils.csv_utils import csv_engine, append_csv_bytes, read_csv_as_text, day_byte_ranges
+from utils.archive_utils import archive_available, build_monthly_archive, read_monthly_archive, months_between, days_between
+from utils.error_utils import archive_error_logs
+from utils.backend_utils import PunchBackend, register_backend, get_punch_backend
 
-# 🔐 1. refresh_token を Drive に保存（上書き対応）
-def save_refresh_token_to_drive(refresh_token, access_token, folder_id):
-    try:
-        creds = Credentials(token=access_token)
-        service = build("drive", "v3", credentials=creds)
-
-        query = f"'{folder_id}' in parents and name='refresh_token.csv'"
-        results = service.files().list(q=query, fields="files(id)").execute()
-        files = results.get("files", [])
-
-        # 🔐 Base64で暗号化
-        import base64
-        encoded_token = base64.b64encode(refresh_token.encode("utf-8")).decode("utf-8")
-        csv_content = f"refresh_token\n{refresh_token}"
-        media = MediaIoBaseUpload(StringIO(csv_content), mimetype="text/csv")
-
-        if files:
-            file_id = files[0]["id"]
-            service.files().update(fileId=file_id, media_body=media).execute()
-        else:
-            file_metadata = {
-                "name": "refresh_token.csv",
-                "parents": [folder_id],
-                "mimeType": "text/csv"
-            }
-            service.files().create(body=file_metadata, media_body=media, fields="id").execute()
-    except Exception as e:
-        print("❌ refresh_token 保存失敗:", e)
-
-# 📥 2. Driveから refresh_token.csv を読み込む
-def load_refresh_token_from_drive(access_token, folder_id):
-    try:
-        creds = Credentials(token=access_token)
-        service = build("drive", "v3", credentials=creds)
-
-        query = f"'{folder_id}' in parents and name='refresh_token.csv'"
-        results = service.files().list(q=query, fields="files(id)").execute()
-        files = results.get("files", [])
-
-        if not files:
-            return None
-
-        file_id = files[0]["id"]
-        request = service.files().get_media(fileId=file_id)
-        fh = BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-
-        fh.seek(0)
-        df = pd.read_csv(fh)
-        return df["refresh_token"].iloc[0]
-    except Exception as e:
-        print("❌ refresh_token 読み込み失敗:", e)
-        return None
+# ⚡ pandas / googleapiclient / requests は起動を遅くするので、使う関数の中で import する
 
-# 🔄 3. refresh_token から access_token を再取得
-def get_access_token_from_refresh_token(refresh_token, client_id, client_secret, token_uri):
-    try:
-        refresh_data = {
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "refresh_token": refresh_token,
-            "grant_type": "refresh_token"
-        }
-
-        response = requests.post(token_uri, data=refresh_data)
-        response.raise_for_status()
-        token_json = response.json()
-        return token_json.get("access_token")
-    except Exception as e:
-        print("❌ access_token 再取得失敗:", e)
-        return None
-
-# 4. セッション初期化時にaccess_tokenを復元する処理
-def restore_access_token_if_needed(client_id, client_secret, token_uri, folder_id):
-    if "access_token" not in st.session_state:
-        #st.info("🔄 セッション復元中...")
-
-        # Drive から refresh_token を読み込む
-        refresh_token = load_refresh_token_from_drive(access_token="", folder_id=folder_id)
-        if not refresh_token:
-            #st.warning("⚠️ refresh_token が見つかりません。再ログインが必要です。")
-            return
-
-        # refresh_token から access_token を再取得
-        access_token = get_access_token_from_refresh_token(refresh_token, client_id, client_secret, token_uri)
-        if access_token:
-            st.session_state.access_token = access_token
-            st.success("✅ access_token を復元しました")
-        else:
-            st.error("❌ access_token の復元に失敗しました。再認証してください。")
+PUNCH_COLUMNS = ["名前", "モード", "時刻", "打刻ID"]
+# 🪪 打刻ID（打刻ごとに端末側で振る一意なID）。同じ打刻の再送・再試行を書き込み時に見分ける
+PUNCH_ID_COLUMN = "打刻ID"
+# 🧓 打刻IDの無い行（列追加前の行・一括取込の行）は内容から決まるIDで扱う
+_LEGACY_PUNCH_ID_NAMESPACE = uuid.UUID("6f1d3c4e-2b7a-4c55-9a57-0d7c1e3b8a21")
 
 # 🕒 5. 打刻データの生成
 def generate_punch_record(name, mode):
@@ -109,18 +56,76 @@ def generate_punch_record(name, mode):
     year = now.strftime("%Y")
     filename = f"{year}_timecard.csv"
 
-    record_df = pd.DataFrame([{
+    # 🪶 1行だけなので pandas は使わず dict で持つ（CSV化は punch_rows_to_csv）
+    record = {
         "名前": name,
         "モード": mode,
-        "時刻": timestamp
-    }])
+        "時刻": timestamp,
+        PUNCH_ID_COLUMN: uuid.uuid4().hex
+    }
 
-    return filename, timestamp, record_df
+    return filename, timestamp, record
+
+# 📐 5-0. タイムカードCSVを型付きで読み込む（名前・モードはカテゴリ、時刻は datetime64）
+#         文字列のままより大幅に省メモリで、集計（groupby・時刻比較）もそのまま速く回せる
+TIMECARD_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def apply_timecard_schema(df):
+    import pandas as pd
+    df = df.astype({column: "category" for column in ("名前", "モード") if column in df.columns})
+    if "時刻" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["時刻"]):
+        try:
+            df["時刻"] = pd.to_datetime(df["時刻"], format=TIMECARD_TIME_FORMAT)
+        except (TypeError, ValueError):
+            # 🧓 古い書式が混ざっている場合だけ遅い推定に回す
+            df["時刻"] = pd.to_datetime(df["時刻"], format="mixed", errors="coerce")
+    return df
+
+def read_timecard_csv(data):
+    import pandas as pd
+    with span("pandas.read_csv"):
+        df = pd.read_csv(BytesIO(data), engine=csv_engine(), dtype={"名前": "category", "モード": "category"})
+        return apply_timecard_schema(df)
+
+# 🧾 5-1. 打刻の行（dict のリスト）をヘッダー付きCSVのバイト列に
+def punch_rows_to_csv(rows):
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=PUNCH_COLUMNS, lineterminator="\n", extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+# 🪪 5-1-1. 打刻ID（無い行は 名前・モード・時刻 から決まるIDにする。同じ行なら何度呼んでも同じ）
+def legacy_punch_id(name, mode, timestamp):
+    return uuid.uuid5(_LEGACY_PUNCH_ID_NAMESPACE, f"{name}\t{mode}\t{timestamp}").hex
+
+def ensure_punch_ids(df):
+    """打刻ID列が無い・空の行に legacy_punch_id を入れた DataFrame（時刻は文字列でも日時型でもよい）"""
+    import pandas as pd
+    ids = df[PUNCH_ID_COLUMN] if PUNCH_ID_COLUMN in df.columns else None
+    if ids is not None and (ids.notna() & (ids != "")).all():
+        return df
+    df = df.copy()
+    timestamps = df["時刻"]
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = timestamps.dt.strftime(TIMECARD_TIME_FORMAT)
+    df[PUNCH_ID_COLUMN] = [
+        punch_id if isinstance(punch_id, str) and punch_id else legacy_punch_id(name, mode, timestamp)
+        for name, mode, timestamp, punch_id in zip(
+            df["名前"].astype(str), df["モード"].astype(str), timestamps.astype(str),
+            ids if ids is not None else [None] * len(df)
+        )
+    ]
+    return df
+
+# 🧩 5-2. 日別シャードのファイル名（例: 2025_timecard.csv → 2025_timecard_1018.csv）
+def get_shard_filename(filename, timestamp):
+    base = filename[: -len(".csv")]
+    return f"{base}_{timestamp[5:7]}{timestamp[8:10]}.csv"
 
 # 📁 6. フォルダの存在確認と自動作成
 def ensure_folder_exists(folder_name, access_token):
-    creds = Credentials(token=access_token)
-    service = build("drive", "v3", credentials=creds)
+    service = get_drive_service(access_token)
 
     query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
     results = service.files().list(q=query, fields="files(id, name, parents)").execute()
@@ -139,102 +144,454 @@ def ensure_folder_exists(folder_name, access_token):
         st.write("📁 新規フォルダを作成しました:", folder)
         return folder.get("id")
 
-def upload_to_drive(access_token, filename, new_csv_data, folder_id=None):
+# 🔁 7-0. 同時書き込み対策（楽観的同時実行制御）の設定
+WRITE_MAX_ATTEMPTS = 6
+WRITE_SETTLE_SECONDS = 0.3   # 書き込み後、他の書き込みに上書きされていないか確認し始めるまでの待ち
+WRITE_VERIFY_WINDOW_SECONDS = 60  # この間に版が動いたら、自分の行が消えていないか確かめ直す
+WRITE_BACKOFF_SECONDS = 0.2  # 競合時の再試行間隔（指数バックオフ＋ジッター）
+
+_write_stats = {"writes": 0, "conflicts": 0, "retries": 0, "duplicate_creates": 0, "repaired_rows": 0}
+
+# 🧾 直近に書いた行（file_id → {"folder_id", "filename", "version", "rows", "written_at", "created"}）
+#    後から古い版を元にした書き込みで消されていないか、送信ワーカーがまとめて確認する
+_recent_writes = {}
+_recent_writes_lock = threading.Lock()
+
+# 🪪 7-1. ファイルに入っている打刻IDの索引（集合）。ファイル内容のキャッシュと同じ版情報で持つので、
+#        自分の書き込みの後は索引もその場で足すだけで済み、追記ごとの重複判定は1行 O(1)（ファイルの解析なし）
+#        他の端末が書いて版が動いたときだけ、ダウンロードした中身から1回作り直す
+class _PunchIdIndex(set):
+    md5 = None  # この集合が表している中身の md5（その場で足したら書いた中身の md5 に進める）
+
+_index_lock = threading.Lock()
+
+def _build_punch_id_index(content, md5):
+    with span("punch.id_index"):
+        index = _PunchIdIndex(ensure_punch_ids(read_csv_as_text(content))[PUNCH_ID_COLUMN]) if content.strip() else _PunchIdIndex()
+    index.md5 = md5
+    return index
+
+def _punch_id_index(file_id, metadata, content):
+    index = get_cached_frame(file_id, metadata)
+    if isinstance(index, _PunchIdIndex):
+        return index
+    index = _build_punch_id_index(content, metadata.get("md5Checksum"))
+    remember_file_content(file_id, content, metadata, frame=index)
+    return index
+
+# 🔍 7-1-1. rows_df のうち索引に無い行（同じ打刻IDは1つにまとめる）
+def _missing_rows(index, rows_df):
+    seen = set()
+    keep = []
+    for punch_id in rows_df[PUNCH_ID_COLUMN]:
+        keep.append(punch_id not in index and punch_id not in seen)
+        seen.add(punch_id)
+    return rows_df[keep]
+
+# ➕ 7-1-2. 書き込みが確定したら索引に足す。同じ版を読んだ別の書き込みが先に足していたら
+#          （集合はキャッシュで共有している）、その集合は自分の書いた中身と合わないので作り直す
+def _extend_punch_id_index(index, read_md5, pending_df, updated_csv, updated_md5):
+    with _index_lock:
+        if read_md5 is not None and index.md5 == read_md5:
+            index.update(pending_df[PUNCH_ID_COLUMN])
+            index.md5 = updated_md5
+            return index
+    return _build_punch_id_index(updated_csv, updated_md5)
+
+def _sleep_backoff(attempt):
+    time.sleep(WRITE_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+# ✅ update のレスポンスが「読んだ版より新しく、中身が自分の送ったバイト列そのもの」なら自分の書き込みとして確定する
+#    Drive の version は増えることしか保証されない（+1 ずつとは限らない）ので、版の差だけでは競合と決めない
+def _is_own_write(read_metadata, response, uploaded_md5):
     try:
-        st.write("📁 upload_to_drive に渡された folder_id:", folder_id)
-        creds = Credentials(token=access_token)
-        service = build("drive", "v3", credentials=creds)
+        newer = int(response["version"]) > int(read_metadata["version"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return newer and response.get("md5Checksum") == uploaded_md5
 
-        query = f"name='{filename}'"
-        if folder_id:
-            query += f" and '{folder_id}' in parents"
+# 🔢 版が「読んだ版の次」なら、読んでから書くまでの間に他の書き込みは無かったと言い切れる
+#    版が飛んでいたら（Drive の都合か、間に誰かが書いたか区別できない）事後確認に回す
+def _is_next_version(read_metadata, response):
+    try:
+        return int(response["version"]) == int(read_metadata["version"]) + 1
+    except (KeyError, TypeError, ValueError):
+        return False
+
+#    version は「自分の行が全部入っていると分かっている版」。競合した書き込みの後は None（要確認）
+def _remember_write(file_id, folder_id, filename, rows_df, version, created=False):
+    import pandas as pd
+    with _recent_writes_lock:
+        entry = _recent_writes.get(file_id)
+        rows = rows_df if entry is None else pd.concat([entry["rows"], rows_df], ignore_index=True).drop_duplicates(PUNCH_ID_COLUMN)
+        _recent_writes[file_id] = {
+            "folder_id": folder_id,
+            "filename": filename,
+            "version": version,
+            "rows": rows,
+            "written_at": time.monotonic(),
+            "created": created or bool(entry and entry["created"]),
+        }
+
+def _note_version(file_id, metadata):
+    with _recent_writes_lock:
+        if file_id in _recent_writes:
+            _recent_writes[file_id]["version"] = str(metadata.get("version"))
 
-        results = service.files().list(q=query, fields="files(id)").execute()
-        files = results.get("files", [])
+def forget_recent_write(file_id):
+    with _recent_writes_lock:
+        _recent_writes.pop(file_id, None)
 
-        if files:
-            file_id = files[0]["id"]
+def _unverified_rows(file_id, metadata):
+    """版が自分の最後の書き込みから動いていれば、消されたかもしれない自分の行を返す"""
+    with _recent_writes_lock:
+        entry = _recent_writes.get(file_id)
+    if entry and entry["version"] != str(metadata.get("version")):
+        return entry["rows"]
+    return None
 
-            # 🔍 既存ファイルの親フォルダ確認
-            file_metadata = service.files().get(fileId=file_id, fields="id, name, parents").execute()
+# 📤 7. 既存CSVへ行を追記してアップロード（画面表示なし。バックグラウンド送信からも使う）
+#       読んだ版と update のレスポンスの版を比べ、間に他の書き込みがあれば最新版に取り込み直して再試行する
+#       打刻IDが既にファイルにある行は足さない（再送・再試行しても二重にならない）
+@timed("punch.append")
+def append_csv_to_drive(service, filename, new_csv_data, folder_id=None):
+    import pandas as pd
+    from googleapiclient.http import MediaIoBaseUpload
+
+    new_df = ensure_punch_ids(read_csv_as_text(new_csv_data))
+
+    def update_existing(file_id):
+        response = None
+        for attempt in range(WRITE_MAX_ATTEMPTS):
+            # 🔍 既存ファイルの親フォルダと版（事前にバッチで取得済みなら通信なし）
+            file_metadata = get_file_metadata(service, file_id)
             current_parents = file_metadata.get("parents", [])
 
-            # 🔽 既存CSVをダウンロード
-            request = service.files().get_media(fileId=file_id)
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-            fh.seek(0)
-
-            # 🔄 CSVを結合
-            existing_df = pd.read_csv(fh)
-            new_df = pd.read_csv(BytesIO(new_csv_data))
-            combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-            updated_csv = combined_df.to_csv(index=False).encode("utf-8")
+            # 🔽 既存CSV（手元のキャッシュが最新ならダウンロードしない）
+            content = download_file_cached(service, file_id, file_metadata)
+
+            # 🪪 打刻IDの索引（自分の書き込みの直後なら解析なし）
+            index = _punch_id_index(file_id, file_metadata, content)
+
+            # ↩️ 版が自分の書き込みから動いていたら、自分の行が消されていないかも確かめて足す
+            unverified_df = _unverified_rows(file_id, file_metadata)
+            if unverified_df is not None:
+                lost_df = _missing_rows(index, unverified_df)
+                pending_df = _missing_rows(index, pd.concat([lost_df, new_df], ignore_index=True))
+            else:
+                lost_df = None
+                pending_df = _missing_rows(index, new_df)
+            if pending_df.empty:
+                _note_version(file_id, file_metadata)
+                return response, current_parents
+            if lost_df is not None:
+                _write_stats["repaired_rows"] += len(lost_df)
+
+            # ➕ 既存部分はバイト列のまま、末尾に新しい行だけを書き足す（DataFrame の結合・再書き出しなし）
+            with span("csv.append"):
+                updated_csv = append_csv_bytes(content, pending_df)
             media = MediaIoBaseUpload(BytesIO(updated_csv), mimetype="text/csv")
 
-            # 🛠 ファイル内容更新＋フォルダ移動（必要なら）
-            update_response = service.files().update(
-                fileId=file_id,
-                media_body=media,
-                addParents=folder_id if folder_id else None,
-                removeParents=",".join(current_parents) if folder_id else None
-            ).execute()
+            # 🛠 ファイル内容更新＋フォルダ移動（別フォルダにあるときだけ。1回の update で済ませる）
+            move = bool(folder_id) and current_parents != [folder_id]
+            with span("drive.upload"):
+                response = service.files().update(
+                    fileId=file_id,
+                    media_body=media,
+                    addParents=folder_id if move else None,
+                    removeParents=",".join(current_parents) if move else None,
+                    fields=CACHE_METADATA_FIELDS
+                ).execute()
+            _write_stats["writes"] += 1
 
-            st.write("✅ ファイル更新完了:", update_response)
-            st.write("📁 フォルダ移動: 旧 →", current_parents, "→ 新 →", folder_id)
-            return True, filename
+            # ✅ 自分の書いた中身が最新版なら確定（索引はその場で足すだけで最新になる。集合のコピーは作らない）
+            updated_md5 = hashlib.md5(updated_csv).hexdigest()
+            if _is_own_write(file_metadata, response, updated_md5):
+                index = _extend_punch_id_index(index, file_metadata.get("md5Checksum"), pending_df, updated_csv, updated_md5)
+                remember_file_content(file_id, updated_csv, response, frame=index)
+                verified = _is_next_version(file_metadata, response)
+                _remember_write(file_id, folder_id, filename, pending_df, str(response.get("version")) if verified else None)
+                update_offset_manifest_quietly(service, folder_id, filename, content, file_metadata, updated_csv, response)
+                return response, current_parents
+            remember_file_content(file_id, updated_csv, response)
+            _remember_write(file_id, folder_id, filename, pending_df, None)
 
-        else:
-            # 🆕 新規ファイル作成
-            media = MediaIoBaseUpload(BytesIO(new_csv_data), mimetype="text/csv")
-            metadata = {
-                "name": filename,
-                "mimeType": "text/csv"
-            }
-            if folder_id:
-                metadata["parents"] = [folder_id]
+            # ⚔️ 書いた直後に誰かが上書きした（または版が進んでいない）→ 最新版を読み直し、足りない行を取り込み直す
+            _write_stats["conflicts"] += 1
+            _write_stats["retries"] += 1
+            _sleep_backoff(attempt)
+
+        raise RuntimeError(f"同時書き込みの競合が解消できませんでした: {filename}")
+
+    def write(file_id):
+        if file_id:
+            return update_existing(file_id)
 
+        # 🆕 新規ファイル作成（同時に作られた同名ファイルは送信ワーカーの確認でまとめる）
+        created_df = _missing_rows(set(), new_df)
+        created_csv = append_csv_bytes(b"", created_df)
+        media = MediaIoBaseUpload(BytesIO(created_csv), mimetype="text/csv")
+        metadata = {
+            "name": filename,
+            "mimeType": "text/csv"
+        }
+        if folder_id:
+            metadata["parents"] = [folder_id]
+
+        with span("drive.upload"):
             response = service.files().create(
                 body=metadata,
                 media_body=media,
-                fields="id, name, parents, webViewLink"
+                fields=CACHE_METADATA_FIELDS + ", webViewLink"
             ).execute()
 
+        remember_file_id(folder_id, filename, response["id"])
+        index = _PunchIdIndex(created_df[PUNCH_ID_COLUMN])
+        index.md5 = hashlib.md5(created_csv).hexdigest()
+        remember_file_content(response["id"], created_csv, response, frame=index)
+        _remember_write(response["id"], folder_id, filename, created_df, str(response.get("version")), created=True)
+        update_offset_manifest_quietly(service, folder_id, filename, b"", None, created_csv, response)
+        return response, None
+
+    # 🗂 fileId はキャッシュから（404ならキャッシュを捨てて引き直す）
+    return call_with_file_id(service, filename, folder_id, write)
+
+# 🔎 7-2. 直近に書いたファイルを1回のバッチでまとめて確認し、消された行があれば書き戻す
+#         同名ファイルが同時に作られていたら、最も古いものに中身を寄せて自分の分は削除する
+def verify_recent_writes(access_token):
+    now = time.monotonic()
+    with _recent_writes_lock:
+        due = {fid: dict(e) for fid, e in _recent_writes.items() if now - e["written_at"] >= WRITE_SETTLE_SECONDS}
+    if not due:
+        return 0
+
+    service = get_drive_service(access_token)
+    requests = {f"get:{fid}": service.files().get(fileId=fid, fields=CACHE_METADATA_FIELDS) for fid in due}
+    for fid, entry in due.items():
+        if entry["created"]:
+            query = f"name='{entry['filename']}' and trashed=false"
+            if entry["folder_id"]:
+                query += f" and '{entry['folder_id']}' in parents"
+            requests[f"list:{fid}"] = service.files().list(q=query, fields="files(id, createdTime)")
+    results = execute_batch(service, requests)
+
+    repaired = 0
+    for fid, entry in due.items():
+        rows_csv = entry["rows"].to_csv(index=False).encode("utf-8")
+        try:
+            # 👯 同名ファイルの重複（同時作成）
+            same_name = (results.get(f"list:{fid}") or {}).get("files")
+            if same_name:
+                canonical = min(same_name, key=lambda f: (f.get("createdTime", ""), f["id"]))
+                if canonical["id"] != fid:
+                    # 🗑 以後の書き込みは正のファイルへ。消した後に残った自分の行も書き戻す
+                    _write_stats["duplicate_creates"] += 1
+                    remember_file_id(entry["folder_id"], entry["filename"], canonical["id"])
+                    content = download_file_bytes(service, fid)
+                    delete_file(service, fid)
+                    append_csv_to_drive(service, entry["filename"], content, entry["folder_id"])
+                    with _recent_writes_lock:
+                        leftover = _recent_writes.pop(fid, entry)["rows"]
+                    append_csv_to_drive(
+                        service, entry["filename"], leftover.to_csv(index=False).encode("utf-8"), entry["folder_id"]
+                    )
+                    continue
+                with _recent_writes_lock:
+                    if fid in _recent_writes:
+                        _recent_writes[fid]["created"] = False
+
+            latest = results.get(f"get:{fid}")
+            if latest is not None and str(latest.get("version")) == entry["version"]:
+                # ✅ 自分の書き込みのまま。確認期間を過ぎたら忘れる
+                if now - entry["written_at"] >= WRITE_VERIFY_WINDOW_SECONDS:
+                    with _recent_writes_lock:
+                        if _recent_writes.get(fid, {}).get("version") == entry["version"]:
+                            del _recent_writes[fid]
+                continue
+
+            # ⚔️ 版が動いた（または消えた）→ 自分の行が残っているか確かめ、無ければ書き戻す
+            before = _write_stats["writes"]
+            if latest is None:
+                forget_recent_write(fid)
+                forget_file_id(entry["folder_id"], entry["filename"])
+                forget_file_content(fid)
+            append_csv_to_drive(service, entry["filename"], rows_csv, entry["folder_id"])
+            repaired += _write_stats["writes"] - before
+        except Exception as e:
+            print(f"⚠️ 書き込みの確認に失敗しました（次回再確認します） ({entry['filename']}):", e)
+    return repaired
+
+def upload_to_drive(access_token, filename, new_csv_data, folder_id=None):
+    try:
+        st.write("📁 upload_to_drive に渡された folder_id:", folder_id)
+        service = get_drive_service(access_token)
+        response, current_parents = append_csv_to_drive(service, filename, new_csv_data, folder_id)
+
+        if current_parents is not None:
+            st.write("✅ ファイル更新完了:", response)
+            st.write("📁 フォルダ移動: 旧 →", current_parents, "→ 新 →", folder_id)
+        else:
             st.write("📄 作成されたファイル情報:", response)
             st.write("📁 保存先フォルダID:", response.get("parents"))
             st.write("🔗 ファイルリンク:", response.get("webViewLink"))
-            return True, filename
+        return True, filename
 
     except Exception as e:
         st.error("❌ CSVアップロード失敗")
         st.write("エラー内容:", str(e))
-        return False
+        return False, filename
+
+# 🗄 7-3. 保存先「drive」（既定）: Drive 上の日別シャード・年次ファイル・締めたアーカイブ
+#         他の保存先は utils.backend_utils（st.secrets の [storage] backend で選ぶ）
+class DriveCsvBackend(PunchBackend):
+    name = "drive"
+    uses_drive_files = True
+
+    def __init__(self, **_):
+        pass
+
+    def append_rows(self, access_token, folder_id, filename, rows):
+        service = get_drive_service(access_token)
+        append_csv_to_drive(service, filename, punch_rows_to_csv(rows), folder_id)
+        # 🗜 1プロセスにつき1日1回、前日以前のシャードを年次ファイルへ統合
+        compact_timecard_shards_daily(access_token, filename[:4], folder_id)
+
+    def load_year(self, access_token, folder_id, year, months=None, columns=None, days=None):
+        return _load_year_frame(get_drive_service(access_token), str(year), folder_id, months, columns, days)
+
+    def sync(self, access_token, folder_id):
+        try:
+            archive_past_years_daily(access_token, folder_id)
+        except Exception as e:
+            print("⚠️ 年の締めに失敗しました（明日再試行します）:", e)
+
+register_backend(DriveCsvBackend.name, DriveCsvBackend)
+
+# 🪪 送信待ちキューの古い行など、打刻IDの無い行にIDを付けて保存先へ渡す
+def _rows_with_punch_ids(rows):
+    import pandas as pd
+    if all(row.get(PUNCH_ID_COLUMN) for row in rows):
+        return rows
+    return ensure_punch_ids(pd.DataFrame(rows).reindex(columns=PUNCH_COLUMNS)).to_dict("records")
+
+# 📤 7-4. 保存先へ書き、索引のメタデータも（Drive の CSV なら書き込み先も）1往復で先に取得
+def _prefetch_for_write(backend, access_token, folder_id, filename):
+    names = [filename, STATUS_FILENAME] if backend.uses_drive_files else [STATUS_FILENAME]
+    prefetch_file_metadata(get_drive_service(access_token), folder_id, names)
 
 # 🧩 8. 打刻処理の統合関数（フォルダ自動作成付き）
+# 📦 Drive の CSV なら年次ファイルには直接書かず、当日分のシャードにだけ追記する（1打刻のコストを一定に保つ）
+@timed("punch.record")
 def record_punch(name, mode, access_token, folder_id):
-    filename, timestamp, df = generate_punch_record(name, mode)
-    csv_data = df.to_csv(index=False).encode("utf-8")
-    success, filename = upload_to_drive(access_token, filename, csv_data, folder_id)
-    return timestamp, success, filename  
+    filename, timestamp, record = generate_punch_record(name, mode)
+    shard_filename = get_shard_filename(filename, timestamp)
+    backend = get_punch_backend()
+    _prefetch_for_write(backend, access_token, folder_id, shard_filename)
+    try:
+        backend.append_rows(access_token, folder_id, shard_filename, [record])
+        success = True
+    except Exception as e:
+        st.error("❌ 打刻の保存に失敗しました")
+        st.write("エラー内容:", str(e))
+        success = False
 
-# 🧩 ex. ファイルの存在を確認
-def check_file_exists(filename, access_token, folder_id=None):
-    creds = Credentials(token=access_token)
-    service = build("drive", "v3", credentials=creds)
+    if success:
+        update_status_index(folder_id, [record])
+        save_status_index_quietly(access_token, folder_id)
 
-    # 🔍 クエリ構築（folder_id の有無で分岐）
-    if folder_id:
-        query = f"name='{filename}' and mimeType='text/csv' and '{folder_id}' in parents"
+    return timestamp, success, shard_filename
+
+# 📮 8-2. 打刻をローカルの送信待ちキューに積んで即座に返す（Driveへの送信はワーカーが行う）
+@timed("punch.enqueue")
+def record_punch_async(name, mode, access_token, folder_id):
+    filename, timestamp, record = generate_punch_record(name, mode)
+    shard_filename = get_shard_filename(filename, timestamp)
+    enqueue_punch(folder_id, shard_filename, record)
+    # 🚦 送信前でも二重打刻を弾けるよう、手元の索引はすぐ更新
+    update_status_index(folder_id, [record])
+    start_outbox_worker(flush_punch_rows, access_token, sync_punch_store)
+    return timestamp, True, shard_filename
+
+_upload_pool = None
+
+# 🧵 8-3-0. 独立したアップロードを並行して送るためのスレッド（バッチはアップロードに使えないため）
+def _get_upload_pool():
+    global _upload_pool
+    if _upload_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _upload_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="drive-upload")
+    return _upload_pool
+
+# 🚚 8-3. 送信待ちの打刻をファイルごとに1回のアップロードでまとめて送る
+#        通信は2往復: ①シャードと索引のメタデータをバッチで取得 ②両方のアップロードを並行して送信
+@timed("punch.flush")
+def flush_punch_rows(folder_id, filename, rows, access_token):
+    # 🧠 裏で更新された共有トークンがあればそちらを優先
+    access_token = get_shared_access_token()[0] or access_token
+    backend = get_punch_backend()
+    _prefetch_for_write(backend, access_token, folder_id, filename)
+
+    update_status_index(folder_id, rows)
+    status_saver = _get_upload_pool().submit(save_status_index_quietly, access_token, folder_id)
+    # 🗜 Drive の CSV ならシャード統合もここ（ワーカー側）で行い、打刻の応答を遅らせない
+    backend.append_rows(access_token, folder_id, filename, _rows_with_punch_ids(rows))
+    status_saver.result()
+    return True
+
+# 📦 8-4. 複数の打刻をまとめて記録（ファイルごとに1回だけ読み書きする）
+#        records: (名前, モード, 時刻) のリスト、または同じ列を持つ DataFrame。時刻が None なら現在時刻
+#        打刻ID列があればそのまま使い、無ければ内容から決まるIDを振る（同じ取込を2回しても二重にならない）
+#        当日分は当日シャードへ、過去分（一括取込など）は各年の年次ファイルへ直接書き込む
+def record_punches(records, access_token, folder_id):
+    import pandas as pd
+    columns = PUNCH_COLUMNS[:3]
+    if isinstance(records, pd.DataFrame):
+        batch_df = records.reindex(columns=PUNCH_COLUMNS).copy()
     else:
-        query = f"name='{filename}' and mimeType='text/csv'"
+        batch_df = pd.DataFrame(list(records), columns=columns)
+    if batch_df.empty:
+        return True, {}
 
-    st.write("🔍 検索クエリ:", query)  # ← デバッグ用に表示
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    batch_df["時刻"] = pd.to_datetime(batch_df["時刻"].fillna(now), format="mixed").dt.strftime("%Y-%m-%d %H:%M:%S")
+    batch_df = ensure_punch_ids(batch_df)
 
-    results = service.files().list(q=query, fields="files(id, name, parents)").execute()
-    files = results.get("files", [])
+    # 🗂 書き込み先ファイルをベクトル演算で振り分け
+    day = batch_df["時刻"].str[:10]
+    year_file = batch_df["時刻"].str[:4] + "_timecard.csv"
+    today_file = get_shard_filename(f"{now[:4]}_timecard.csv", now)
+    target = year_file.where(day != now[:10], today_file)
+
+    backend = get_punch_backend()
+    written = {}
+    success = True
+    for filename, group in batch_df.sort_values("時刻", kind="stable").groupby(target, sort=True):
+        try:
+            backend.append_rows(access_token, folder_id, filename, group.to_dict("records"))
+            written[filename] = len(group)
+        except Exception as e:
+            print(f"❌ 一括打刻の書き込み失敗 ({filename}):", e)
+            success = False
+
+    if written:
+        update_status_index(folder_id, batch_df[target.isin(list(written))].to_dict("records"))
+        save_status_index_quietly(access_token, folder_id)
+    return success, written
+
+# 📥 8-5. 過去の打刻CSV（名前,モード,時刻）を一括取込
+def import_punches_from_csv(csv_file, access_token, folder_id):
+    import pandas as pd
+    import_df = pd.read_csv(csv_file, usecols=lambda column: column in PUNCH_COLUMNS, dtype=str)
+    return record_punches(import_df, access_token, folder_id)
+
+# 🧩 ex. ファイルの存在を確認
+@timed("drive.check_file_exists")
+def check_file_exists(filename, access_token, folder_id=None):
+    service = get_drive_service(access_token)
+
+    # 🗂 fileId キャッシュ経由で確認（キャッシュが無ければ検索）
+    file_id = find_file_id(service, filename, folder_id)
+    files = [{"id": file_id, "name": filename, "parents": [folder_id] if folder_id else []}] if file_id else []
 
     if files:
         st.success(f"✅ ファイル '{filename}' は Drive に存在します")
@@ -244,3 +601,633 @@ def check_file_exists(filename, access_token, folder_id=None):
         st.warning(f"⚠️ ファイル '{filename}' は Drive に存在しません")
         return False
 
+# 📥 ex. Drive上のCSVをDataFrameとして読み込む
+def download_csv_from_drive(service, file_id):
+    return read_timecard_csv(download_file_cached(service, file_id))
+
+# 📥 ex. 一覧で見つけたシャードを読み込む。一覧の後に別の端末の統合で消されていたら None（行は年次ファイルへ移っている）
+def _download_listed_shard(service, file_id):
+    from googleapiclient.errors import HttpError
+    try:
+        return download_csv_from_drive(service, file_id)
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+        forget_file_content(file_id)
+        return None
+
+# 🔍 ex. 指定年の日別シャード一覧（ファイル名順）
+def list_timecard_shards(service, year, folder_id):
+    query = f"name contains '{year}_timecard_' and mimeType='text/csv' and trashed=false"
+    if folder_id:
+        query += f" and '{folder_id}' in parents"
+
+    shards = []
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=query, fields="nextPageToken, files(id, name)", pageToken=page_token
+        ).execute()
+        for f in results.get("files", []):
+            if f["name"] != f"{year}_timecard.csv":
+                remember_file_id(folder_id, f["name"], f["id"])
+                shards.append(f)
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+
+    return sorted(shards, key=lambda f: f["name"])
+
+# 🗜 9. 日別シャードを年次ファイルへ統合（当日分は追記中なので残す）
+def compact_timecard_shards(access_token, year, folder_id, keep_today=True):
+    import pandas as pd
+    service = get_drive_service(access_token)
+
+    shards = list_timecard_shards(service, year, folder_id)
+    if keep_today:
+        today = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        today_name = get_shard_filename(f"{year}_timecard.csv", today)
+        shards = [f for f in shards if f["name"] != today_name]
+    if not shards:
+        return 0
+
+    shard_df = pd.concat([download_csv_from_drive(service, f["id"]) for f in shards], ignore_index=True)
+    shard_df = shard_df.sort_values("時刻", kind="stable")
+    csv_data = shard_df.to_csv(index=False).encode("utf-8")
+
+    append_csv_to_drive(service, f"{year}_timecard.csv", csv_data, folder_id)
+
+    # 🧹 年次ファイルへ取り込めたシャードだけ削除
+    for f in shards:
+        delete_file(service, f["id"], folder_id, f["name"])
+        forget_recent_write(f["id"])
+    return len(shards)
+
+_last_compaction = {}
+
+# 🗜 9-2. 1プロセスにつき1日1回だけ統合を走らせる
+def compact_timecard_shards_daily(access_token, year, folder_id):
+    today = datetime.now().strftime("%Y-%m-%d")
+    if _last_compaction.get((folder_id, year)) == today:
+        return 0
+    try:
+        count = compact_timecard_shards(access_token, year, folder_id)
+        _last_compaction[(folder_id, year)] = today
+        return count
+    except Exception as e:
+        # 🧵 送信ワーカーから呼ばれるので画面ではなくログに出す
+        print("⚠️ シャード統合に失敗しました（次回の送信で再試行します）:", e)
+        return 0
+
+# 📖 10. 年次ファイル＋未統合シャード（締め済みの年はアーカイブも）をまとめて1年分の DataFrame に
+#        months / columns を渡すと、アーカイブからはその月・列だけを読む（CSV は丸ごと読んでから列を絞る）
+#        days（"YYYY-MM-DD" のリスト）を渡すと、年次ファイルはバイト位置の索引でその日の範囲だけ、シャードもその日の分だけ読む
+def _load_year_frame(service, year, folder_id, months=None, columns=None, days=None, reread=False):
+    import pandas as pd
+    frames = []
+    if days is not None:
+        # 📦 年次ファイルと索引の fileId・メタデータはバッチ1往復で
+        prefetch_file_metadata(service, folder_id, [f"{year}_timecard.csv", get_offsets_filename(f"{year}_timecard.csv")])
+    # 🗄 当年はまだ締めていないのでアーカイブを探さない（打刻のたびの検索を増やさない）
+    archived = read_timecard_archive(service, year, folder_id, months, columns) if int(year) < datetime.now().year else None
+    if archived is not None:
+        frames.append(archived)
+
+    year_file_id = find_file_id(service, f"{year}_timecard.csv", folder_id)
+    if year_file_id:
+        year_frame = None
+        if days is not None:
+            year_frame = read_year_file_days(service, year_file_id, f"{year}_timecard.csv", folder_id, days)
+        frames.append(year_frame if year_frame is not None else download_csv_from_drive(service, year_file_id))
+    shards = list_timecard_shards(service, year, folder_id)
+    if days is not None:
+        # 🗓 シャード名の日付（MMDD）で範囲外のものは読まない
+        wanted = set(days)
+        shards = [f for f in shards if f"{year}-{f['name'][-8:-6]}-{f['name'][-6:-4]}" in wanted]
+    shard_frames = [_download_listed_shard(service, f["id"]) for f in shards]
+    if any(f is None for f in shard_frames) and not reread:
+        # 🧹 読んでいる間に統合されたシャードがある → その行が入った年次ファイルから1回だけ読み直す
+        return _load_year_frame(service, year, folder_id, months, columns, days, reread=True)
+    frames += [f for f in shard_frames if f is not None]
+    if not frames:
+        return None
+
+    # 🏷 ファイルごとにカテゴリが違うと結合で文字列に戻るので、結合後に型を付け直す
+    year_df = apply_timecard_schema(pd.concat([f[columns] if columns else f for f in frames], ignore_index=True))
+    if archived is not None and len(frames) > 1:
+        # 🧹 締めの途中で止まった場合、アーカイブと元の CSV の両方に同じ行がある
+        year_df = year_df.drop_duplicates() if columns else ensure_punch_ids(year_df).drop_duplicates(PUNCH_ID_COLUMN)
+    return year_df
+
+def load_timecard_year(access_token, year, folder_id):
+    import pandas as pd
+    year_df = get_punch_backend().load_year(access_token, folder_id, str(year))
+    if year_df is None:
+        return pd.DataFrame(columns=PUNCH_COLUMNS)
+    return apply_timecard_schema(year_df).sort_values("時刻", kind="stable").reset_index(drop=True)
+
+# 📖 10-0. 期間 [start, end) の打刻（年をまたいでよい）。columns で列を絞れる（時刻は常に含む）
+def load_timecard_range(access_token, folder_id, start, end, columns=None):
+    import pandas as pd
+    backend = get_punch_backend()
+    columns = list(dict.fromkeys(["時刻", *columns])) if columns else None
+    months = months_between(start, end)
+
+    frames = []
+    for year in sorted({month[:4] for month in months}):
+        year_df = backend.load_year(
+            access_token, folder_id, year, [m for m in months if m[:4] == year], columns, days_between(start, end, year)
+        )
+        if year_df is not None:
+            frames.append(year_df)
+    if not frames:
+        return pd.DataFrame(columns=columns or PUNCH_COLUMNS)
+
+    df = apply_timecard_schema(pd.concat(frames, ignore_index=True))
+    df = df[(df["時刻"] >= pd.Timestamp(start)) & (df["時刻"] < pd.Timestamp(end))]
+    return df.sort_values("時刻", kind="stable").reset_index(drop=True)
+
+# 📅 10-0-1. 今日の打刻（当日シャードと、年次ファイルの今日の範囲だけを読む。年の行数によらない）
+def load_todays_punches(access_token, folder_id, columns=None):
+    from datetime import timedelta
+    today = datetime.now()
+    return load_timecard_range(
+        access_token, folder_id, today.strftime("%Y-%m-%d"), (today + timedelta(days=1)).strftime("%Y-%m-%d"), columns
+    )
+
+# 🔄 10-1. ローカルの打刻DB（SQLite）を保存先（既定は Drive）の内容に合わせる
+#          Drive で直接修正・削除された行や、他の端末の打刻を取り込む。未送信の行はそのまま
+RECONCILE_INTERVAL_SECONDS = 5 * 60
+
+_last_reconcile = {}  # folder_id → monotonic
+
+def reconcile_punch_store(access_token, folder_id, year):
+    year_df = load_timecard_year(access_token, year, folder_id)
+    rows = ensure_punch_ids(year_df.reindex(columns=PUNCH_COLUMNS)).astype(str).to_dict("records")
+    today = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def filename_for(timestamp):
+        if timestamp[:10] == today[:10]:
+            return get_shard_filename(f"{year}_timecard.csv", timestamp)
+        return f"{year}_timecard.csv"
+
+    added, removed = replace_synced_punches(folder_id, year, rows, filename_for)
+    set_sync_state("last_reconcile", {"folder_id": folder_id, "year": year, "at": today, "added": added, "removed": removed})
+    return added, removed
+
+# 🔁 10-2. 送信ワーカーから毎回呼ばれる同期処理（書き込みの事後確認＋一定間隔で保存先との突き合わせ）
+def sync_punch_store(access_token):
+    verify_recent_writes(access_token)
+    backend = get_punch_backend()
+    now = time.monotonic()
+    year = datetime.now().strftime("%Y")
+    for folder_id in known_folders():
+        if now - _last_reconcile.get(folder_id, float("-inf")) < RECONCILE_INTERVAL_SECONDS:
+            continue
+        try:
+            reconcile_punch_store(access_token, folder_id, year)
+            _last_reconcile[folder_id] = now
+        except Exception as e:
+            print("⚠️ ローカルDBと保存先の突き合わせに失敗しました（次回再試行します）:", e)
+        # 🗄 保存先ごとの保守（Drive の CSV なら年の締め）
+        backend.sync(access_token, folder_id)
+
+# 🚦 11. スタッフごとの最新打刻（名前 → モード・時刻）。年次データを読まずに二重打刻を判定する
+STATUS_FILENAME = "punch_status.json"
+STATUS_TTL_SECONDS = 60
+
+_status_index = {}  # folder_id → {"entries": {名前: {"モード", "時刻"}}, "loaded_at": monotonic}
+_status_lock = threading.Lock()
+
+def _merge_status(entries, rows):
+    for row in rows:
+        current = entries.get(row["名前"])
+        if current is None or current["時刻"] <= row["時刻"]:
+            entries[row["名前"]] = {"モード": row["モード"], "時刻": row["時刻"]}
+    return entries
+
+# 📥 11-1. Drive の punch_status.json を読み込み、手元の更新分とマージ（TTL内はメモリのみ）
+def load_status_index(access_token, folder_id, refresh=False):
+    with _status_lock:
+        cached = _status_index.get(folder_id)
+        if cached and not refresh and time.monotonic() - cached["loaded_at"] < STATUS_TTL_SECONDS:
+            return cached["entries"]
+
+    service = get_drive_service(access_token)
+    file_id = find_file_id(service, STATUS_FILENAME, folder_id)
+    # 💾 最後に書いたのが自分なら、版の確認だけでダウンロードは省く
+    remote = json.loads(download_file_cached(service, file_id)) if file_id else {}
+
+    # 🗄 ローカルDB（未送信分を含む）の最新打刻も合わせる
+    local = latest_punches(folder_id)
+
+    with _status_lock:
+        entries = _status_index.get(folder_id, {}).get("entries", {})
+        entries = _merge_status(dict(entries), [dict(v, 名前=k) for k, v in remote.items()])
+        entries = _merge_status(entries, [dict(v, 名前=k) for k, v in local.items()])
+        _status_index[folder_id] = {"entries": entries, "loaded_at": time.monotonic()}
+        return entries
+
+# ✏️ 11-2. 打刻した内容で手元の索引を更新
+def update_status_index(folder_id, rows):
+    with _status_lock:
+        cached = _status_index.setdefault(folder_id, {"entries": {}, "loaded_at": 0})
+        _merge_status(cached["entries"], rows)
+
+# 📤 11-3. 索引を Drive に保存（スタッフ数分の小さなJSONなので丸ごと上書き）
+def save_status_index(access_token, folder_id):
+    from googleapiclient.http import MediaIoBaseUpload
+    entries = load_status_index(access_token, folder_id, refresh=True)
+    service = get_drive_service(access_token)
+    body = json.dumps(entries, ensure_ascii=False).encode("utf-8")
+
+    def write(file_id):
+        media = MediaIoBaseUpload(BytesIO(body), mimetype="application/json")
+        if file_id:
+            response = service.files().update(fileId=file_id, media_body=media, fields=CACHE_METADATA_FIELDS).execute()
+        else:
+            metadata = {"name": STATUS_FILENAME, "mimeType": "application/json"}
+            if folder_id:
+                metadata["parents"] = [folder_id]
+            response = service.files().create(body=metadata, media_body=media, fields=CACHE_METADATA_FIELDS).execute()
+            # 👯 別の端末も同時に作っていたら、最も古いものを正として自分の分は消し、正の方へマージして保存し直す
+            canonical = settle_created_file(service, STATUS_FILENAME, folder_id, response["id"])
+            if canonical != response["id"]:
+                _write_stats["duplicate_creates"] += 1
+                delete_file(service, response["id"])
+                return save_status_index(access_token, folder_id)
+        remember_file_content(response["id"], body, response)
+        return response
+
+    return call_with_file_id(service, STATUS_FILENAME, folder_id, write)
+
+# 🤫 11-3-2. 索引の保存失敗で打刻自体を失敗扱いにしない（次の打刻で再保存される）
+def save_status_index_quietly(access_token, folder_id):
+    try:
+        save_status_index(access_token, folder_id)
+    except Exception as e:
+        print("⚠️ 打刻状況の保存に失敗しました:", e)
+
+# 🔍 11-4. 直前と同じモードの打刻（出勤の二重押しなど）かどうか
+#          同じ日の中か、日付をまたいでも DUPLICATE_PUNCH_WINDOW_SECONDS 以内のものだけ弾く
+#          （退勤を押し忘れても、翌日以降の出勤は記録できるように）
+DUPLICATE_PUNCH_WINDOW_SECONDS = 10 * 60
+
+def is_duplicate_punch(name, mode, access_token, folder_id):
+    status = load_status_index(access_token, folder_id).get(name)
+    if status is None or status["モード"] != mode:
+        return False
+    try:
+        last = datetime.strptime(status["時刻"], TIMECARD_TIME_FORMAT)
+    except (TypeError, ValueError):
+        return False
+    now = datetime.now()
+    return last.date() == now.date() or abs((now - last).total_seconds()) < DUPLICATE_PUNCH_WINDOW_SECONDS
+
+# 👥 11-5. 現在出勤中のスタッフ（名前 → 出勤時刻）
+def get_clocked_in_staff(access_token, folder_id):
+    entries = load_status_index(access_token, folder_id)
+    return {name: status["時刻"] for name, status in entries.items() if status["モード"] == "出勤"}
+
+# 📤 12. 期間・スタッフを指定したCSVエクスポート（ファイルを少しずつ読み、該当行だけを書き出す）
+#        start / end は "YYYY-MM-DD"（end はその日を含まない）。年をまたぐ範囲は各年のファイルを順に読む
+#        メモリに載るのはダウンロード中の1チャンクと書き出し待ちの行だけ
+EXPORT_FLUSH_ROWS = 5000
+
+def _iter_archived_rows(service, year, folder_id, month, manifest):
+    df = read_timecard_archive(service, year, folder_id, [month], manifest=manifest)
+    yield PUNCH_COLUMNS
+    if df is not None:
+        df = ensure_punch_ids(df)
+        yield from zip(df["名前"].astype(str), df["モード"].astype(str), df["時刻"].dt.strftime(TIMECARD_TIME_FORMAT), df[PUNCH_ID_COLUMN])
+
+# 🗄 Drive の CSV 以外の保存先は、1年分ずつ読んでから行を流す
+def _iter_backend_rows(backend, access_token, folder_id, year):
+    df = backend.load_year(access_token, folder_id, year)
+    yield PUNCH_COLUMNS
+    if df is not None:
+        yield from ensure_punch_ids(df.reindex(columns=PUNCH_COLUMNS).fillna("")).itertuples(index=False, name=None)
+
+# 🗂 ファイル（またはアーカイブの1か月分）ごとに、(先頭がヘッダーの行イテレータ, 打刻IDで重複を除くか) を返す
+#    締めた年はアーカイブと CSV の両方に同じ行が残りうるので除く（締めの途中で止まった・締めの間に書き込みがあって元の CSV を残した場合）
+def _export_sources(service, folder_id, start, end):
+    months = months_between(start, end)
+    for year in sorted({month[:4] for month in months}):
+        # 🗄 締め済みの年はアーカイブから1か月分ずつ
+        manifest = load_archive_manifest(service, year, folder_id) if int(year) < datetime.now().year else None
+        archived = bool(manifest)
+        if archived:
+            for month in months:
+                if month[:4] == year:
+                    yield _iter_archived_rows(service, year, folder_id, month, manifest), True
+
+        year_file_id = find_file_id(service, f"{year}_timecard.csv", folder_id)
+        if year_file_id:
+            yield _iter_csv_rows(iter_file_chunks(service, year_file_id)), archived
+        for shard in list_timecard_shards(service, year, folder_id):
+            # 🗓 シャード名の日付（MMDD）で範囲外のものは読まない
+            day = f"{year}-{shard['name'][-8:-6]}-{shard['name'][-6:-4]}"
+            if start[:10] <= day < end[:10]:
+                yield _iter_csv_rows(iter_file_chunks(service, shard["id"])), archived
+
+def _iter_csv_rows(chunks):
+    carry = b""
+    for chunk in chunks:
+        lines = (carry + chunk).split(b"\n")
+        carry = lines.pop()
+        yield from csv.reader(line.decode("utf-8-sig").rstrip("\r") for line in lines)
+    if carry.strip():
+        yield from csv.reader([carry.decode("utf-8-sig").rstrip("\r")])
+
+def iter_timecard_export(access_token, folder_id, start, end, name=None):
+    backend = get_punch_backend()
+    if backend.uses_drive_files:
+        sources = _export_sources(get_drive_service(access_token), folder_id, start, end)
+    else:
+        years = sorted({month[:4] for month in months_between(start, end)})
+        sources = ((_iter_backend_rows(backend, access_token, folder_id, year), False) for year in years)
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(PUNCH_COLUMNS)
+    seen = set()  # 締めた年の出力済み打刻ID（その年の該当行の分だけメモリに載る）
+
+    for rows, dedupe in sources:
+        header = next(rows, None)
+        if not header:
+            continue
+        # 🧭 列の位置はファイルのヘッダーから（列が増えていても PUNCH_COLUMNS の順で出す）
+        positions = [header.index(column) if column in header else None for column in PUNCH_COLUMNS]
+        name_at, time_at = header.index("名前"), header.index("時刻")
+
+        pending = 0
+        for row in rows:
+            if len(row) <= max(name_at, time_at):
+                continue
+            # 🕒 時刻は "YYYY-MM-DD HH:MM:SS" なので文字列比較で範囲判定できる
+            if not (start <= row[time_at] < end) or (name and row[name_at] != name):
+                continue
+            out = ["" if i is None or i >= len(row) else row[i] for i in positions]
+            if not out[3]:
+                out[3] = legacy_punch_id(*out[:3])
+            if dedupe:
+                if out[3] in seen:
+                    continue
+                seen.add(out[3])
+            writer.writerow(out)
+            pending += 1
+            if pending >= EXPORT_FLUSH_ROWS:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+# 🌊 12-1. ジェネレータを読み取り専用のファイルとして渡す（st.download_button などに）
+class TimecardExportStream(RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._leftover = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._leftover:
+            self._leftover = next(self._chunks, None)
+            if self._leftover is None:
+                self._leftover = b""
+                return 0
+        size = min(len(buffer), len(self._leftover))
+        buffer[:size] = self._leftover[:size]
+        self._leftover = self._leftover[size:]
+        return size
+
+# 🗄 13. 年の締め: 前年分を重複除去・並べ替え（月 → 名前 → 時刻）して Parquet に固め、
+#        月ごとの row group・行範囲を manifest（JSON）に残す。元の CSV（年次ファイル・シャード）はゴミ箱へ
+#        締めた後に届いた前年分の打刻は CSV に追記され、次の締めでアーカイブに取り込まれる
+ARCHIVE_GRACE_DAYS = 7  # 年明けから締めるまでの日数（前年分の送信待ちが届くのを待つ）
+ARCHIVE_MIMETYPE = "application/vnd.apache.parquet"
+TIMECARD_CSV_NAME = re.compile(r"(\d{4})_timecard(_\d{4})?\.csv$")  # 年次ファイル・シャード（グループ1が年）
+
+_last_archive_check = {}  # folder_id → 日付
+
+def get_archive_filenames(year):
+    return f"{year}_timecard.parquet", f"{year}_timecard.manifest.json"
+
+def load_archive_manifest(service, year, folder_id):
+    manifest_id = find_file_id(service, get_archive_filenames(year)[1], folder_id)
+    if not manifest_id:
+        return None
+    return json.loads(download_file_cached(service, manifest_id))
+
+# 🔎 13-1. アーカイブから必要な月・列だけ読む（無ければ None）
+def read_timecard_archive(service, year, folder_id, months=None, columns=None, manifest=None):
+    manifest = manifest or load_archive_manifest(service, year, folder_id)
+    if not manifest:
+        return None
+    archive_id = find_file_id(service, get_archive_filenames(year)[0], folder_id)
+    if not archive_id:
+        return None
+
+    metadata = get_file_metadata(service, archive_id)
+    source = open_file_for_range_reads(service, archive_id, metadata)
+    if metadata.get("md5Checksum") == manifest["archive"]["md5Checksum"]:
+        with span("archive.read"):
+            return apply_timecard_schema(read_monthly_archive(source, manifest, months, columns))
+
+    # ⚠️ 締め直しの途中などで manifest とアーカイブが食い違う場合は、manifest の row group 番号は使わずに
+    #    ファイル全体を読み、月はここで絞る（呼び出し側に他の月の行を返さない）
+    read_columns = None if columns is None else list(dict.fromkeys([*columns, "時刻"]))
+    with span("archive.read"):
+        df = apply_timecard_schema(read_monthly_archive(source, None, columns=read_columns))
+    if months is not None:
+        df = df[df["時刻"].dt.strftime("%Y-%m").isin(months)].reset_index(drop=True)
+    return df if columns is None else df[columns]
+
+# 🗜 13-2. 1年分を締める（戻り値: アーカイブの行数。締める対象が無ければ 0）
+def archive_timecard_year(access_token, year, folder_id):
+    year = str(year)
+    if int(year) >= datetime.now().year:
+        raise ValueError(f"{year} 年はまだ締められません")
+    if not archive_available():
+        print("⚠️ pyarrow が無いため年の締めを行いません（CSV のまま残します）")
+        return 0
+    # 📮 その年の送信待ちが残っていれば、届いてから締める
+    if any(p["folder_id"] == folder_id and p["row"]["時刻"].startswith(year) for p in pending_punches()):
+        return 0
+
+    service = get_drive_service(access_token)
+    sources = {}
+    year_file_id = find_file_id(service, f"{year}_timecard.csv", folder_id)
+    if year_file_id:
+        sources[year_file_id] = f"{year}_timecard.csv"
+    offsets_id = find_file_id(service, get_offsets_filename(f"{year}_timecard.csv"), folder_id)
+    sources.update({f["id"]: f["name"] for f in list_timecard_shards(service, year, folder_id)})
+    if not sources:
+        return 0
+    before = batch_get_metadata(service, sources)
+
+    with span("archive.build"):
+        year_df = load_timecard_year(access_token, year, folder_id)
+        # 🪪 打刻IDで重複除去（IDの無い古い行は内容から決まるIDになるので、同じ行どうしがまとまる）
+        year_df = ensure_punch_ids(year_df).drop_duplicates(PUNCH_ID_COLUMN)
+        content, manifest = build_monthly_archive(year_df, "時刻", ["名前", "時刻"])
+
+    # 📤 アーカイブ → manifest の順に書く（manifest には中身の md5 を入れて、食い違いを読み手が検出できるように）
+    archive_name, manifest_name = get_archive_filenames(year)
+    response = upload_file_bytes(service, archive_name, folder_id, content, ARCHIVE_MIMETYPE)
+    checksum = hashlib.md5(content).hexdigest()
+    if response.get("md5Checksum") not in (None, checksum):
+        raise IOError(f"{archive_name} のアップロード内容が一致しません")
+    manifest["archive"] = {"name": archive_name, "md5Checksum": checksum, "size": len(content)}
+    upload_file_bytes(service, manifest_name, folder_id, json.dumps(manifest, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    # 🗑 読んだ後に書き換わっていない元ファイルだけゴミ箱へ（書き換わったものは次の締めで取り込む）
+    after = batch_get_metadata(service, sources)
+    for file_id, filename in sources.items():
+        if before.get(file_id) and after.get(file_id) and before[file_id].get("version") == after[file_id].get("version"):
+            trash_file(service, file_id, folder_id, filename)
+            forget_recent_write(file_id)
+            if file_id == year_file_id and offsets_id:
+                # 🧭 年次ファイルのバイト位置の索引も一緒に
+                trash_file(service, offsets_id, folder_id, get_offsets_filename(filename))
+    return len(year_df)
+
+# 📅 13-3. 年明け（ARCHIVE_GRACE_DAYS 日後）以降、まだ CSV が残っている過去の年を締める（1フォルダにつき1日1回）
+#          エラーログの日別ファイルも同じく年ごとにまとめる
+def archive_past_years_daily(access_token, folder_id):
+    from datetime import timedelta
+    now = datetime.now()
+    today = now.strftime("%Y-%m-%d")
+    if _last_archive_check.get(folder_id) == today:
+        return {}
+    _last_archive_check[folder_id] = today
+
+    closed_year = (now - timedelta(days=ARCHIVE_GRACE_DAYS)).year - 1
+    service = get_drive_service(access_token)
+    # 🔤 Drive の name contains は先頭一致なので "_timecard" では検索できない。フォルダの CSV を一覧して名前はこちらで見る
+    query = f"mimeType='text/csv' and trashed=false and '{folder_id}' in parents"
+    years = set()
+    page_token = None
+    while True:
+        results = service.files().list(q=query, fields="nextPageToken, files(name)", pageToken=page_token).execute()
+        years.update(m.group(1) for m in (TIMECARD_CSV_NAME.match(f["name"]) for f in results.get("files", [])) if m)
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+
+    archived = {}
+    for year in sorted(y for y in years if int(y) <= closed_year):
+        archived[year] = archive_timecard_year(access_token, year, folder_id)
+    archive_error_logs(access_token, folder_id, closed_year)
+    return archived
+
+# 🧭 14. 年次ファイルのバイト位置の索引（{年}_timecard.offsets.json）
+#        日ごとに「その日の行が年次ファイルのどのバイト範囲にあるか」を、年次ファイルへの書き込みのたびに更新する
+#        読み手は索引と年次ファイルの md5 が一致するときだけ、必要な日の範囲を Range 指定で読む（食い違えば全体を読む）
+OFFSETS_FORMAT = 1
+# 📏 これより近い範囲どうしは1回の Range 読みにまとめる（間の行は読んだ後で捨てる）
+RANGE_MERGE_GAP_BYTES = 16 * 1024
+
+def get_offsets_filename(filename):
+    return filename[:-len(".csv")] + ".offsets.json"
+
+def _is_year_filename(filename):
+    return len(filename) == len("2025_timecard.csv") and filename[:4].isdigit() and filename.endswith("_timecard.csv")
+
+# 🧮 14-1. content（ファイル全体）の索引。base（content の先頭 base["size"] バイト分の索引）があれば続きだけ読む
+def build_offset_manifest(content, base=None):
+    header_end = content.find(b"\n") + 1 or len(content)
+    columns = content[:header_end].decode("utf-8-sig").rstrip("\r\n").split(",")
+    manifest = base or {"format": OFFSETS_FORMAT, "columns": columns, "header": [0, header_end], "size": header_end, "days": {}}
+    if "時刻" in columns:
+        for day, spans in day_byte_ranges(content, columns.index("時刻"), manifest["size"]).items():
+            existing = manifest["days"].setdefault(day, [])
+            if existing and existing[-1][1] == spans[0][0]:
+                existing[-1][1] = spans.pop(0)[1]
+            existing.extend(spans)
+    manifest["size"] = len(content)
+    manifest["md5Checksum"] = hashlib.md5(content).hexdigest()
+    return manifest
+
+def load_offset_manifest(service, filename, folder_id):
+    file_id = find_file_id(service, get_offsets_filename(filename), folder_id)
+    return json.loads(download_file_cached(service, file_id)) if file_id else None
+
+def _offsets_match(manifest, metadata):
+    return (
+        manifest is not None and metadata is not None and manifest.get("format") == OFFSETS_FORMAT
+        and str(manifest.get("size")) == str(metadata.get("size"))
+        and manifest.get("md5Checksum") == metadata.get("md5Checksum")
+    )
+
+# ✏️ 14-2. 年次ファイルへの書き込み後に索引を更新（書く前の版の索引が正しく、末尾に足しただけなら足した部分だけ読む）
+#          content / metadata は書く前の中身と版、updated_csv / response は書いた後
+def update_offset_manifest(service, folder_id, filename, content, metadata, updated_csv, response):
+    if not _is_year_filename(filename):
+        return None
+    base = None
+    if content and updated_csv.startswith(content):
+        base = load_offset_manifest(service, filename, folder_id)
+        if not _offsets_match(base, metadata):
+            base = None
+    with span("offsets.build"):
+        manifest = build_offset_manifest(updated_csv, base)
+    if response.get("md5Checksum") not in (None, manifest["md5Checksum"]):
+        return None
+    body = json.dumps(manifest, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    upload_file_bytes(service, get_offsets_filename(filename), folder_id, body, "application/json")
+    return manifest
+
+# 🤫 14-2-2. 索引の更新に失敗しても書き込み自体は成功扱い（読み手は食い違いを検出して全体を読む）
+def update_offset_manifest_quietly(service, folder_id, filename, content, metadata, updated_csv, response):
+    try:
+        return update_offset_manifest(service, folder_id, filename, content, metadata, updated_csv, response)
+    except Exception as e:
+        print(f"⚠️ バイト位置の索引の更新に失敗しました ({filename}):", e)
+        return None
+
+def _read_span(f, start, end):
+    f.seek(start)
+    chunks = []
+    while start < end:
+        chunk = f.read(end - start)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        start += len(chunk)
+    return b"".join(chunks)
+
+# 📐 14-3. 年次ファイルから指定した日の行だけを読む（索引が無い・古いときは None）
+#          手元のキャッシュが最新ならメモリから、無ければ必要な範囲だけを Range 指定でダウンロードする
+def read_year_file_days(service, file_id, filename, folder_id, days):
+    import pandas as pd
+    manifest = load_offset_manifest(service, filename, folder_id)
+    metadata = get_file_metadata(service, file_id)
+    if not _offsets_match(manifest, metadata):
+        return None
+
+    days = set(days)
+    spans = sorted(span for day in days for span in manifest["days"].get(day, []))
+    if not spans:
+        return apply_timecard_schema(pd.DataFrame(columns=manifest["columns"]))
+
+    merged = [list(manifest["header"])]
+    for start, end in spans:
+        if start - merged[-1][1] <= RANGE_MERGE_GAP_BYTES:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    f = open_file_for_range_reads(service, file_id, metadata)
+    with span("offsets.read"):
+        data = b"".join(_read_span(f, start, end) for start, end in merged)
+    df = read_timecard_csv(data)
+    # ✂️ まとめて読んだ範囲に入った他の日の行を落とす
+    return df[df["時刻"].dt.strftime("%Y-%m-%d").isin(days)].reset_index(drop=True)
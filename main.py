@@ -1,25 +1,36 @@
 import streamlit as st
-import requests
 import json
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from ui import (
     show_title,
     user_selector,
     punch_buttons,
     show_auth_status,
     show_punch_result,
-    show_login_link
+    show_login_link,
+    export_controls
 )
 from utils.auth_utis import (
     save_refresh_token_to_drive,
     load_refresh_token_from_drive,
     get_access_token_from_refresh_token,
-    restore_access_token_if_needed
+    restore_access_token_if_needed,
+    is_access_token_valid
 )
 from logicMod import (
-    record_punch,
-    check_file_exists
+    record_punch_async,
+    flush_punch_rows,
+    sync_punch_store,
+    is_duplicate_punch,
+    get_clocked_in_staff,
+    iter_timecard_export,
+    TimecardExportStream
 )
+from utils.outbox_utils import start_outbox_worker, pending_punch_count
+from utils.token_utils import get_http_session, expires_at_from, remember_tokens, get_shared_access_token
+from utils.timing_utils import timing_enabled, record_timing
+from utils.backend_utils import oauth_scope
 # 🧩 Step 0: セッションステート初期化
 if "code_used" not in st.session_state:
     st.session_state.code_used = False
@@ -43,133 +54,165 @@ redirect_uri = st.secrets["web"]["redirect_uri"]
 #st.write("↩️ redirect_uri:", redirect_uri)
 #st.write("📁 folder_id:", folder_id)
 
-restore_access_token_if_needed(client_id, client_secret, token_uri, folder_id)
+# ⚡ トークンが有効なら認証処理（Step 2〜5-1）はまるごと省略（期限切れのときだけ評価する）
+auth_ok = is_access_token_valid()
+auth_started = time.perf_counter()
+
+if not auth_ok:
+    restore_access_token_if_needed(client_id, client_secret, token_uri, folder_id)
 
 # 🖼️ タイトル表示
 show_title()
 
-# 🔍 Step 2: 認証コードの取得
-if "code_used" not in st.session_state:
-    st.session_state.code_used = False
-#st.write("🔍 全クエリパラメータ:", st.query_params)  # ← ここに入れる！
-query_params = st.query_params
-code = query_params.get("code")
-
-if isinstance(code, list):
-    code = code[0]
-
-#st.write("🔍 認証コード:", code)
-
-# 🚪 Step 3: 初回認証フロー（codeがある場合）
-if code and not st.session_state.code_used:
-    #st.write("🚪 Step 3: 認証コードあり → access_token を取得します")
-
-    token_data = {
-        "code": code,
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "redirect_uri": redirect_uri,
-        "grant_type": "authorization_code"
-    }
-
-    token_response = requests.post(token_uri, data=token_data)
-    #st.write("🧾 トークンレスポンス:", token_response.text)  # ← Googleのレスポンスを確認
-
-    token_json = token_response.json()
-    access_token = token_json.get("access_token")
-    refresh_token = token_json.get("refresh_token")
-
-    show_auth_status(access_token is not None, token_json)
-
-    #st.write("🔑 access_token:", access_token)
-    #st.write("🔁 refresh_token:", refresh_token)
-
-    if access_token and refresh_token:
-        save_refresh_token_to_drive(refresh_token, access_token, folder_id)
-        #st.success("✅ refresh_token を Drive に保存しました")
-        st.session_state.access_token = access_token
-        st.session_state.initial_access_token = access_token
-        st.session_state.code_used = True  # ✅ 再利用防止フラグ
-        st.success("✅ access_token をセッションに保存しました")
-
-    # ✅ 認証コードをURLから消す
-    st.markdown("""
-    <script>
-      const url = new URL(window.location);
-      url.searchParams.delete("code");
-      window.history.replaceState({}, '', url);
-    </script>
-    """, unsafe_allow_html=True)
-
-# 🔄 Step 4: 自動認証フロー（codeがない場合）
-if st.session_state.access_token is None:
-    #st.write("🔄 Step 4: code がない → 自動認証フロー開始")
-
-    try:
-        # ✅ Step 4.1: refresh_token.csv を読み込み
-        if st.session_state.initial_access_token:
-            #st.write("📥 Step 4.1: initial_access_token あり → refresh_token.csv を読み込みます")
-            saved_refresh_token = load_refresh_token_from_drive(
-                access_token=st.session_state.initial_access_token,
-                folder_id=folder_id
-            )
-            #st.write("📄 Step 4.2: refresh_token 読み込み結果:", saved_refresh_token)
-        else:
-            #st.warning("⚠️ Step 4.1: initial_access_token が未設定です")
-            saved_refresh_token = None
-
-        # ✅ Step 4.3: refresh_token があれば access_token を再取得
-        if saved_refresh_token:
-            st.write("🚀 Step 4.3: access_token を再取得します")
-            new_access_token = get_access_token_from_refresh_token(
-                refresh_token=saved_refresh_token,
-                client_id=client_id,
-                client_secret=client_secret,
-                token_uri=token_uri
-            )
-            #st.write("🔑 Step 4.4: 新しい access_token:", new_access_token)
+if not auth_ok:
+    # 🔍 Step 2: 認証コードの取得
+    if "code_used" not in st.session_state:
+        st.session_state.code_used = False
+    #st.write("🔍 全クエリパラメータ:", st.query_params)  # ← ここに入れる！
+    query_params = st.query_params
+    code = query_params.get("code")
+
+    if isinstance(code, list):
+        code = code[0]
+
+    #st.write("🔍 認証コード:", code)
+
+    # 🚪 Step 3: 初回認証フロー（codeがある場合）
+    if code and not st.session_state.code_used:
+        #st.write("🚪 Step 3: 認証コードあり → access_token を取得します")
+
+        token_data = {
+            "code": code,
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "redirect_uri": redirect_uri,
+            "grant_type": "authorization_code"
+        }
+
+        token_response = get_http_session().post(token_uri, data=token_data, timeout=30)
+        #st.write("🧾 トークンレスポンス:", token_response.text)  # ← Googleのレスポンスを確認
 
-            if new_access_token:
-                st.session_state.access_token = new_access_token
-                st.success("✅ Step 4.5: 自動ログインに成功しました")
+        token_json = token_response.json()
+        access_token = token_json.get("access_token")
+        refresh_token = token_json.get("refresh_token")
+
+        show_auth_status(access_token is not None, token_json)
+
+        #st.write("🔑 access_token:", access_token)
+        #st.write("🔁 refresh_token:", refresh_token)
+
+        if access_token and refresh_token:
+            save_refresh_token_to_drive(refresh_token, access_token, folder_id)
+            #st.success("✅ refresh_token を Drive に保存しました")
+            # 🧠 プロセス共有のトークンとして登録（他セッションは Drive を読まずに使える）
+            expires_at = expires_at_from(token_json.get("expires_in", 3600))
+            remember_tokens(refresh_token, access_token, expires_at)
+            st.session_state.access_token = access_token
+            st.session_state.expires_at = expires_at
+            st.session_state.initial_access_token = access_token
+            st.session_state.code_used = True  # ✅ 再利用防止フラグ
+            st.success("✅ access_token をセッションに保存しました")
+
+        # ✅ 認証コードをURLから消す
+        st.markdown("""
+        <script>
+          const url = new URL(window.location);
+          url.searchParams.delete("code");
+          window.history.replaceState({}, '', url);
+        </script>
+        """, unsafe_allow_html=True)
+
+    # 🔄 Step 4: 自動認証フロー（codeがない場合）
+    if st.session_state.access_token is None:
+        #st.write("🔄 Step 4: code がない → 自動認証フロー開始")
+
+        try:
+            # ✅ Step 4.1: refresh_token.csv を読み込み
+            if st.session_state.initial_access_token:
+                #st.write("📥 Step 4.1: initial_access_token あり → refresh_token.csv を読み込みます")
+                saved_refresh_token = load_refresh_token_from_drive(
+                    access_token=st.session_state.initial_access_token,
+                    folder_id=folder_id
+                )
+                #st.write("📄 Step 4.2: refresh_token 読み込み結果:", saved_refresh_token)
             else:
-                st.warning("⚠️ Step 4.4: access_token の取得に失敗しました")
-                show_login_link(client_id, redirect_uri)  # ← ここで再ログインリンク表示
-                show_auth_status(False, token_json={"error": "invalid_grant", "error_description": "Bad Request"})
-                
-        else:
-            #st.warning("⚠️ Step 4.3: refresh_token が取得できませんでした")
-            show_login_link(client_id, redirect_uri)
-
-    except Exception as e:
-        st.error("❌ Step 4.X: 自動認証に失敗しました")
-        st.write(e)
-
-        auth_url = (
-            "https://accounts.google.com/o/oauth2/v2/auth?"
-            f"client_id={client_id}&"
-            f"redirect_uri={redirect_uri}&"
-            "response_type=code&"
-            "scope=https://www.googleapis.com/auth/drive.file&"
-            "access_type=offline&"
-            "prompt=consent"
-        )
-        st.markdown(f"[🔐 Google認証を開始する]({auth_url})")
-        
-# 🔄 Step 5-1: セッション復元処理（access_token がなければ Drive から復元）
-restore_access_token_if_needed(client_id, client_secret, token_uri, folder_id)
+                #st.warning("⚠️ Step 4.1: initial_access_token が未設定です")
+                saved_refresh_token = None
+
+            # ✅ Step 4.3: refresh_token があれば access_token を再取得
+            if saved_refresh_token:
+                st.write("🚀 Step 4.3: access_token を再取得します")
+                new_access_token, new_expires_at = get_access_token_from_refresh_token(
+                    refresh_token=saved_refresh_token,
+                    client_id=client_id,
+                    client_secret=client_secret,
+                    token_uri=token_uri
+                )
+                #st.write("🔑 Step 4.4: 新しい access_token:", new_access_token)
+
+                if new_access_token:
+                    st.session_state.access_token = new_access_token
+                    st.session_state.expires_at = new_expires_at
+                    st.success("✅ Step 4.5: 自動ログインに成功しました")
+                else:
+                    st.warning("⚠️ Step 4.4: access_token の取得に失敗しました")
+                    show_login_link(client_id, redirect_uri)  # ← ここで再ログインリンク表示
+                    show_auth_status(False, token_json={"error": "invalid_grant", "error_description": "Bad Request"})
+
+            else:
+                #st.warning("⚠️ Step 4.3: refresh_token が取得できませんでした")
+                show_login_link(client_id, redirect_uri)
+
+        except Exception as e:
+            st.error("❌ Step 4.X: 自動認証に失敗しました")
+            st.write(e)
+
+            auth_url = (
+                "https://accounts.google.com/o/oauth2/v2/auth?"
+                f"client_id={client_id}&"
+                f"redirect_uri={redirect_uri}&"
+                "response_type=code&"
+                f"scope={oauth_scope()}&"
+                "access_type=offline&"
+                "prompt=consent"
+            )
+            st.markdown(f"[🔐 Google認証を開始する]({auth_url})")
+
+    # 🔄 Step 5-1: セッション復元処理（access_token がなければ Drive から復元）
+    restore_access_token_if_needed(client_id, client_secret, token_uri, folder_id)
+
+# ⏱ 認証処理（Step 2〜5-1）にかかった時間
+if not auth_ok and timing_enabled():
+    record_timing("main.auth", (time.perf_counter() - auth_started) * 1000)
+
+# 🕒 Step 5-2: 打刻UI（fragment 内の操作では打刻部分だけが再実行され、認証処理は走らない）
+@st.fragment
+def punch_section():
+    # 🧠 裏で更新された共有トークンがあればセッションにも反映
+    shared_token, shared_expires_at = get_shared_access_token()
+    if shared_token and shared_token != st.session_state.access_token:
+        st.session_state.access_token = shared_token
+        st.session_state.expires_at = shared_expires_at
 
-# 🕒 Step 5-2: access_token がある → 打刻UIを表示
-if st.session_state.access_token:
-    st.write("🕒 Step 5: access_token がある → 打刻UIを表示します")
     name = user_selector(staff_list)
     punch_in, punch_out = punch_buttons()
 
-    # 出勤処理
+    # ⌛ トークンが切れていたらアプリ全体を再実行して認証をやり直す
+    if (punch_in or punch_out) and not is_access_token_valid():
+        st.rerun()
+
+    # 🚦 直前と同じモードの打刻（二重押し）は記録しない
+    if punch_in and name and is_duplicate_punch(name, "出勤", st.session_state.access_token, folder_id):
+        st.warning(f"⚠️ {name} さんはすでに出勤済みです")
+        punch_in = False
+    if punch_out and name and is_duplicate_punch(name, "退勤", st.session_state.access_token, folder_id):
+        st.warning(f"⚠️ {name} さんはすでに退勤済みです")
+        punch_out = False
+
+    # 出勤処理（ローカルの送信待ちキューに積んで即時表示。Driveへはバックグラウンドで送信）
     if punch_in and name:
-        timestamp, success, filename = record_punch(name, "出勤", st.session_state.access_token, folder_id)
+        timestamp, success, filename = record_punch_async(name, "出勤", st.session_state.access_token, folder_id)
         show_punch_result(name, timestamp, "in" if success else "error")
-        check_file_exists(filename, st.session_state.access_token, folder_id)
         #エラーチェック
         #st.write({
         #   "folder_id": folder_id,
@@ -178,10 +221,45 @@ if st.session_state.access_token:
         #   "success": success
         #})
 
-    # 出勤処理
+    # 退勤処理
     if punch_out and name:
-        timestamp, success, filename = record_punch(name, "退勤", st.session_state.access_token, folder_id)
+        timestamp, success, filename = record_punch_async(name, "退勤", st.session_state.access_token, folder_id)
         show_punch_result(name, timestamp, "out" if success else "error")
+
+    # 👥 現在出勤中のスタッフ
+    clocked_in = get_clocked_in_staff(st.session_state.access_token, folder_id)
+    if clocked_in:
+        st.caption("👥 出勤中: " + "、".join(f"{n}（{t[11:16]}〜）" for n, t in sorted(clocked_in.items())))
+
+    pending = pending_punch_count()
+    if pending:
+        st.caption(f"📮 Drive 送信待ち: {pending} 件")
+
+# 📤 Step 5-3: 期間・スタッフを指定してCSVをダウンロード（年次ファイルを丸ごと読み込まずに該当行だけ書き出す）
+@st.fragment
+def export_section():
+    with st.expander("📤 打刻データのエクスポート"):
+        name, start_date, end_date = export_controls(staff_list)
+        if not start_date:
+            return
+        start = start_date.strftime("%Y-%m-%d")
+        end = (end_date + timedelta(days=1)).strftime("%Y-%m-%d")
+        access_token = st.session_state.access_token
+        # ⏳ ボタンが押されたときだけ Drive を読む（data に関数を渡すとクリック時に呼ばれる）
+        st.download_button(
+            "⬇️ CSVをダウンロード",
+            data=lambda: TimecardExportStream(iter_timecard_export(access_token, folder_id, start, end, name)),
+            file_name=f"timecard_{start_date:%Y%m%d}_{end_date:%Y%m%d}{'_' + name if name else ''}.csv",
+            mime="text/csv",
+            on_click="ignore"
+        )
+
+if st.session_state.access_token:
+    st.write("🕒 Step 5: access_token がある → 打刻UIを表示します")
+    # 📮 前回起動時の未送信分も含め、送信ワーカーに最新トークンを渡す
+    start_outbox_worker(flush_punch_rows, st.session_state.access_token, sync_punch_store)
+    punch_section()
+    export_section()
 else:
     st.warning("⚠️ access_token が未取得のため、打刻UIは表示されません")
     if "client_id" in st.session_state and "redirect_uri" in st.session_state:
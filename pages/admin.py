@@ -0,0 +1,66 @@
+import hmac
+import streamlit as st
+from utils.timing_utils import (
+    timing_enabled,
+    set_timing_enabled,
+    reset_timings,
+    timing_summary,
+    export_prometheus,
+    export_jsonl
+)
+from utils.retry_utils import retry_stats
+from utils.outbox_utils import outbox_status
+from utils.error_utils import error_log_stats
+from utils.store_utils import store_stats
+
+# ⏱ 管理ページ: 打刻・認証の各ステップの所要時間と、送信まわりの状況
+st.title("⏱ 処理時間（管理用）")
+
+# 🔐 st.secrets の [admin] password を入力したセッションだけ表示（未設定なら誰にも開かない）
+try:
+    admin_password = st.secrets["admin"]["password"]
+except Exception:
+    admin_password = None
+if not admin_password:
+    st.error("❌ 管理ページは無効です（secrets.toml の [admin] に password を設定してください）")
+    st.stop()
+if not st.session_state.get("admin_ok"):
+    password = st.text_input("🔑 管理者パスワード", type="password")
+    if password and hmac.compare_digest(password.encode("utf-8"), str(admin_password).encode("utf-8")):
+        st.session_state.admin_ok = True
+        st.rerun()
+    if password:
+        st.error("❌ パスワードが違います")
+    st.stop()
+
+enabled = st.toggle("計測を有効にする", value=timing_enabled())
+if enabled != timing_enabled():
+    set_timing_enabled(enabled)
+st.caption("計測はこのプロセス内の全セッション分を集計します。無効の間は記録しません。")
+
+# 📊 ステップごとの p50 / p95 / p99
+summary = timing_summary()
+if summary:
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+else:
+    st.info("まだ計測データがありません")
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.download_button("📤 Prometheus 形式", export_prometheus(), file_name="timecard_metrics.prom", mime="text/plain")
+with col2:
+    st.download_button("📤 JSON Lines", export_jsonl(), file_name="timecard_timings.jsonl", mime="application/jsonl")
+with col3:
+    if st.button("🧹 リセット"):
+        reset_timings()
+        st.rerun()
+
+# 🔁 再試行・遮断 / 📮 送信待ち / 📝 エラーログ
+st.subheader("🔁 再試行・遮断")
+st.json(retry_stats())
+st.subheader("📮 送信待ちの打刻")
+st.json(outbox_status())
+st.subheader("🗄 ローカルの打刻DB")
+st.json(store_stats())
+st.subheader("📝 エラーログ")
+st.json(error_log_stats())
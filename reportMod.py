@@ -0,0 +1,101 @@
+import pandas as pd
+
+# 📋 集計の単位（pandas の期間指定, 列名）
+HOURS_PERIODS = {
+    "daily": ("D", "日付"),
+    "weekly": ("W-SUN", "週"),
+    "monthly": ("M", "月"),
+}
+
+
+# 🔗 1. 出勤と次の退勤をペアにする（スタッフごと・時刻順）
+#       戻り値: shifts（名前, 出勤, 退勤, 勤務時間[h]）, unmatched（相手のいない打刻）, open（勤務中＝最後が出勤）
+def pair_shifts(punch_df):
+    df = punch_df[["名前", "モード", "時刻"]].copy()
+    df["時刻"] = pd.to_datetime(df["時刻"])
+    df = df.sort_values(["名前", "時刻"], kind="stable").reset_index(drop=True)
+
+    by_name = df.groupby("名前", sort=False)
+    next_mode = by_name["モード"].shift(-1)
+    next_time = by_name["時刻"].shift(-1)
+    is_last = next_mode.isna()
+
+    is_in = df["モード"] == "出勤"
+    is_pair = is_in & (next_mode == "退勤")
+    closed_by_prev = is_pair.groupby(df["名前"], sort=False).shift(1, fill_value=False)
+
+    shifts = pd.DataFrame({
+        "名前": df.loc[is_pair, "名前"],
+        "出勤": df.loc[is_pair, "時刻"],
+        "退勤": next_time[is_pair],
+    }).reset_index(drop=True)
+    shifts["勤務時間"] = (shifts["退勤"] - shifts["出勤"]).dt.total_seconds() / 3600
+
+    open_mask = is_in & is_last
+    unmatched_mask = (is_in & ~is_pair & ~open_mask) | (~is_in & ~closed_by_prev)
+    return shifts, df[unmatched_mask].reset_index(drop=True), df[open_mask].reset_index(drop=True)
+
+
+# 🧮 2. 勤務時間を日・週・月ごとに合計（勤務は出勤時刻の日付に計上）
+def summarize_hours(shifts, period="daily"):
+    freq, label = HOURS_PERIODS[period]
+    keys = shifts["出勤"].dt.to_period(freq).astype(str).rename(label)
+    totals = shifts.groupby([shifts["名前"], keys])["勤務時間"].sum()
+    return totals.reset_index()
+
+
+# 📊 3. 1年分（または任意期間）の打刻から集計一式を作る
+def build_hours_report(punch_df):
+    shifts, unmatched, open_punches = pair_shifts(punch_df)
+    report = {"shifts": shifts, "unmatched": unmatched, "open": open_punches}
+    for period in HOURS_PERIODS:
+        report[period] = summarize_hours(shifts, period)
+    return report
+
+
+def _add_totals(totals, new_totals, label):
+    combined = pd.concat([totals, new_totals], ignore_index=True)
+    return combined.groupby(["名前", label], as_index=False)["勤務時間"].sum()
+
+
+# ➕ 4. 新しい打刻だけで集計を更新（年全体を読み直さない）
+#       new_punch_df は既存の打刻より後の時刻であること（追記順に届く前提）
+def update_hours_report(report, new_punch_df):
+    pending = pd.concat([report["open"], new_punch_df], ignore_index=True)
+    shifts, unmatched, open_punches = pair_shifts(pending)
+
+    report["shifts"] = pd.concat([report["shifts"], shifts], ignore_index=True)
+    report["unmatched"] = pd.concat([report["unmatched"], unmatched], ignore_index=True)
+    report["open"] = open_punches
+    for period, (_, label) in HOURS_PERIODS.items():
+        report[period] = _add_totals(report[period], summarize_hours(shifts, period), label)
+    return report
+
+
+# 📖 5. Drive 上の1年分から集計
+def build_hours_report_for_year(access_token, year, folder_id):
+    from logicMod import load_timecard_year
+    return build_hours_report(load_timecard_year(access_token, year, folder_id))
+
+
+# 🗄 6. ローカルの打刻DB（SQLite）から期間・スタッフで絞り込んで集計（CSVの読み込み・解析なし）
+#       start / end は "YYYY-MM-DD"（end はその日を含まない）
+def build_hours_report_from_store(folder_id, start=None, end=None, name=None):
+    from utils.store_utils import query_punches
+    punch_df = pd.DataFrame(query_punches(folder_id, start, end, name), columns=["名前", "モード", "時刻"])
+    return build_hours_report(punch_df)
+
+
+# 🗓 7. Drive 上の任意期間（年をまたいでよい）から集計。締め済みの年はアーカイブの該当月だけを読む
+#       当年分は年次ファイルのバイト位置の索引で、期間内の日の範囲だけを読む
+def build_hours_report_for_period(access_token, folder_id, start, end):
+    from logicMod import load_timecard_range
+    return build_hours_report(load_timecard_range(access_token, folder_id, start, end))
+
+
+# 📆 8. day（既定は今日）を含む週（月曜〜日曜）の集計
+def build_hours_report_for_week(access_token, folder_id, day=None):
+    from datetime import date, timedelta
+    day = date.fromisoformat(day) if day else date.today()
+    monday = day - timedelta(days=day.weekday())
+    return build_hours_report_for_period(access_token, folder_id, monday.isoformat(), (monday + timedelta(days=7)).isoformat())
@@ -37,8 +37,11 @@ def show_punch_result(name, timestamp, status):
     else:
         st.error("❌ 打刻の保存に失敗しました")
 
-def show_login_link(client_id, redirect_uri, scope="https://www.googleapis.com/auth/drive.file"):
-    """Google OAuth 認証リンクの表示"""
+def show_login_link(client_id, redirect_uri, scope=None):
+    """Google OAuth 認証リンクの表示（scope を省略すると保存先に合わせる）"""
+    if scope is None:
+        from utils.backend_utils import oauth_scope
+        scope = oauth_scope()
     auth_url = (
         f"https://accounts.google.com/o/oauth2/auth"
         f"?client_id={client_id}"
@@ -68,3 +71,17 @@ def show_main_ui_if_authenticated(staff_list=None):
             show_login_link(st.session_state.client_id, st.session_state.redirect_uri)
         return None, None, None
 
+
+def export_controls(staff_list):
+    """エクスポートの条件（スタッフ・期間）の入力。期間の終了日はその日を含む"""
+    from datetime import date
+    today = date.today()
+    col1, col2 = st.columns(2)
+    with col1:
+        name = st.selectbox("スタッフ", ["（全員）"] + list(staff_list), key="export_name")
+    with col2:
+        period = st.date_input("期間", value=(today.replace(day=1), today), key="export_period")
+    if not isinstance(period, (list, tuple)) or len(period) != 2:
+        st.info("期間の開始日と終了日を選んでください")
+        return None, None, None
+    return (None if name == "（全員）" else name), period[0], period[1]
@@ -0,0 +1,92 @@
+from datetime import datetime
+from io import BytesIO
+
+# 🗜 アーカイブ（締めた年のデータ）の圧縮方式。列ごとに圧縮されるので CSV よりずっと小さくなる
+ARCHIVE_COMPRESSION = "zstd"
+# 📒 manifest の書式の版（読み方が変わったら上げる）
+MANIFEST_FORMAT = 1
+
+
+# 🧰 1. Parquet を扱えるか（pyarrow が無い環境ではアーカイブせず CSV のまま残す）
+def archive_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# 📦 2. 月ごとに1つの row group として Parquet に書く
+#       df は time_column が日時型であること。月 → sort_columns の順に並べ替えてから書く
+#       戻り値: (Parquet のバイト列, manifest)。manifest には月ごとの row group 番号と行範囲が入る
+def build_monthly_archive(df, time_column, sort_columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    months = df[time_column].dt.strftime("%Y-%m")
+    df = df.assign(_month=months).sort_values(["_month", *sort_columns], kind="stable")
+    counts = df["_month"].value_counts(sort=False).sort_index()
+    table = pa.Table.from_pandas(df.drop(columns="_month"), preserve_index=False)
+
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "rows": len(df),
+        "columns": [c for c in df.columns if c != "_month"],
+        "sorted_by": ["month", *sort_columns],
+        "compression": ARCHIVE_COMPRESSION,
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "months": {},
+    }
+    buffer = BytesIO()
+    with pq.ParquetWriter(buffer, table.schema, compression=ARCHIVE_COMPRESSION) as writer:
+        first_row = 0
+        for group, (month, rows) in enumerate(counts.items()):
+            writer.write_table(table.slice(first_row, rows), row_group_size=rows)
+            manifest["months"][month] = {"row_group": group, "first_row": first_row, "rows": int(rows)}
+            first_row += rows
+    return buffer.getvalue(), manifest
+
+
+# 🔎 3. 必要な月・列だけ読む（source はバイト列か、seek / read できるファイル）
+#       ファイルを渡せば、pyarrow は末尾のメタデータと該当する row group の列だけを読みに行く
+#       manifest が None（中身と食い違っていて使えない）なら、months は見ずに全体を読む
+def read_monthly_archive(source, manifest, months=None, columns=None):
+    import pyarrow.parquet as pq
+
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    if manifest is None:
+        return pq.ParquetFile(source).read(columns=columns).to_pandas()
+    entries = manifest["months"]
+    wanted = sorted(entries) if months is None else [m for m in sorted(set(months)) if m in entries]
+    parquet_file = pq.ParquetFile(source)
+    if not wanted:
+        return parquet_file.schema_arrow.empty_table().select(columns or manifest["columns"]).to_pandas()
+    groups = [entries[m]["row_group"] for m in wanted]
+    return parquet_file.read_row_groups(groups, columns=columns).to_pandas()
+
+
+# 🗓 4. 期間 [start, end) に含まれる月（"YYYY-MM"）。year を渡すとその年の分だけ
+def months_between(start, end, year=None):
+    months = []
+    y, m = int(start[:4]), int(start[5:7])
+    while f"{y:04d}-{m:02d}" < end[:7] or (f"{y:04d}-{m:02d}" == end[:7] and end[7:] > "-01"):
+        if year is None or y == int(year):
+            months.append(f"{y:04d}-{m:02d}")
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+
+# 🗓 5. 期間 [start, end) に含まれる日（"YYYY-MM-DD"）。year を渡すとその年の分だけ
+def days_between(start, end, year=None):
+    from datetime import date, timedelta
+    day, last = date.fromisoformat(start[:10]), date.fromisoformat(end[:10])
+    if end[10:].strip(" 0:"):
+        # 🕒 end に時刻が付いていればその日も含む
+        last += timedelta(days=1)
+    days = []
+    while day < last:
+        if year is None or day.year == int(year):
+            days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
@@ -1,72 +1,75 @@
 import streamlit as st
-import pandas as pd
-import requests
+import csv
 import json
 import base64
 from datetime import datetime
-from io import StringIO, BytesIO
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-from google.oauth2.credentials import Credentials
+from io import StringIO
+from utils.drive_utils import (
+    get_drive_service,
+    remember_file_id,
+    call_with_file_id,
+    download_file_bytes
+)
 from utils.error_utils import log_error_to_drive
+from utils.token_utils import (
+    request_access_token,
+    expires_at_from,
+    remember_tokens,
+    configure_token_manager,
+    get_shared_access_token
+)
+from utils.timing_utils import timed
 
 # 🔐 1. refresh_token を Drive に保存（上書き対応）
+@timed("auth.save_refresh_token")
 def save_refresh_token_to_drive(refresh_token, access_token, folder_id):
+    from googleapiclient.http import MediaIoBaseUpload
     try:
-        creds = Credentials(token=access_token)
-        service = build("drive", "v3", credentials=creds)
-
-        query = f"'{folder_id}' in parents and name='refresh_token.csv'"
-        results = service.files().list(q=query, fields="files(id)").execute()
-        files = results.get("files", [])
+        service = get_drive_service(access_token)
 
         # 🔐 Base64で暗号化
         encoded_token = base64.b64encode(refresh_token.encode("utf-8")).decode("utf-8")
         csv_content = f"refresh_token\n{encoded_token}"
-        media = MediaIoBaseUpload(StringIO(csv_content), mimetype="text/csv")
 
-        if files:
-            file_id = files[0]["id"]
-            service.files().update(fileId=file_id, media_body=media).execute()
-        else:
-            file_metadata = {
-                "name": "refresh_token.csv",
-                "parents": [folder_id],
-                "mimeType": "text/csv"
-            }
-            service.files().create(body=file_metadata, media_body=media, fields="id").execute()
+        def write(file_id):
+            media = MediaIoBaseUpload(StringIO(csv_content), mimetype="text/csv")
+            if file_id:
+                service.files().update(fileId=file_id, media_body=media).execute()
+            else:
+                file_metadata = {
+                    "name": "refresh_token.csv",
+                    "parents": [folder_id],
+                    "mimeType": "text/csv"
+                }
+                response = service.files().create(body=file_metadata, media_body=media, fields="id").execute()
+                remember_file_id(folder_id, "refresh_token.csv", response["id"])
+
+        call_with_file_id(service, "refresh_token.csv", folder_id, write)
     except Exception as e:
         st.error("❌ エラーをlogに保存しました")
         log_error_to_drive(str(e), access_token, "1ID1-LS6_kU5l7h1VRHR9RaAAZyUkIHIt")
 
 
 # 📥 2. Driveから refresh_token.csv を読み込む
+@timed("auth.load_refresh_token")
 def load_refresh_token_from_drive(access_token, folder_id):
     try:
-        creds = Credentials(token=access_token)
-        service = build("drive", "v3", credentials=creds)
+        service = get_drive_service(access_token)
 
-        query = f"'{folder_id}' in parents and name='refresh_token.csv'"
-        results = service.files().list(q=query, fields="files(id)").execute()
-        files = results.get("files", [])
+        def read(file_id):
+            if not file_id:
+                return None
+            # 🪶 1行だけのCSVなので pandas を使わずに読む
+            content = download_file_bytes(service, file_id).decode("utf-8-sig")
+            return next(csv.DictReader(StringIO(content)))
 
-        if not files:
+        row = call_with_file_id(service, "refresh_token.csv", folder_id, read)
+        if row is None:
             log_error_to_drive("refresh_token.csv が Drive に存在しません", access_token, folder_id)
             return None
 
-        file_id = files[0]["id"]
-        request = service.files().get_media(fileId=file_id)
-        fh = BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-        fh.seek(0)
-        
-        df = pd.read_csv(fh)
-        
         # 🔓 Base64復号処理
-        encoded_token = df["refresh_token"].iloc[0]
+        encoded_token = row["refresh_token"]
         decoded_token = base64.b64decode(encoded_token.encode("utf-8")).decode("utf-8")
         return decoded_token
         
@@ -76,25 +79,19 @@ def load_refresh_token_from_drive(access_token, folder_id):
         return None
 
 # 🔄 3. refresh_token から access_token を再取得
+@timed("auth.refresh_access_token")
 def get_access_token_from_refresh_token(refresh_token, client_id, client_secret, token_uri, folder_id=None):
     try:
-        refresh_data = {
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "refresh_token": refresh_token,
-            "grant_type": "refresh_token"
-        }
-
-        response = requests.post(token_uri, data=refresh_data)
-        response.raise_for_status()
-        token_json = response.json()
+        # 🔌 token_uri へは共有セッション（keep-alive）で接続
+        token_json = request_access_token(refresh_token, client_id, client_secret, token_uri)
 
         access_token = token_json.get("access_token")
         expires_in = token_json.get("expires_in")  # 秒数（例：3600）
 
         if access_token and expires_in:
-            from pytz import timezone
-            expires_at = datetime.now(timezone("Asia/Tokyo")) + pd.to_timedelta(expires_in, unit="s")
+            expires_at = expires_at_from(expires_in)
+            # 🧠 プロセス共有のトークンとして登録（以降は裏で自動更新）
+            remember_tokens(refresh_token, access_token, expires_at)
             return access_token, expires_at
         else:
             st.warning("⚠️ トークンレスポンスに access_token または expires_in が含まれていません")
@@ -113,6 +110,7 @@ def get_access_token_from_refresh_token(refresh_token, client_id, client_secret,
 
 
 # 4. セッション初期化時にaccess_tokenを復元する処理
+@timed("auth.restore")
 def restore_access_token_if_needed(client_id, client_secret, token_uri, folder_id):
     from pytz import timezone
     now = datetime.now(timezone("Asia/Tokyo"))
@@ -122,6 +120,15 @@ def restore_access_token_if_needed(client_id, client_secret, token_uri, folder_i
     #st.write("🧭 restore_access_token_if_needed: expires_at =", st.session_state.get("expires_at"))
     #st.write("🧭 restore_access_token_if_needed: initial_access_token =", st.session_state.get("initial_access_token"))
 
+    # 🧠 プロセス共有のトークンが有効ならそれを使う（Drive読込・トークン取得なし）
+    configure_token_manager(client_id, client_secret, token_uri)
+    shared_token, shared_expires_at = get_shared_access_token()
+    if shared_token:
+        if st.session_state.get("access_token") != shared_token:
+            st.session_state.access_token = shared_token
+            st.session_state.expires_at = shared_expires_at
+        return
+
     # ✅ トークンが未設定 or 有効期限切れなら復元を試みる
     if (
         "access_token" not in st.session_state
@@ -157,3 +164,14 @@ def restore_access_token_if_needed(client_id, client_secret, token_uri, folder_i
             log_error_to_drive("access_token の復元に失敗しました（トークン取得失敗）", "", folder_id)
     else:
         st.write("✅ access_token はまだ有効です（復元不要）")
+
+
+# ✅ 5. セッションの access_token がまだ有効か（有効なら認証処理をまるごと省略できる）
+def is_access_token_valid():
+    from pytz import timezone
+    expires_at = st.session_state.get("expires_at")
+    return (
+        bool(st.session_state.get("access_token"))
+        and expires_at is not None
+        and expires_at > datetime.now(timezone("Asia/Tokyo"))
+    )
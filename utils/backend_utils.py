@@ -0,0 +1,211 @@
+import csv
+import os
+import threading
+from io import StringIO
+from utils.sheets_utils import get_sheets_service, ensure_sheet, append_sheet_rows, read_sheet_rows
+
+try:
+    import fcntl
+except ImportError:  # Windows では他プロセスとのロックなし（同じプロセス内のロックだけ）
+    fcntl = None
+
+# 🗄 打刻の保存先（バックエンド）。st.secrets の [storage] で選ぶ
+#
+#     [storage]
+#     backend = "local"            # "drive"（既定）/ "local" / "sheets"
+#     path = "data/timecards"      # local: CSV を置くディレクトリ
+#     spreadsheet_id = "..."       # sheets: 書き込み先のスプレッドシート
+#
+# 打刻の状況（punch_status.json）・エラーログ・トークンは、どの保存先でも Drive に置く
+DEFAULT_BACKEND = "drive"
+DRIVE_SCOPE = "https://www.googleapis.com/auth/drive.file"
+LOCAL_BACKEND_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "timecards")
+
+# 🧾 行の列（logicMod.PUNCH_COLUMNS と同じ順）
+_COLUMNS = ["名前", "モード", "時刻", "打刻ID"]
+_ID_COLUMN = "打刻ID"
+
+_factories = {}  # 名前 → factory(**settings)
+_backend = None
+_backend_lock = threading.Lock()
+
+
+# 🧩 1. 保存先の共通の形。rows は _COLUMNS をキーに持つ dict のリスト（打刻IDは必ず入っていること）
+class PunchBackend:
+    name = ""
+    # 📁 Drive 上の CSV（シャード・年次ファイル）に書く保存先か（メタデータの先読み・締めの対象）
+    uses_drive_files = False
+    # 🔐 Drive（drive.file）のほかにログイン時に求める権限
+    oauth_scopes = ()
+
+    # ➕ 行を追加する。filename は送信待ちキューの振り分け単位（例: 2025_timecard_1018.csv）。失敗したら例外
+    def append_rows(self, access_token, folder_id, filename, rows):
+        raise NotImplementedError
+
+    # 📖 1年分の行（DataFrame。無ければ None）。months / columns / days は絞り込みのヒント（無視してもよい）
+    def load_year(self, access_token, folder_id, year, months=None, columns=None, days=None):
+        raise NotImplementedError
+
+    # 🔁 送信ワーカーから定期的に呼ばれる保守処理（締めなど）
+    def sync(self, access_token, folder_id):
+        pass
+
+
+def _group_by_year(rows):
+    groups = {}
+    for row in rows:
+        groups.setdefault(row["時刻"][:4], []).append(row)
+    return groups
+
+
+def _rows_to_frame(header, rows, columns):
+    import pandas as pd
+    df = pd.DataFrame([r + [""] * (len(header) - len(r)) for r in rows], columns=header)
+    df = df.reindex(columns=_COLUMNS).fillna("")
+    # 🪪 再送などで同じ打刻IDの行が重なっていたら1つにする（IDの無い行はそのまま）
+    df = df[~(df[_ID_COLUMN].duplicated() & (df[_ID_COLUMN] != ""))].reset_index(drop=True)
+    return df[columns] if columns else df
+
+
+# 💽 2. ローカルの CSV（年ごとに1ファイル）。ファイル末尾への追記なので、1打刻のコストは年の行数によらない
+#       打刻IDの索引はファイルの大きさと一緒に持ち、他のプロセスが書き足した分だけを読んで更新する
+class LocalCsvBackend(PunchBackend):
+    name = "local"
+
+    def __init__(self, path=None, **_):
+        self.root = path or LOCAL_BACKEND_PATH
+        self._indexes = {}  # ファイルのパス → (読んだバイト数, 打刻IDの集合, ID列の位置)
+        self._lock = threading.Lock()
+
+    def _path(self, folder_id, year):
+        return os.path.join(self.root, folder_id or "_", f"{year}_timecard.csv")
+
+    # 🪪 前回から書き足された部分だけを読んで索引を更新（ファイルが縮んでいたら読み直す）
+    def _index(self, path, f):
+        size = os.fstat(f.fileno()).st_size
+        known, ids, position = self._indexes.get(path, (0, set(), None))
+        if known > size:
+            known, ids, position = 0, set(), None
+        if known < size:
+            f.seek(known)
+            lines = f.read(size - known).decode("utf-8-sig").splitlines()
+            for row in csv.reader(lines):
+                if position is None:
+                    position = row.index(_ID_COLUMN) if _ID_COLUMN in row else -1
+                elif 0 <= position < len(row):
+                    ids.add(row[position])
+        self._indexes[path] = (size, ids, position)
+        return size, ids
+
+    def append_rows(self, access_token, folder_id, filename, rows):
+        for year, group in _group_by_year(rows).items():
+            path = self._path(folder_id, year)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._lock, open(path, "a+b") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                size, ids = self._index(path, f)
+                pending = {}
+                for row in group:
+                    if row[_ID_COLUMN] not in ids:
+                        pending.setdefault(row[_ID_COLUMN], row)
+                if not pending:
+                    continue
+
+                buffer = StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=_COLUMNS, lineterminator="\n", extrasaction="ignore")
+                if size == 0:
+                    writer.writeheader()
+                writer.writerows(pending.values())
+                data = buffer.getvalue().encode("utf-8")
+                f.write(data)
+                f.flush()
+                # 💾 停電でも書いた打刻を失わないように
+                os.fsync(f.fileno())
+                ids.update(pending)
+                position = _COLUMNS.index(_ID_COLUMN) if size == 0 else self._indexes[path][2]
+                self._indexes[path] = (size + len(data), ids, position)
+
+    def load_year(self, access_token, folder_id, year, months=None, columns=None, days=None):
+        path = self._path(folder_id, year)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                return None
+            return _rows_to_frame(header, list(reader), columns)
+
+
+# 📊 3. Google スプレッドシート（年ごとに1タブ）。values.append で末尾に足すので、既存の行は読まない
+#       append は「同じ行がもうあるか」を確かめられないため、再送で重なった行は読むときに打刻IDでまとめる
+#       folder_id は使わない（店舗ごとに spreadsheet_id を分ける）
+class SheetsBackend(PunchBackend):
+    name = "sheets"
+    oauth_scopes = ("https://www.googleapis.com/auth/spreadsheets",)
+
+    def __init__(self, spreadsheet_id=None, **_):
+        if not spreadsheet_id:
+            raise ValueError("保存先 sheets には [storage] の spreadsheet_id が必要です")
+        self.spreadsheet_id = spreadsheet_id
+
+    def append_rows(self, access_token, folder_id, filename, rows):
+        service = get_sheets_service(access_token)
+        for year, group in _group_by_year(rows).items():
+            # 🔢 タブの sheetId は年にする（同時に作られても同じタブになる）
+            ensure_sheet(service, self.spreadsheet_id, year, _COLUMNS, int(year))
+            append_sheet_rows(service, self.spreadsheet_id, year, [[row[c] for c in _COLUMNS] for row in group])
+
+    def load_year(self, access_token, folder_id, year, months=None, columns=None, days=None):
+        values = read_sheet_rows(get_sheets_service(access_token), self.spreadsheet_id, str(year))
+        if not values:
+            return None
+        return _rows_to_frame(values[0], values[1:], columns)
+
+
+# 🏷 4. 保存先の登録（Drive の CSV は logicMod が登録する）
+def register_backend(name, factory):
+    _factories[name] = factory
+
+
+register_backend(LocalCsvBackend.name, LocalCsvBackend)
+register_backend(SheetsBackend.name, SheetsBackend)
+
+
+# ⚙️ 5. st.secrets の [storage]（無ければ既定の Drive）
+def get_storage_settings():
+    try:
+        import streamlit as st
+        return dict(st.secrets.get("storage", {}))
+    except Exception:
+        # 🧪 secrets.toml が無い環境（ベンチマークなど）
+        return {}
+
+
+# 🔌 6. 使う保存先（プロセスで1つ。初回に設定を読んで作る）
+def get_punch_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            settings = get_storage_settings()
+            _backend = create_backend(settings.pop("backend", DEFAULT_BACKEND), **settings)
+        return _backend
+
+
+# 🔐 ログインリンクの scope（保存先が求める権限を足す。空白区切りを URL 用に %20 で）
+def oauth_scope():
+    return "%20".join([DRIVE_SCOPE, *get_punch_backend().oauth_scopes])
+
+
+def create_backend(name, **settings):
+    if name not in _factories:
+        raise ValueError(f"不明な保存先です: {name}（{' / '.join(sorted(_factories))}）")
+    return _factories[name](**settings)
+
+
+# 🔀 7. 保存先を切り替える（ベンチマークなど。None なら次回 st.secrets から選び直す）
+def use_punch_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,76 @@
+from io import BytesIO
+
+_engine = None
+
+
+# 🏎 1. CSV の解析エンジン（pyarrow があれば使う。無ければ pandas 標準の C エンジン）
+def csv_engine():
+    global _engine
+    if _engine is None:
+        try:
+            import pyarrow  # noqa: F401
+            _engine = "pyarrow"
+        except ImportError:
+            _engine = "c"
+    return _engine
+
+
+# 🧱 既存CSVに列を足す（既存の行は空欄で埋める。列数の揃わないCSVは pyarrow で読めないため）
+def _add_columns(content, columns):
+    header_suffix = ("," + ",".join(columns)).encode("utf-8")
+    row_suffix = b"," * len(columns)
+    lines = content.split(b"\n")
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        suffix = header_suffix if i == 0 else row_suffix
+        lines[i] = line[:-1] + suffix + b"\r" if line.endswith(b"\r") else line + suffix
+    return b"\n".join(lines)
+
+
+# ➕ 2. 既存CSVのバイト列の末尾に行を足す（既存部分は解析も再書き出しもしない）
+#       列は既存ファイルのヘッダー順に合わせる（rows_df にしか無い列はヘッダーに足す）。中身が空ならヘッダー付きで書く
+def append_csv_bytes(content, rows_df):
+    if not content.strip():
+        return rows_df.to_csv(index=False, lineterminator="\n").encode("utf-8")
+
+    header = content.split(b"\n", 1)[0].decode("utf-8-sig").rstrip("\r")
+    columns = header.split(",")
+    added = [column for column in rows_df.columns if column not in columns]
+    if added:
+        content = _add_columns(content, added)
+        columns += added
+    body = rows_df.reindex(columns=columns).to_csv(index=False, header=False, lineterminator="\n").encode("utf-8")
+    if not content.endswith(b"\n"):
+        content += b"\n"
+    return content + body
+
+
+# 📥 3. 値を文字列のまま読む（書き戻すときに書式を変えないため）
+def read_csv_as_text(data):
+    import pandas as pd
+    return pd.read_csv(BytesIO(data), dtype=str, keep_default_na=False)
+
+
+# 🗓 4. 行ごとのバイト位置を、日付（column 列の先頭10文字）ごとの範囲 [start, end) のリストにまとめる
+#       start バイト目（行頭であること）から末尾までを読む。連続する同じ日の行は1つの範囲になる
+def day_byte_ranges(content, column, start=0):
+    import csv
+    ranges = {}
+    position = start
+    while position < len(content):
+        end = content.find(b"\n", position)
+        end = len(content) if end < 0 else end + 1
+        line = content[position:end]
+        if line.strip():
+            fields = next(csv.reader([line.decode("utf-8")])) if b'"' in line else line.split(b",")
+            if column < len(fields):
+                day = fields[column][:10]
+                day = day.decode("utf-8") if isinstance(day, bytes) else day
+                spans = ranges.setdefault(day, [])
+                if spans and spans[-1][1] == position:
+                    spans[-1][1] = end
+                else:
+                    spans.append([position, end])
+        position = end
+    return ranges
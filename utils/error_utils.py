@@ -1,69 +1,260 @@
-import streamlit as st
-import pandas as pd
+import hashlib
+import json
+import threading
+from collections import deque
 from datetime import datetime
 from io import BytesIO
-from pytz import timezone
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-from google.oauth2.credentials import Credentials
+from utils.drive_utils import (
+    get_drive_service,
+    remember_file_id,
+    remember_file_content,
+    call_with_file_id,
+    download_file_bytes,
+    download_file_cached,
+    find_file_id,
+    get_file_metadata,
+    upload_file_bytes,
+    trash_file,
+    open_file_for_range_reads,
+    CACHE_METADATA_FIELDS
+)
+from utils.archive_utils import archive_available, build_monthly_archive, read_monthly_archive
+from utils.csv_utils import append_csv_bytes
+from utils.token_utils import get_shared_access_token
+from utils.retry_utils import is_circuit_open
 
-#エラー収集
+# 🧺 メモリ上に溜めておくエラーの上限（超えた分は捨てて件数だけ数える）
+ERROR_BUFFER_MAX = 500
+# 🚚 この件数が溜まるか、この秒数が経ったら Drive へまとめて書き込む
+ERROR_FLUSH_THRESHOLD = 20
+ERROR_FLUSH_INTERVAL_SECONDS = 10
+
+_buffer = deque()  # (folder_id, access_token, 行データ)
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher = None
+_stats = {"buffered": 0, "dropped": 0, "flushed": 0, "failed_flushes": 0, "last_error": None}
+
+
+# 📄 日別のエラーログ（例: エラーLOG_20251018.csv）。書き込みコストがログ全体の大きさに依存しない
+def get_error_log_filename(timestamp):
+    return f"エラーLOG_{timestamp[:10].replace('-', '')}.csv"
+
+
+#エラー収集（バッファに積むだけ。Driveへの書き込みは裏でまとめて行う）
 def log_error_to_drive(error_message, access_token, folder_id):
-    try:
-        creds = Credentials(token=access_token)
-        service = build("drive", "v3", credentials=creds)
-
-        filename = "エラーLOG.csv"
-        query = f"name='{filename}' and '{folder_id}' in parents and trashed=false"
-        results = service.files().list(q=query, fields="files(id, name, parents)").execute()
-        files = results.get("files", [])
-
-        # 🕒 JSTでタイムスタンプ
-        timestamp = datetime.now(timezone("Asia/Tokyo")).strftime("%Y-%m-%d %H:%M:%S")
-
-        # 🧼 エラー内容をCSV安全化（改行・カンマ対策）
-        safe_message = error_message.replace("\n", " ").replace(",", "、")
-        new_row = pd.DataFrame([{"日付（時刻）": timestamp, "エラー内容": safe_message}])
-
-        if files:
-            file_id = files[0]["id"]
-            request = service.files().get_media(fileId=file_id)
-            fh = BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-            fh.seek(0)
-
-            existing_df = pd.read_csv(fh)
-            combined_df = pd.concat([existing_df, new_row], ignore_index=True)
-        else:
-            combined_df = new_row
-
-        updated_csv = combined_df.to_csv(index=False).encode("utf-8")
+    from pytz import timezone
+    # 🕒 JSTでタイムスタンプ
+    timestamp = datetime.now(timezone("Asia/Tokyo")).strftime("%Y-%m-%d %H:%M:%S")
+
+    # 🧼 エラー内容をCSV安全化（改行・カンマ対策）
+    safe_message = str(error_message).replace("\n", " ").replace(",", "、")
+    row = {"日付（時刻）": timestamp, "エラー内容": safe_message}
+
+    with _lock:
+        if len(_buffer) >= ERROR_BUFFER_MAX:
+            # 🚫 障害時の連鎖で溢れたら新しい方を捨てる（最初の原因の方を残す）
+            _stats["dropped"] += 1
+            return
+        _buffer.append((folder_id, access_token, row))
+        _stats["buffered"] += 1
+        pending = len(_buffer)
+
+    _start_flusher()
+    if pending >= ERROR_FLUSH_THRESHOLD:
+        _wakeup.set()
+
+
+# 📝 エラーログ1ファイルへ行を追記
+#       既存のログは解析せず、バイト列の末尾に行を足すだけ
+#       書いた内容は手元にキャッシュするので、続けて書くときはダウンロードせず版の確認だけで済む（ログが伸びても一定）
+def _append_error_rows(service, filename, folder_id, new_rows):
+    import pandas as pd
+    from googleapiclient.http import MediaIoBaseUpload
+    new_df = pd.DataFrame(new_rows, columns=["日付（時刻）", "エラー内容"])
+
+    def write(file_id):
+        existing = download_file_cached(service, file_id) if file_id else b""
+        updated_csv = append_csv_bytes(existing, new_df)
         media = MediaIoBaseUpload(BytesIO(updated_csv), mimetype="text/csv")
 
-        if files:
+        if file_id:
             response = service.files().update(
                 fileId=file_id,
                 media_body=media,
-                fields="id, name, parents, webViewLink"
-            ).execute()
-        else:
-            metadata = {
-                "name": filename,
-                "parents": [folder_id],
-                "mimeType": "text/csv"
-            }
-            response = service.files().create(
-                body=metadata,
-                media_body=media,
-                fields="id, name, parents, webViewLink"
+                fields=CACHE_METADATA_FIELDS + ", webViewLink"
             ).execute()
+            remember_file_content(file_id, updated_csv, response)
+            return response
+
+        metadata = {
+            "name": filename,
+            "parents": [folder_id],
+            "mimeType": "text/csv"
+        }
+        response = service.files().create(
+            body=metadata,
+            media_body=media,
+            fields=CACHE_METADATA_FIELDS + ", webViewLink"
+        ).execute()
+        remember_file_id(folder_id, filename, response["id"])
+        remember_file_content(response["id"], updated_csv, response)
+        return response
+
+    return call_with_file_id(service, filename, folder_id, write)
+
+
+# 🚚 溜まったエラーをフォルダ・日付ごとに1回の書き込みでまとめて保存
+def flush_error_log():
+    # ⚡ Drive への接続を遮断中なら書かずに溜めておく（障害中にログ書き込みで負荷を増やさない）
+    if is_circuit_open("drive"):
+        return 0
+    with _lock:
+        entries = list(_buffer)
+        _buffer.clear()
+    if not entries:
+        return 0
+
+    groups = {}
+    for folder_id, access_token, row in entries:
+        key = (folder_id, get_error_log_filename(row["日付（時刻）"]))
+        groups.setdefault(key, {"token": None, "entries": []})
+        groups[key]["token"] = groups[key]["token"] or access_token
+        groups[key]["entries"].append((folder_id, access_token, row))
+
+    flushed = 0
+    failed = []
+    for (folder_id, filename), group in groups.items():
+        access_token = get_shared_access_token()[0] or group["token"]
+        try:
+            if not access_token:
+                raise ValueError("access_token がありません")
+            service = get_drive_service(access_token)
+            _append_error_rows(service, filename, folder_id, [row for _, _, row in group["entries"]])
+            flushed += len(group["entries"])
+        except Exception as e:
+            failed += group["entries"]
+            _stats["failed_flushes"] += 1
+            _stats["last_error"] = str(e)
+            print("❌ エラーログ保存に失敗しました:", e)
+
+    # ↩️ 書けなかった分は先頭に戻す（上限を超える分は捨てる）
+    with _lock:
+        for entry in reversed(failed):
+            if len(_buffer) >= ERROR_BUFFER_MAX:
+                _stats["dropped"] += 1
+                continue
+            _buffer.appendleft(entry)
+        _stats["flushed"] += flushed
+    return flushed
+
+
+# 📊 バッファの状況（溜まっている件数・捨てた件数など）
+def error_log_stats():
+    with _lock:
+        return dict(_stats, pending=len(_buffer))
+
+
+def _flusher_loop():
+    while True:
+        _wakeup.wait(ERROR_FLUSH_INTERVAL_SECONDS)
+        _wakeup.clear()
+        try:
+            flush_error_log()
+        except Exception as e:
+            _stats["last_error"] = str(e)
+
+
+def _start_flusher():
+    global _flusher
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flusher_loop, name="error-log-flusher", daemon=True)
+            _flusher.start()
+
+
+# 🗄 年ごとのエラーログのアーカイブ（Parquet）と manifest（月ごとの row group・行範囲）
+ERROR_LOG_COLUMNS = ["日付（時刻）", "エラー内容"]
+LEGACY_ERROR_LOG_FILENAME = "エラーLOG.csv"
+
+
+def get_error_archive_filenames(year):
+    return f"エラーLOG_{year}.parquet", f"エラーLOG_{year}.manifest.json"
+
+
+def _load_error_archive(service, year, folder_id, months=None):
+    archive_name, manifest_name = get_error_archive_filenames(year)
+    manifest_id = find_file_id(service, manifest_name, folder_id)
+    archive_id = find_file_id(service, archive_name, folder_id) if manifest_id else None
+    if not archive_id:
+        return None
+    manifest = json.loads(download_file_cached(service, manifest_id))
+    metadata = get_file_metadata(service, archive_id)
+    source = open_file_for_range_reads(service, archive_id, metadata)
+    if metadata.get("md5Checksum") == manifest.get("archive", {}).get("md5Checksum"):
+        return read_monthly_archive(source, manifest, months)
+
+    # ⚠️ アーカイブを書いた後、manifest を書く前に止まった場合などは manifest の row group 番号を使わずに全体を読み、月はここで絞る
+    df = read_monthly_archive(source, None)
+    if months is not None:
+        df = df[df["日付（時刻）"].dt.strftime("%Y-%m").isin(months)].reset_index(drop=True)
+    return df
+
+
+# 📖 指定年（と月）のアーカイブ済みエラーログ。アーカイブが無ければ None
+def read_error_archive(access_token, year, folder_id, months=None):
+    return _load_error_archive(get_drive_service(access_token), year, folder_id, months)
+
+
+# 🗜 through_year 年までの日別エラーログ（と旧形式の エラーLOG.csv）を年ごとのアーカイブへまとめ、元ファイルはゴミ箱へ
+#       既にアーカイブがある年は、その内容と合わせて重複を除いて書き直す。戻り値: 年 → 行数
+def archive_error_logs(access_token, folder_id, through_year):
+    import pandas as pd
+    if not archive_available():
+        return {}
+    service = get_drive_service(access_token)
+
+    query = f"name contains 'エラーLOG' and mimeType='text/csv' and trashed=false and '{folder_id}' in parents"
+    files, page_token = [], None
+    while True:
+        results = service.files().list(q=query, fields="nextPageToken, files(id, name)", pageToken=page_token).execute()
+        files += results.get("files", [])
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
+
+    # 📄 日別ファイルは名前の日付で、旧形式の1ファイルは中身の日付で年に振り分ける
+    sources = [
+        f for f in files
+        if f["name"] == LEGACY_ERROR_LOG_FILENAME or f["name"][len("エラーLOG_"):][:4] <= str(through_year)
+    ]
+    if not sources:
+        return {}
+    frames = [
+        pd.read_csv(BytesIO(download_file_bytes(service, f["id"])), dtype=str, keep_default_na=False)
+        for f in sources
+    ]
+    log_df = pd.concat(frames, ignore_index=True).reindex(columns=ERROR_LOG_COLUMNS)
+    log_df["日付（時刻）"] = pd.to_datetime(log_df["日付（時刻）"], format="mixed", errors="coerce")
+    log_df = log_df.dropna(subset=["日付（時刻）"])
 
-        st.success("✅ エラーログを保存しました")
-        st.write("🔗 ログファイル:", response.get("webViewLink"))
+    archived = {}
+    for year, year_df in log_df.groupby(log_df["日付（時刻）"].dt.year):
+        existing = _load_error_archive(service, year, folder_id)
+        if existing is not None:
+            year_df = pd.concat([existing, year_df], ignore_index=True)
+        year_df = year_df.drop_duplicates()
+        content, manifest = build_monthly_archive(year_df, "日付（時刻）", ["日付（時刻）"])
+        archive_name, manifest_name = get_error_archive_filenames(year)
+        # 📤 アーカイブ → manifest の順に書く（manifest には中身の md5 を入れて、食い違いを読み手が検出できるように）
+        response = upload_file_bytes(service, archive_name, folder_id, content, "application/vnd.apache.parquet")
+        checksum = hashlib.md5(content).hexdigest()
+        if response.get("md5Checksum") not in (None, checksum):
+            raise IOError(f"{archive_name} のアップロード内容が一致しません")
+        manifest["archive"] = {"name": archive_name, "md5Checksum": checksum, "size": len(content)}
+        upload_file_bytes(service, manifest_name, folder_id, json.dumps(manifest, ensure_ascii=False).encode("utf-8"), "application/json")
+        archived[int(year)] = len(year_df)
 
-    except Exception as e:
-        st.error("❌ エラーログ保存に失敗しました")
-        st.write("📋 詳細:", str(e))
+    for f in sources:
+        trash_file(service, f["id"], folder_id, f["name"])
+    return archived
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from utils.store_utils import (
+    insert_punch,
+    pending_punches,
+    pending_punch_total,
+    mark_synced,
+    migrate_jsonl_outbox
+)
+
+# 📮 打刻の送信待ち。ローカルの SQLite（utils.store_utils）に保存し、未送信の行を送信ワーカーが Drive へ送る
+# 📜 以前の JSONL 形式のキュー（残っていれば初回に SQLite へ取り込む）
+OUTBOX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "punch_outbox.jsonl")
+# ⏱ 送信ワーカーの待機間隔（失敗時はこの間隔で再試行）
+FLUSH_INTERVAL_SECONDS = 2.0
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+_state = {
+    "access_token": None,
+    "migrated": False,
+    "last_flush": None,
+    "last_error": None,
+}
+
+
+def _ensure_migrated():
+    with _lock:
+        if not _state["migrated"]:
+            migrate_jsonl_outbox(OUTBOX_PATH)
+            _state["migrated"] = True
+
+
+# 📝 1. 打刻をローカルの SQLite に保存（コミットしてから返す）
+def enqueue_punch(folder_id, filename, row):
+    _ensure_migrated()
+    seq = insert_punch(folder_id, filename, row)
+    _wakeup.set()
+    return seq
+
+
+# 📊 2. 未送信の件数（バックログの確認用）
+def pending_punch_count():
+    _ensure_migrated()
+    return pending_punch_total()
+
+
+def outbox_status():
+    return {
+        "pending": pending_punch_count(),
+        "last_flush": _state["last_flush"],
+        "last_error": _state["last_error"],
+        "worker_alive": bool(_worker and _worker.is_alive()),
+    }
+
+
+# 🚚 3. 溜まっている打刻をまとめて送信
+#       flush_func(folder_id, filename, rows, access_token) が True を返したグループだけ送信済みにする
+def flush_outbox(flush_func, access_token=None):
+    access_token = access_token or _state["access_token"]
+    if not access_token:
+        return 0
+
+    _ensure_migrated()
+    entries = pending_punches()
+    if not entries:
+        return 0
+
+    groups = {}
+    for entry in entries:
+        groups.setdefault((entry["folder_id"], entry["filename"]), []).append(entry)
+
+    flushed = set()
+    for (folder_id, filename), group in groups.items():
+        try:
+            ok = flush_func(folder_id, filename, [e["row"] for e in group], access_token)
+        except Exception as e:
+            ok = False
+            _state["last_error"] = str(e)
+        if ok:
+            flushed.update(e["seq"] for e in group)
+
+    mark_synced(flushed)
+
+    if flushed:
+        _state["last_flush"] = time.time()
+    return len(flushed)
+
+
+def _worker_loop(flush_func, after_flush=None):
+    while True:
+        _wakeup.wait(FLUSH_INTERVAL_SECONDS)
+        _wakeup.clear()
+        try:
+            flush_outbox(flush_func)
+            # 🔎 送信済みの書き込みの事後確認など（after_flush(access_token)）
+            if after_flush and _state["access_token"]:
+                after_flush(_state["access_token"])
+        except Exception as e:
+            _state["last_error"] = str(e)
+
+
+# 🧵 4. 送信ワーカーを起動（プロセスで1つ。再実行のたびに最新トークンを渡す）
+def start_outbox_worker(flush_func, access_token, after_flush=None):
+    global _worker
+    _state["access_token"] = access_token
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, args=(flush_func, after_flush), name="punch-outbox", daemon=True)
+            _worker.start()
+    _wakeup.set()
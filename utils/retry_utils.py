@@ -0,0 +1,238 @@
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from collections import Counter
+
+# 🔁 一時的なエラーとみなすHTTPステータス（429 と 5xx）
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 32
+# ⏱ Retry-After がこれより長ければ待たずに諦める（画面を長く止めないため）
+MAX_RETRY_AFTER_SECONDS = 60
+
+# 🪣 プロセス全体のリクエスト予算（トークンバケット）。使い切ったら少し待ち、それでも無ければ諦める
+REQUEST_BUDGET_PER_MINUTE = 600
+REQUEST_BUDGET_BURST = 60
+BUDGET_WAIT_SECONDS = 5
+# 🧪 False なら予算を数えない（ベンチの Drive 代替が install 中だけ切る。待ち時間を計測に混ぜない）
+REQUEST_BUDGET_ENABLED = True
+
+# 🆕 作成（POST）は、Drive に届いた後の失敗で送り直すと同じファイルがもう1つできる
+#    届いていないと分かる失敗（429・接続できなかった）だけ再試行し、それ以外はそのまま呼び出し側へ返す
+#    （呼び出し側は作成後に同名ファイルを確かめる: drive_utils.settle_created_file / verify_recent_writes）
+CREATE_RETRY_STATUSES = {429}
+
+# ⚡ 連続でこの回数失敗したら遮断し、しばらく相手にリクエストを送らない
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_OPEN_SECONDS = 30
+
+_lock = threading.Lock()
+_counters = Counter()
+_budget = {"tokens": float(REQUEST_BUDGET_BURST), "updated": time.monotonic()}
+_breakers = {}  # 相手（"drive" / "token"）→ {"failures", "opened_at", "probing"}
+
+
+class CircuitOpenError(Exception):
+    """遮断中のため送らなかった"""
+
+
+class RequestBudgetExceeded(Exception):
+    """リクエスト予算を使い切った"""
+
+
+class RetryableStatusError(Exception):
+    """再試行しても 429 / 5xx のままだった"""
+
+    def __init__(self, status, message=""):
+        super().__init__(f"HTTP {status} {message}".strip())
+        self.status = status
+
+
+# 📊 1. カウンタ（再試行・スロットル・遮断など）
+def retry_stats():
+    with _lock:
+        stats = dict(_counters)
+        stats["breakers"] = {
+            target: ("open" if _is_open_locked(state, time.monotonic()) else "closed")
+            for target, state in _breakers.items()
+        }
+        stats["budget_tokens"] = round(_budget["tokens"], 1)
+    return stats
+
+
+def reset_retry_state():
+    with _lock:
+        _counters.clear()
+        _breakers.clear()
+        _budget.update(tokens=float(REQUEST_BUDGET_BURST), updated=time.monotonic())
+
+
+# 🪣 2. リクエスト予算
+def _take_budget():
+    if not REQUEST_BUDGET_ENABLED:
+        return
+    deadline = time.monotonic() + BUDGET_WAIT_SECONDS
+    waited = False
+    while True:
+        with _lock:
+            now = time.monotonic()
+            refill = (now - _budget["updated"]) * REQUEST_BUDGET_PER_MINUTE / 60
+            _budget["tokens"] = min(_budget["tokens"] + refill, REQUEST_BUDGET_BURST)
+            _budget["updated"] = now
+            if _budget["tokens"] >= 1:
+                _budget["tokens"] -= 1
+                if waited:
+                    _counters["budget_waits"] += 1
+                return
+            if now >= deadline:
+                _counters["budget_rejections"] += 1
+                raise RequestBudgetExceeded("リクエスト予算を使い切りました。少し待ってから再試行してください")
+            wait = (1 - _budget["tokens"]) * 60 / REQUEST_BUDGET_PER_MINUTE
+        waited = True
+        time.sleep(min(wait, max(deadline - time.monotonic(), 0.01)))
+
+
+# ⚡ 3. サーキットブレーカー（遮断 → 一定時間後に1件だけ試す → 成功で復帰）
+def _is_open_locked(state, now):
+    return state["opened_at"] is not None and now - state["opened_at"] < BREAKER_OPEN_SECONDS
+
+
+def is_circuit_open(target):
+    with _lock:
+        state = _breakers.get(target)
+        return bool(state) and _is_open_locked(state, time.monotonic())
+
+
+def _before_request(target):
+    with _lock:
+        state = _breakers.setdefault(target, {"failures": 0, "opened_at": None, "probing": False})
+        if state["opened_at"] is None:
+            return
+        if _is_open_locked(state, time.monotonic()) or state["probing"]:
+            _counters["breaker_rejections"] += 1
+            raise CircuitOpenError(f"{target} への接続を一時的に止めています（連続失敗のため）")
+        state["probing"] = True
+
+
+def _record_result(target, ok):
+    with _lock:
+        state = _breakers[target]
+        state["probing"] = False
+        if ok:
+            state["failures"] = 0
+            state["opened_at"] = None
+            return
+        state["failures"] += 1
+        if state["failures"] >= BREAKER_FAILURE_THRESHOLD:
+            if state["opened_at"] is None or not _is_open_locked(state, time.monotonic()):
+                _counters["breaker_trips"] += 1
+            state["opened_at"] = time.monotonic()
+
+
+# ⏳ 4. 待ち時間（Retry-After があればそれに従い、無ければ指数バックオフ＋フルジッター）
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        from email.utils import parsedate_to_datetime
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+# 🔁 5. 共通の実行ループ
+#       send() は (status, retry_after, 結果) を返す。status が None なら通信エラー（例外は送出）
+#       retry_statuses / retry_errors で再試行する失敗を絞れる（それ以外は遮断の判定にだけ数えて、すぐ返す）
+def call_with_retry(target, send, max_retries=MAX_RETRIES, transient_errors=(OSError,),
+                    retry_statuses=RETRY_STATUSES, retry_errors=None):
+    retry_errors = transient_errors if retry_errors is None else retry_errors
+    for attempt in range(max_retries + 1):
+        _before_request(target)
+        _take_budget()
+        with _lock:
+            _counters[f"{target}_requests"] += 1
+
+        try:
+            status, retry_after, result = send()
+        except transient_errors as e:
+            _record_result(target, ok=False)
+            if attempt == max_retries or not isinstance(e, retry_errors):
+                with _lock:
+                    _counters["give_ups" if attempt == max_retries else "not_retried"] += 1
+                raise
+            status, retry_after, result = None, None, None
+        else:
+            if status not in RETRY_STATUSES:
+                _record_result(target, ok=True)
+                return result
+            _record_result(target, ok=False)
+            with _lock:
+                if status == 429:
+                    _counters["throttles"] += 1
+            if attempt == max_retries or status not in retry_statuses:
+                with _lock:
+                    _counters["give_ups" if attempt == max_retries else "not_retried"] += 1
+                return result
+
+        delay = backoff_delay(attempt, retry_after)
+        if delay > MAX_RETRY_AFTER_SECONDS:
+            with _lock:
+                _counters["give_ups"] += 1
+            raise RetryableStatusError(status, f"Retry-After {delay:.0f}s は長すぎるため中止しました")
+        with _lock:
+            _counters["retries"] += 1
+        time.sleep(delay)
+
+
+# 🆕 バッチ以外の POST（files().create・Sheets の values.append など）は送り直すと二重になる
+def _is_create(uri, method):
+    return method == "POST" and not urllib.parse.urlparse(uri).path.startswith("/batch")
+
+
+# 🌐 6. httplib2.Http 互換のラッパー（Drive の全リクエスト・バッチ・ダウンロードがここを通る）
+class RetryingHttp:
+    def __init__(self, http, target="drive"):
+        self.http = http
+        self.target = target
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        import httplib2
+
+        def send():
+            resp, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+            retry_after = _parse_retry_after(resp.get("retry-after"))
+            return resp.status, retry_after, (resp, content)
+
+        transient_errors = (OSError, httplib2.HttpLib2Error)
+        if _is_create(uri, method):
+            return call_with_retry(
+                self.target, send, transient_errors=transient_errors, retry_statuses=CREATE_RETRY_STATUSES,
+                retry_errors=(ConnectionRefusedError, socket.gaierror, httplib2.ServerNotFoundError)
+            )
+        return call_with_retry(self.target, send, transient_errors=transient_errors)
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+# 🔑 7. requests のレスポンスを返す呼び出し（トークンエンドポイント用）
+def request_with_retry(target, func):
+    import requests
+
+    def send():
+        response = func()
+        return response.status_code, _parse_retry_after(response.headers.get("Retry-After")), response
+
+    return call_with_retry(target, send, transient_errors=(requests.ConnectionError, requests.Timeout))
@@ -0,0 +1,85 @@
+import threading
+from utils.drive_utils import build_google_service
+
+# 📊 Google スプレッドシート（Sheets API v4）の読み書き。打刻の保存先「sheets」で使う
+# ⚡ googleapiclient は初回に使うときに読み込む（drive_utils と同じ）
+
+# 🧺 同時に保持するトークン数の上限（古いものから破棄）
+MAX_CACHED_SERVICES = 8
+
+_services = {}      # access_token → service
+_sheet_titles = {}  # spreadsheet_id → タブ名の集合
+_lock = threading.Lock()
+
+
+# 🏭 1. access_token ごとに Sheets クライアントを共有
+def get_sheets_service(access_token):
+    with _lock:
+        service = _services.get(access_token)
+    if service is None:
+        service = build_google_service("sheets", "v4", access_token)
+        with _lock:
+            _services[access_token] = service
+            while len(_services) > MAX_CACHED_SERVICES:
+                _services.pop(next(iter(_services)))
+    return service
+
+
+def clear_sheets_services():
+    with _lock:
+        _services.clear()
+        _sheet_titles.clear()
+
+
+def _quote(title):
+    return "'" + title.replace("'", "''") + "'"
+
+
+# 🗂 2. タブ名の一覧（プロセス内にキャッシュ。refresh=True で取り直す）
+def list_sheet_titles(service, spreadsheet_id, refresh=False):
+    with _lock:
+        titles = _sheet_titles.get(spreadsheet_id)
+    if titles is None or refresh:
+        response = service.spreadsheets().get(spreadsheetId=spreadsheet_id, fields="sheets.properties.title").execute()
+        titles = {s["properties"]["title"] for s in response.get("sheets", [])}
+        with _lock:
+            _sheet_titles[spreadsheet_id] = titles
+    return titles
+
+
+# ➕ 3. タブが無ければ作る。作成とヘッダー行の書き込みは1回の batchUpdate（途中の状態を他の端末に見せない）
+#       同時に別の端末が作っていたら、そちらを使う
+def ensure_sheet(service, spreadsheet_id, title, header, sheet_id):
+    from googleapiclient.errors import HttpError
+    if title in list_sheet_titles(service, spreadsheet_id) or title in list_sheet_titles(service, spreadsheet_id, refresh=True):
+        return
+    header_row = {"values": [{"userEnteredValue": {"stringValue": str(h)}} for h in header]}
+    try:
+        service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": [
+            {"addSheet": {"properties": {"title": title, "sheetId": sheet_id}}},
+            {"appendCells": {"sheetId": sheet_id, "rows": [header_row], "fields": "userEnteredValue"}},
+        ]}).execute()
+    except HttpError as e:
+        if e.resp.status != 400 or title not in list_sheet_titles(service, spreadsheet_id, refresh=True):
+            raise
+    with _lock:
+        _sheet_titles.setdefault(spreadsheet_id, set()).add(title)
+
+
+# 📤 4. 行を末尾に追加（values.append。既存の行は読まないので、行数によらず1回の通信で済む）
+def append_sheet_rows(service, spreadsheet_id, title, values):
+    return service.spreadsheets().values().append(
+        spreadsheetId=spreadsheet_id,
+        range=f"{_quote(title)}!A1",
+        valueInputOption="RAW",
+        insertDataOption="INSERT_ROWS",
+        body={"values": values}
+    ).execute()
+
+
+# 📥 5. タブの全行（1行目はヘッダー）。タブが無ければ None
+def read_sheet_rows(service, spreadsheet_id, title):
+    if title not in list_sheet_titles(service, spreadsheet_id) and title not in list_sheet_titles(service, spreadsheet_id, refresh=True):
+        return None
+    response = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=_quote(title)).execute()
+    return response.get("values", [])
@@ -0,0 +1,240 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+# 🗄 打刻のローカル保存先（SQLite / WAL）。打刻はまずここに入り、送信ワーカーが Drive へ同期する
+STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "timecard.sqlite3")
+# ⏳ 他のスレッド・プロセスが書き込み中のときに待つ秒数
+BUSY_TIMEOUT_SECONDS = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS punches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    folder_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    punched_at TEXT NOT NULL,
+    punch_id TEXT,
+    synced INTEGER NOT NULL DEFAULT 0,
+    source TEXT NOT NULL DEFAULT 'local',
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_punches_name_time ON punches(folder_id, name, punched_at);
+CREATE INDEX IF NOT EXISTS idx_punches_time ON punches(folder_id, punched_at);
+CREATE INDEX IF NOT EXISTS idx_punches_pending ON punches(id) WHERE synced = 0;
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# 🪪 打刻IDの一意インデックス（同じ打刻を再送・再取込しても1行にしかならない）。ID の無い古い行は NULL のまま
+_PUNCH_ID_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS idx_punches_punch_id ON punches(punch_id)"
+
+_thread_local = threading.local()
+
+
+# 🔌 1. スレッドごとの接続（sqlite3 の接続はスレッド間で共有しない）
+def _connect():
+    conn = getattr(_thread_local, "conn", None)
+    if conn is not None and getattr(_thread_local, "path", None) == STORE_PATH:
+        return conn
+
+    os.makedirs(os.path.dirname(STORE_PATH), exist_ok=True)
+    conn = sqlite3.connect(STORE_PATH, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # 💾 停電でも確定済みの打刻を失わないよう、コミットごとに同期する
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.executescript(_SCHEMA)
+    # 🧓 打刻ID列が無い古いDBには列を足す
+    if "punch_id" not in {column[1] for column in conn.execute("PRAGMA table_info(punches)")}:
+        conn.execute("ALTER TABLE punches ADD COLUMN punch_id TEXT")
+    conn.execute(_PUNCH_ID_INDEX)
+    _thread_local.conn, _thread_local.path = conn, STORE_PATH
+    return conn
+
+
+class _transaction:
+    def __enter__(self):
+        self.conn = _connect()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+
+def _to_row(name, mode, punched_at, punch_id=None):
+    return {"名前": name, "モード": mode, "時刻": punched_at, "打刻ID": punch_id or ""}
+
+
+# 📝 2. 打刻を保存（未送信として）。同じ打刻IDが既にあれば何もしない（戻り値は None）
+def insert_punch(folder_id, filename, row):
+    with _transaction() as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO punches (folder_id, filename, name, mode, punched_at, punch_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (folder_id, filename, row["名前"], row["モード"], row["時刻"], row.get("打刻ID") or None, time.time())
+        )
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+# 📮 3. 未送信の打刻（送信ワーカー用。{"seq", "folder_id", "filename", "row"} の古い順）
+def pending_punches():
+    rows = _connect().execute(
+        "SELECT id, folder_id, filename, name, mode, punched_at, punch_id FROM punches WHERE synced = 0 ORDER BY id"
+    ).fetchall()
+    return [
+        {"seq": seq, "folder_id": folder_id, "filename": filename, "row": _to_row(*row)}
+        for seq, folder_id, filename, *row in rows
+    ]
+
+
+def pending_punch_total():
+    return _connect().execute("SELECT COUNT(*) FROM punches WHERE synced = 0").fetchone()[0]
+
+
+def mark_synced(ids):
+    ids = list(ids)
+    if not ids:
+        return
+    with _transaction() as conn:
+        conn.executemany("UPDATE punches SET synced = 1 WHERE id = ?", [(i,) for i in ids])
+
+
+# 🔄 4. Drive 側の内容に合わせる（送信済みの行は Drive が正。未送信の行はそのまま残す）
+#       rows: Drive 上のその年の全打刻（名前・モード・時刻・打刻ID）。戻り値は (追加件数, 削除件数)
+#       打刻IDが同じ行どうしを先に対応づけ、IDの無い古い行だけ 名前・モード・時刻 で突き合わせる
+def replace_synced_punches(folder_id, year, rows, filename_for=None):
+    start, end = f"{year}-01-01", f"{int(year) + 1}-01-01"
+    drive_by_id = {r["打刻ID"]: r for r in rows}
+
+    with _transaction() as conn:
+        local = conn.execute(
+            "SELECT id, name, mode, punched_at, punch_id, synced FROM punches "
+            "WHERE folder_id = ? AND punched_at >= ? AND punched_at < ? ORDER BY id",
+            (folder_id, start, end)
+        ).fetchall()
+
+        removed, confirmed, updated, labelled, unmatched = [], [], [], [], []
+        for row_id, name, mode, punched_at, punch_id, synced in local:
+            drive_row = drive_by_id.pop(punch_id, None) if punch_id else None
+            if drive_row is None:
+                unmatched.append((row_id, name, mode, punched_at, synced))
+                continue
+            if not synced:
+                confirmed.append((row_id,))
+            if (drive_row["名前"], drive_row["モード"], drive_row["時刻"]) != (name, mode, punched_at):
+                # ✏️ Drive 側で名前・時刻などが直された行
+                updated.append((drive_row["名前"], drive_row["モード"], drive_row["時刻"], row_id))
+
+        remaining = Counter((r["名前"], r["モード"], r["時刻"]) for r in drive_by_id.values())
+        ids_by_key = {}
+        for punch_id, r in drive_by_id.items():
+            ids_by_key.setdefault((r["名前"], r["モード"], r["時刻"]), []).append(punch_id)
+        for row_id, name, mode, punched_at, synced in unmatched:
+            key = (name, mode, punched_at)
+            if remaining[key] > 0:
+                remaining[key] -= 1
+                # 🪪 IDの無い古い行には Drive 側のIDを付ける
+                labelled.append((ids_by_key[key].pop(), row_id))
+                if not synced:
+                    # ✅ 送信後に記録が落ちていた行（Drive には既にある）
+                    confirmed.append((row_id,))
+            elif synced:
+                # 🗑 Drive 側で削除・修正された行
+                removed.append((row_id,))
+
+        added = [
+            (folder_id, filename_for(key[2]) if filename_for else "", key[0], key[1], key[2], punch_id, time.time())
+            for key, ids in ids_by_key.items() for punch_id in ids[:remaining[key]]
+        ]
+        conn.executemany("DELETE FROM punches WHERE id = ?", removed)
+        conn.executemany("UPDATE punches SET synced = 1 WHERE id = ?", confirmed)
+        conn.executemany("UPDATE punches SET name = ?, mode = ?, punched_at = ? WHERE id = ?", updated)
+        conn.executemany("UPDATE OR IGNORE punches SET punch_id = ? WHERE id = ?", labelled)
+        conn.executemany(
+            "INSERT OR IGNORE INTO punches (folder_id, filename, name, mode, punched_at, punch_id, synced, source, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, 1, 'drive', ?)",
+            added
+        )
+    return len(added), len(removed)
+
+
+# 🔍 5. 期間・スタッフで絞り込み（インデックスを使う）
+def query_punches(folder_id, start=None, end=None, name=None):
+    sql = "SELECT name, mode, punched_at, punch_id FROM punches WHERE folder_id = ?"
+    params = [folder_id]
+    if name:
+        sql += " AND name = ?"
+        params.append(name)
+    if start:
+        sql += " AND punched_at >= ?"
+        params.append(start)
+    if end:
+        sql += " AND punched_at < ?"
+        params.append(end)
+    sql += " ORDER BY punched_at, id"
+    return [_to_row(*row) for row in _connect().execute(sql, params)]
+
+
+# 🚦 6. スタッフごとの最新の打刻（名前 → {"モード", "時刻"}）
+def latest_punches(folder_id):
+    rows = _connect().execute(
+        "SELECT name, mode, MAX(punched_at) FROM punches WHERE folder_id = ? GROUP BY name", (folder_id,)
+    ).fetchall()
+    return {name: {"モード": mode, "時刻": punched_at} for name, mode, punched_at in rows}
+
+
+def known_folders():
+    return [row[0] for row in _connect().execute("SELECT DISTINCT folder_id FROM punches")]
+
+
+# 🧷 7. 同期の状態（最終同期時刻など）
+def get_sync_state(key, default=None):
+    row = _connect().execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+def set_sync_state(key, value):
+    with _transaction() as conn:
+        conn.execute(
+            "INSERT INTO sync_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, ensure_ascii=False))
+        )
+
+
+# 🚚 8. 旧形式の送信待ちキュー（JSONL）を取り込む（1回だけ。取り込んだファイルは .migrated に改名）
+def migrate_jsonl_outbox(path):
+    if not os.path.exists(path):
+        return 0
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    with _transaction() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO punches (folder_id, filename, name, mode, punched_at, punch_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (e["folder_id"], e["filename"], e["row"]["名前"], e["row"]["モード"], e["row"]["時刻"],
+                 e["row"].get("打刻ID") or None, time.time())
+                for e in entries
+            ]
+        )
+    os.replace(path, path + ".migrated")
+    return len(entries)
+
+
+def store_stats():
+    conn = _connect()
+    total, pending = conn.execute("SELECT COUNT(*), COALESCE(SUM(synced = 0), 0) FROM punches").fetchone()
+    return {"path": STORE_PATH, "punches": total, "pending": pending, "last_reconcile": get_sync_state("last_reconcile")}
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+# ⏱ 計測の有効・無効（既定は無効。環境変数 TIMECARD_TIMING=1 か管理ページで有効にする）
+_enabled = os.environ.get("TIMECARD_TIMING", "") not in ("", "0", "false")
+
+# 🪣 ヒストグラムの区切り（ミリ秒）。Prometheus の le ラベルにもそのまま使う
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+# 🧺 パーセンタイル計算用に残す直近のサンプル数（ステップごと）
+SAMPLES_PER_STEP = 1024
+
+_lock = threading.Lock()
+_steps = {}  # ステップ名 → {"count", "sum", "max", "buckets", "samples"}
+
+
+def timing_enabled():
+    return _enabled
+
+
+def set_timing_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def reset_timings():
+    with _lock:
+        _steps.clear()
+
+
+# 📝 1. 1回分の所要時間を記録
+def record_timing(name, elapsed_ms):
+    with _lock:
+        step = _steps.get(name)
+        if step is None:
+            step = _steps[name] = {
+                "count": 0, "sum": 0.0, "max": 0.0,
+                "buckets": [0] * (len(BUCKETS_MS) + 1),
+                "samples": deque(maxlen=SAMPLES_PER_STEP),
+            }
+        step["count"] += 1
+        step["sum"] += elapsed_ms
+        step["max"] = max(step["max"], elapsed_ms)
+        step["samples"].append(elapsed_ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                step["buckets"][i] += 1
+                break
+        else:
+            step["buckets"][-1] += 1
+
+
+# 📏 2. 計測区間（無効なら何もしない）
+@contextmanager
+def _timed_span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, (time.perf_counter() - start) * 1000)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name):
+    if not _enabled:
+        return _NULL_SPAN
+    return _timed_span(name)
+
+
+def timed(name):
+    """関数全体を1つの区間として計測するデコレータ"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _timed_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# 📊 3. 集計（ステップごとの件数・平均・p50/p95/p99・最大）
+def _percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def timing_summary():
+    with _lock:
+        steps = {name: (dict(step), sorted(step["samples"])) for name, step in _steps.items()}
+    summary = []
+    for name, (step, ordered) in sorted(steps.items()):
+        summary.append({
+            "step": name,
+            "count": step["count"],
+            "mean_ms": round(step["sum"] / step["count"], 3),
+            "p50_ms": round(_percentile(ordered, 50), 3),
+            "p95_ms": round(_percentile(ordered, 95), 3),
+            "p99_ms": round(_percentile(ordered, 99), 3),
+            "max_ms": round(step["max"], 3),
+        })
+    return summary
+
+
+# 📤 4. Prometheus テキスト形式
+def export_prometheus():
+    metric = "timecard_step_duration_seconds"
+    lines = [
+        f"# HELP {metric} Time spent in each step of the punch and auth paths.",
+        f"# TYPE {metric} histogram",
+    ]
+    with _lock:
+        steps = {name: (step["count"], step["sum"], list(step["buckets"])) for name, step in _steps.items()}
+    for name, (count, total_ms, buckets) in sorted(steps.items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS_MS, buckets):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{step="{name}",le="{bound / 1000:g}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{step="{name}",le="+Inf"}} {count}')
+        lines.append(f'{metric}_sum{{step="{name}"}} {total_ms / 1000:.6f}')
+        lines.append(f'{metric}_count{{step="{name}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+# 📤 5. JSON Lines（1ステップ1行。path を渡せば追記もする）
+def export_jsonl(path=None):
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    text = "".join(
+        json.dumps(dict(row, timestamp=timestamp), ensure_ascii=False) + "\n" for row in timing_summary()
+    )
+    if path:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+    return text
@@ -0,0 +1,143 @@
+import threading
+from datetime import datetime, timedelta
+from utils.drive_utils import get_drive_service, evict_drive_service
+from utils.retry_utils import request_with_retry
+
+# ⏳ 有効期限の何秒前に裏で更新するか
+REFRESH_MARGIN_SECONDS = 5 * 60
+# 🔁 更新に失敗したときの再試行間隔
+REFRESH_RETRY_SECONDS = 30
+
+_http_session = None
+_lock = threading.Lock()
+_refresh_now = threading.Event()
+_refresher = None
+_state = {
+    "client": None,          # (client_id, client_secret, token_uri)
+    "refresh_token": None,   # 復号済み
+    "access_token": None,
+    "expires_at": None,      # Asia/Tokyo の aware datetime
+    "last_error": None,
+}
+
+
+# 🔌 1. token_uri 向けの keep-alive 付き共有セッション
+def get_http_session():
+    global _http_session
+    if _http_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        _http_session = session
+    return _http_session
+
+
+# 🔄 2. refresh_token で access_token を取得（画面表示なし。失敗時は例外）
+def request_access_token(refresh_token, client_id, client_secret, token_uri):
+    refresh_data = {
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "refresh_token": refresh_token,
+        "grant_type": "refresh_token"
+    }
+    response = request_with_retry(
+        "token", lambda: get_http_session().post(token_uri, data=refresh_data, timeout=30)
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+# 🕒 JST の現在時刻（pytz は使うときに読み込む。起動を遅くしないため）
+def _now_jst():
+    from pytz import timezone
+    return datetime.now(timezone("Asia/Tokyo"))
+
+
+def expires_at_from(expires_in):
+    return _now_jst() + timedelta(seconds=int(expires_in))
+
+
+# 🧠 3. プロセス共有のトークン状態を登録（全セッションで使い回す）
+def configure_token_manager(client_id, client_secret, token_uri):
+    with _lock:
+        _state["client"] = (client_id, client_secret, token_uri)
+
+
+def remember_tokens(refresh_token=None, access_token=None, expires_at=None):
+    with _lock:
+        old_token = _state["access_token"]
+        if refresh_token:
+            _state["refresh_token"] = refresh_token
+        if access_token:
+            _state["access_token"] = access_token
+            _state["expires_at"] = expires_at
+
+    # 🔁 旧トークンのDriveクライアントを破棄し、新トークンは有効期限付きで登録
+    if access_token and old_token and old_token != access_token:
+        evict_drive_service(old_token)
+    if access_token:
+        get_drive_service(access_token, expires_at)
+    _start_refresher()
+
+
+# ✅ 4. まだ有効な共有トークン（なければ None, None）
+def get_shared_access_token():
+    with _lock:
+        access_token, expires_at = _state["access_token"], _state["expires_at"]
+    if access_token and expires_at and expires_at > _now_jst():
+        return access_token, expires_at
+    return None, None
+
+
+def has_shared_refresh_token():
+    with _lock:
+        return _state["refresh_token"] is not None
+
+
+# 🔄 5. 共有トークンを今すぐ更新（裏のスレッドから呼ばれる）
+def refresh_shared_access_token():
+    with _lock:
+        client, refresh_token = _state["client"], _state["refresh_token"]
+    if not client or not refresh_token:
+        return None
+
+    token_json = request_access_token(refresh_token, *client)
+    access_token = token_json.get("access_token")
+    expires_in = token_json.get("expires_in")
+    if not access_token or not expires_in:
+        raise ValueError(f"トークンレスポンスに access_token または expires_in が含まれていません: {token_json}")
+
+    remember_tokens(access_token=access_token, expires_at=expires_at_from(expires_in))
+    return access_token
+
+
+def _refresher_loop():
+    while True:
+        with _lock:
+            expires_at = _state["expires_at"]
+        if expires_at is None:
+            wait = REFRESH_RETRY_SECONDS
+        else:
+            remaining = (expires_at - _now_jst()).total_seconds()
+            wait = max(remaining - REFRESH_MARGIN_SECONDS, 0)
+
+        if _refresh_now.wait(wait):
+            _refresh_now.clear()
+        try:
+            refresh_shared_access_token()
+            _state["last_error"] = None
+        except Exception as e:
+            _state["last_error"] = str(e)
+            _refresh_now.wait(REFRESH_RETRY_SECONDS)
+
+
+# 🧵 6. 期限前に裏で更新するスレッド（プロセスで1つ）
+def _start_refresher():
+    global _refresher
+    with _lock:
+        if _state["refresh_token"] is None:
+            return
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_refresher_loop, name="token-refresher", daemon=True)
+            _refresher.start()